@@ -1,5 +1,22 @@
 # auth.py
+# JWT login and the current-user dependencies. Tokens carry the user's id and
+# role as signed claims, and authenticated users are cached in-process (see
+# PrincipalCache), so most requests never touch the users table.
+#
+# Revocation is per-process and only takes full effect after
+# PRINCIPAL_CACHE_TTL: invalidate_user() stops trusting a user's token claims
+# and drops their cached row in the calling process only, while every other
+# worker keeps serving the old id/role until its claims and cache entries age
+# out. Any code that changes a users row (signup today; role changes or
+# deletions when they are added) must call invalidate_user() after its commit.
+# Rows changed directly in the database rely on the TTL alone.
 import os
+import logging
+import time
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List
 from fastapi import Depends, HTTPException, status, APIRouter
@@ -7,15 +24,21 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import mysql.connector
-from database import get_db
+from database import get_async_db
+from tracing import traced
 
 # Import models from users
 from users.models import UserInDB, UserInDBInternal, Token, TokenData, UserCreate
 
+logger = logging.getLogger(__name__)
+
 # Configuration (can move to a separate config file if needed)
 SECRET_KEY = os.getenv("SECRET_KEY", "5b182e8d53509cc4a2b18b3a991ea9acc3a06a798db0686b20faa87e0598f103")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 1440)) # Use the correct value
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 60)) # Seconds token claims / a DB-loaded user are trusted
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2)) # Concurrent bcrypt operations
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 16)) # Waiting operations before rejecting
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -31,6 +54,84 @@ def get_password_hash(password: str) -> str:
     """Hashes a plain password."""
     return pwd_context.hash(password)
 
+# --- Password Hashing Executor ---
+class PasswordHasher:
+    """
+    Runs bcrypt hashing/verification on a dedicated bounded thread pool so the
+    100-300 ms of CPU per call never runs on the event loop. At most `workers`
+    operations run at once and `max_queue` more may wait; anything beyond that
+    is rejected immediately with a 503 instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # Counters are only updated from the event loop thread (or under the GIL for
+        # the timing fields), so plain ints are sufficient. `_in_flight` counts calls
+        # until they finish in their thread, not until their caller stops waiting.
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def _timed(self, submitted_at: float, func, *args):
+        waited = time.monotonic() - submitted_at
+        self.queue_wait_total += waited
+        self.queue_wait_max = max(self.queue_wait_max, waited)
+        return func(*args)
+
+    async def run(self, func, *args):
+        if self._in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent login/signup attempts. Please retry shortly.",
+                headers={"Retry-After": "1"},
+            )
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(self._timed, time.monotonic(), func, *args)
+        self._in_flight += 1
+        future.add_done_callback(functools.partial(self._on_done, loop))
+        # Cancelling the wait also cancels a call that has not started; one already
+        # running cannot be interrupted and stays counted until it finishes
+        return await asyncio.wrap_future(future)
+
+    def _on_done(self, loop: asyncio.AbstractEventLoop, future):
+        # Runs in the bcrypt thread (or the cancelling one): hand the bookkeeping to the loop
+        try:
+            loop.call_soon_threadsafe(self._finished, future.cancelled())
+        except RuntimeError:
+            pass # Event loop already closed (shutdown)
+
+    def _finished(self, cancelled: bool):
+        self._in_flight -= 1
+        if not cancelled:
+            self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "queue_depth": max(0, self._in_flight - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_wait_seconds_total": self.queue_wait_total,
+            "queue_wait_seconds_max": self.queue_wait_max,
+        }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the bounded bcrypt executor (raises 503 when saturated)."""
+    return await password_hasher.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the bounded bcrypt executor (raises 503 when saturated)."""
+    return await password_hasher.run(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Creates a JWT access token."""
     to_encode = data.copy()
@@ -38,12 +139,83 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc)})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# --- Principal Cache and Revocation ---
+class PrincipalCache:
+    """
+    In-process cache of authenticated users plus a per-user revocation clock.
+
+    Tokens carry the user's id and role as signed claims, which are trusted for
+    the first `ttl` seconds after the token was issued; after that the user is
+    re-read from the DB and cached for `ttl` seconds. A role change or deletion
+    therefore reaches every worker within `ttl` seconds. invalidate() makes it
+    immediate in this process only: tokens issued before the call stop being
+    trusted on their claims and the cached user is dropped, but other
+    processes keep their own claims window and cache until the TTL passes.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries = {} # username -> (UserInDB, expires_at)
+        self._revoked_at = {} # username -> unix time of the last invalidation
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[UserInDB]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[username]
+                return None
+            return entry[0]
+
+    def put(self, user: UserInDB):
+        with self._lock:
+            self._entries[user.username] = (user, time.monotonic() + self.ttl)
+
+    def claims_trusted(self, username: str, issued_at: Optional[float]) -> bool:
+        """True if a token issued at `issued_at` is younger than `ttl` and post-dates the user's last invalidation."""
+        if issued_at is None or issued_at < time.time() - self.ttl:
+            return False
+        with self._lock:
+            revoked_at = self._revoked_at.get(username)
+        return revoked_at is None or issued_at > revoked_at
+
+    def invalidate(self, username: str):
+        now = time.time()
+        with self._lock:
+            self._entries.pop(username, None)
+            self._revoked_at[username] = now
+            # Claims of tokens older than the TTL are never trusted, so older revocations cannot match
+            horizon = now - self.ttl
+            for stale in [name for name, at in self._revoked_at.items() if at < horizon]:
+                del self._revoked_at[stale]
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL)
+
+def invalidate_user(username: str):
+    """
+    Revocation hook: call after any change to a users row (a role change, a
+    deletion, or (re)creating an account under the name), once it has
+    committed, so that existing tokens stop being trusted on their claims and
+    the cached user is dropped. Only affects this process; other workers keep
+    the old id/role for up to PRINCIPAL_CACHE_TTL seconds, until their token
+    claims and cache entries stop being trusted.
+    """
+    principal_cache.invalidate(username)
+
+@traced("auth.get_current_user")
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
-    """Dependency to get the current authenticated user from the JWT token."""
+    """
+    Dependency to get the current authenticated user from the JWT token.
+    Uses the token's signed id/role claims while they are still trusted (for
+    PRINCIPAL_CACHE_TTL seconds after issue), then the principal cache, and
+    only falls back to the database on a miss.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -58,25 +230,32 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
     except JWTError:
         raise credentials_exception
 
+    user_id, role = payload.get("uid"), payload.get("role")
+    if user_id is not None and role is not None and principal_cache.claims_trusted(username, payload.get("iat")):
+        return UserInDB(id=user_id, username=username, role=role)
+
+    cached_user = principal_cache.get(username)
+    if cached_user is not None:
+        return cached_user
+
     try:
-        with get_db() as (db, cursor):
-            cursor.execute(
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
                 "SELECT id, username, role FROM users WHERE username = %s",
                 (token_data.username,)
             )
-            user_data = cursor.fetchone()
+            user_data = await cursor.fetchone()
             if user_data is None:
                 raise credentials_exception
             # Ensure user_data is a dictionary or map it correctly
             user = UserInDB(**user_data)
+            principal_cache.put(user)
             return user
     except mysql.connector.Error as e:
-        print(f"DB error fetching user '{token_data.username}': {e}")
+        logger.error(f"DB error fetching user '{token_data.username}': {e}")
         raise HTTPException(status_code=500, detail="Database error during authentication.")
     except Exception as e:
-        print(f"Unexpected error fetching user '{token_data.username}': {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Unexpected error fetching user '{token_data.username}': {e}")
         raise credentials_exception
 
 # --- Dependency for Role Checking ---
@@ -97,48 +276,49 @@ def require_role(roles: List[str]):
 
 # This endpoint remains here as it's the entry point for obtaining tokens
 # It uses verify_password and create_access_token from this file
-# and interacts with the database via get_db
+# and interacts with the database via get_async_db
 router = APIRouter()
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """Logs in a user and returns an access token."""
     try:
-        with get_db() as (db, cursor):
-            cursor.execute(
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
                 "SELECT id, username, password, role FROM users WHERE username = %s",
                 (form_data.username,)
             )
-            user_data = cursor.fetchone()
-            if not user_data:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Incorrect username or password",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
-
-            user_in_db = UserInDBInternal(**user_data) # Use internal model with password
-            if not verify_password(form_data.password, user_in_db.password):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Incorrect username or password",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
-            access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-            access_token = create_access_token(
-                data={"sub": user_in_db.username}, expires_delta=access_token_expires
+            user_data = await cursor.fetchone()
+        if not user_data:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
             )
-            return {"access_token": access_token, "token_type": "bearer"}
+
+        user_in_db = UserInDBInternal(**user_data) # Use internal model with password
+        # Verified after the DB connection is returned, so bcrypt time never holds a pooled connection
+        if not await verify_password_async(form_data.password, user_in_db.password):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        # id and role travel as signed claims so authenticated requests skip the user lookup
+        access_token = create_access_token(
+            data={"sub": user_in_db.username, "uid": user_in_db.id, "role": user_in_db.role},
+            expires_delta=access_token_expires,
+        )
+        return {"access_token": access_token, "token_type": "bearer"}
 
     except mysql.connector.Error as e:
-        print(f"DB Error during login for user {form_data.username}: {e}")
+        logger.error(f"DB Error during login for user {form_data.username}: {e}")
         raise HTTPException(status_code=500, detail="Login failed due to database error.")
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Unexpected error during login for user {form_data.username}: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Unexpected error during login for user {form_data.username}: {e}")
         raise HTTPException(
             status_code=500, detail="An unexpected error occurred during login."
         )
@@ -0,0 +1,346 @@
+# benchmarks/datagen.py
+# Bulk synthetic data for capacity testing, loaded straight into MySQL (the
+# API would take days at this scale) plus small real PDFs in the blob store.
+#
+#   python -m benchmarks.datagen generate --users 50000 --documents 1000000 --versions-per-doc 5 --pdfs 100000
+#   python -m benchmarks.datagen scale-test --steps 10000,100000,1000000 --base-url http://localhost:8000
+#
+# `generate` appends to whatever is already loaded: rows get explicit ids
+# after the current maximum, so run it against an otherwise idle database.
+# Versions share the generated PDFs (as re-uploads and dedupe do in
+# production), the latest version of each document gets its stored text and
+# search postings, and all users share the benchmark password.
+#
+# `scale-test` grows the dataset step by step and, after each step, measures
+# listing, search, version lookup and delete latencies through the API of a
+# running server configured for the same database. Operations whose latency
+# grows by more than --cliff-factor between two steps are flagged.
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import mysql.connector
+
+from benchmarks.run import BENCH_PASSWORD, RESULTS_DIR, HttpClient, login, percentile
+from benchmarks.synthetic import SEARCH_TERMS, document_lines, make_pdf, sentence, title
+
+logger = logging.getLogger(__name__)
+
+RECRUITER_EVERY = 20 # One generated user in this many is a recruiter
+TEXT_MODES = ("latest", "none")
+
+class BulkLoader:
+    """One dedicated connection with constraint checks relaxed for bulk inserts."""
+
+    def __init__(self, batch_size: int):
+        from database import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+
+        self.batch_size = batch_size
+        self.connection = mysql.connector.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME)
+        self.cursor = self.connection.cursor()
+        # Ids are assigned here and titles carry the document id, so both checks are redundant while loading
+        self.cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+
+    def scalar(self, sql: str, params=()):
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchone()[0]
+
+    def next_id(self, table: str) -> int:
+        return int(self.scalar(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}"))
+
+    def insert(self, sql: str, rows: List[tuple]):
+        # executemany turns a plain INSERT ... VALUES into multi-row statements
+        for start in range(0, len(rows), self.batch_size):
+            self.cursor.executemany(sql, rows[start:start + self.batch_size])
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.cursor.close()
+        self.connection.close()
+
+def _blob_lines(seed_key: str) -> List[str]:
+    return document_lines(random.Random(seed_key), 30)
+
+def _write_blobs(loader: BulkLoader, count: int, seed: int) -> List[Tuple[str, str, int, str]]:
+    """Writes `count` new single-page PDFs into the blob store; returns (sha256, path, size, seed key) each."""
+    import hashlib
+    from documents.storage import BLOB_DIR, blob_path
+
+    offset = int(loader.scalar("SELECT COUNT(*) FROM blobs")) # New keys, so re-runs add new content
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    blobs = []
+    for number in range(offset, offset + count):
+        seed_key = f"{seed}-blob-{number}"
+        pdf = make_pdf([_blob_lines(seed_key)])
+        sha256 = hashlib.sha256(pdf).hexdigest()
+        path = blob_path(sha256, ".pdf")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(pdf)
+        blobs.append((sha256, path, len(pdf), seed_key))
+        if len(blobs) % 10000 == 0:
+            logger.info(f"Wrote {len(blobs)}/{count} PDFs.")
+    return blobs
+
+def _slug(text: str) -> str:
+    return "_".join(text.split())
+
+def generate(users: int, documents: int, versions_per_doc: int, pdfs: int, seed: int = 1,
+             text_mode: str = "latest", index: bool = True, batch_size: int = 5000) -> Dict[str, int]:
+    """Appends users, documents, versions, blobs (and text/postings) to the database; returns row counts added."""
+    from auth import get_password_hash
+    from documents.search_index import tokenize
+
+    loader = BulkLoader(batch_size)
+    rng = random.Random(f"{seed}-{loader.next_id('documents')}")
+    added = Counter()
+    started = time.monotonic()
+    try:
+        if users:
+            password_hash = get_password_hash(BENCH_PASSWORD) # One bcrypt hash shared by every generated user
+            first_user = loader.next_id("users")
+            rows = [
+                (f"gen{seed}_{user_id}", password_hash, "recruiter" if user_id % RECRUITER_EVERY == 0 else "user")
+                for user_id in range(first_user, first_user + users)
+            ]
+            loader.insert("INSERT INTO users (id, username, password, role) VALUES (%s, %s, %s, %s)",
+                          [(first_user + i,) + row for i, row in enumerate(rows)])
+            loader.commit()
+            added["users"] = users
+            logger.info(f"Inserted {users} users.")
+        if not documents:
+            return dict(added)
+
+        loader.cursor.execute("SELECT id FROM users WHERE role = 'user' ORDER BY id")
+        owners = [row[0] for row in loader.cursor.fetchall()]
+        if not owners:
+            raise ValueError("No 'user' accounts to own documents; generate some users first.")
+        blobs = _write_blobs(loader, max(pdfs, 1), seed)
+        ref_counts = Counter()
+        next_document = loader.next_id("documents")
+        next_version = loader.next_id("document_versions")
+        now = datetime.now()
+
+        for batch_start in range(0, documents, batch_size):
+            doc_rows, version_rows, text_rows, posting_rows = [], [], [], []
+            for _ in range(min(batch_size, documents - batch_start)):
+                document_id = next_document
+                next_document += 1
+                # Squared uniform skews ownership: a few heavy owners, a long tail of light ones
+                owner_id = owners[int(len(owners) * rng.random() ** 2)]
+                created_at = now - timedelta(seconds=rng.randrange(730 * 24 * 3600))
+                doc_title = f"{_slug(title(rng))}_{document_id}" # Suffix keeps (title, owner_id) unique
+                versions = rng.randint(1, 2 * versions_per_doc - 1)
+                uploaded_at = created_at
+                for number in range(1, versions + 1):
+                    blob = blobs[rng.randrange(len(blobs))]
+                    ref_counts[blob[0]] += 1
+                    uploaded_at += timedelta(seconds=rng.randrange(1, 30 * 24 * 3600))
+                    version_rows.append((next_version, document_id, number, blob[1], min(uploaded_at, now), blob[0], "identity"))
+                    next_version += 1
+                latest_version_id = next_version - 1
+                doc_rows.append((document_id, doc_title, sentence(rng, rng.randint(5, 20)), owner_id, blob[1], created_at))
+                if text_mode == "latest" or index:
+                    text = "\n".join(_blob_lines(blob[3]))
+                    if text_mode == "latest":
+                        text_rows.append((latest_version_id, text))
+                    if index:
+                        posting_rows.extend((term, document_id, count) for term, count in Counter(tokenize(text)).items())
+
+            loader.insert(
+                "INSERT INTO documents (id, title, description, owner_id, latest_file_path, created_at) VALUES (%s, %s, %s, %s, %s, %s)",
+                doc_rows,
+            )
+            loader.insert(
+                "INSERT INTO document_versions (id, document_id, version, file_path, uploaded_at, blob_sha256, codec) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                version_rows,
+            )
+            if text_rows:
+                loader.insert("INSERT INTO document_text (version_id, content) VALUES (%s, %s)", text_rows)
+            if posting_rows:
+                loader.insert("INSERT INTO search_postings (term, document_id, term_freq) VALUES (%s, %s, %s)", posting_rows)
+            loader.commit()
+            added["documents"] += len(doc_rows)
+            added["versions"] += len(version_rows)
+            added["postings"] += len(posting_rows)
+            elapsed = time.monotonic() - started
+            logger.info(f"Inserted {added['documents']}/{documents} documents, {added['versions']} versions "
+                        f"({added['documents'] / elapsed:.0f} documents/s).")
+
+        loader.insert(
+            """
+            INSERT INTO blobs (sha256, file_path, size_bytes, stored_bytes, codec, ref_count)
+            VALUES (%s, %s, %s, %s, 'identity', %s)
+            ON DUPLICATE KEY UPDATE ref_count = ref_count + VALUES(ref_count)
+            """,
+            [(sha256, path, size, size, ref_counts[sha256]) for sha256, path, size, _ in blobs if ref_counts[sha256]],
+        )
+        loader.commit()
+        added["blobs"] = len(blobs)
+    finally:
+        loader.close()
+    logger.info(f"Generated {dict(added)} in {time.monotonic() - started:.1f}s.")
+    return dict(added)
+
+# --- Scale test ---
+
+def _dataset_size(loader: BulkLoader) -> Dict[str, int]:
+    return {
+        "users": int(loader.scalar("SELECT COUNT(*) FROM users")),
+        "documents": int(loader.scalar("SELECT COUNT(*) FROM documents")),
+        "versions": int(loader.scalar("SELECT COUNT(*) FROM document_versions")),
+        "blobs": int(loader.scalar("SELECT COUNT(*) FROM blobs")),
+    }
+
+def _measure(client: HttpClient, requests: List[Tuple[str, str, dict]], expect=(200,)) -> dict:
+    latencies, errors = [], 0
+    for method, path, headers in requests:
+        started = time.perf_counter()
+        status, _ = client.request(method, path, None, headers)
+        latencies.append(time.perf_counter() - started)
+        errors += status not in expect
+    latencies.sort()
+    return {
+        "samples": len(latencies),
+        "errors": errors,
+        "p50_ms": 1000 * percentile(latencies, 0.50),
+        "p90_ms": 1000 * percentile(latencies, 0.90),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "max_ms": 1000 * latencies[-1] if latencies else 0.0,
+    }
+
+def measure_step(client: HttpClient, loader: BulkLoader, samples: int, rng: random.Random) -> Dict[str, dict]:
+    """Times the API operations whose cost depends on dataset size, for the heaviest document owner."""
+    loader.cursor.execute(
+        "SELECT d.owner_id, u.username FROM documents d JOIN users u ON u.id = d.owner_id "
+        "GROUP BY d.owner_id, u.username ORDER BY COUNT(*) DESC LIMIT 1"
+    )
+    owner_id, owner_name = loader.cursor.fetchone()
+    loader.cursor.execute("SELECT username FROM users WHERE role = 'recruiter' ORDER BY id LIMIT 1")
+    recruiter = loader.cursor.fetchone()
+    loader.cursor.execute("SELECT id FROM documents WHERE owner_id = %s ORDER BY RAND() LIMIT %s", (owner_id, 2 * samples))
+    document_ids = [row[0] for row in loader.cursor.fetchall()]
+    loader.commit() # End the read snapshot so later steps see new rows
+
+    owner = {"Authorization": f"Bearer {login(client, owner_name)}"}
+    reader = {"Authorization": f"Bearer {login(client, recruiter[0])}"} if recruiter else owner
+    terms = [rng.choice(SEARCH_TERMS) for _ in range(samples)]
+    return {
+        "list_own_documents": _measure(client, [("GET", "/documents/?limit=50", owner)] * samples),
+        "list_applicant_documents": _measure(client, [("GET", "/documents/applicant/?limit=50", reader)] * samples)
+        if recruiter else None,
+        "search_metadata": _measure(client, [("GET", f"/documents/search/?query={t}&limit=50", reader) for t in terms]),
+        "search_content": _measure(
+            client, [("GET", f"/documents/search/?query={t}&search_content=true&limit=50", reader) for t in terms]
+        ),
+        "version_lookup": _measure(client, [("GET", f"/documents/{d}/versions/", owner) for d in document_ids[:samples]]),
+        "delete_document": _measure(client, [("DELETE", f"/documents/{d}", owner) for d in document_ids[samples:]]),
+    }
+
+def scale_test(base_url: str, steps: List[int], users: int, versions_per_doc: int, pdfs_per_document: float,
+               samples: int, seed: int, text_mode: str, index: bool, batch_size: int, cliff_factor: float,
+               output: Optional[str]) -> dict:
+    client = HttpClient(base_url)
+    loader = BulkLoader(batch_size)
+    rng = random.Random(seed)
+    report = {"meta": {"base_url": base_url, "steps": steps, "samples": samples, "seed": seed}, "steps": []}
+    try:
+        for number, target in enumerate(sorted(steps)):
+            current = int(loader.scalar("SELECT COUNT(*) FROM documents"))
+            loader.commit()
+            missing = target - current
+            if missing > 0:
+                generate(users if number == 0 else 0, missing, versions_per_doc,
+                         max(1, int(missing * pdfs_per_document)), seed, text_mode, index, batch_size)
+            size = _dataset_size(loader)
+            operations = measure_step(client, loader, samples, rng)
+            report["steps"].append({"dataset": size, "operations": operations})
+            logger.info(f"Measured step at {size['documents']} documents / {size['versions']} versions.")
+    finally:
+        loader.close()
+
+    report["cliffs"] = _find_cliffs(report["steps"], cliff_factor)
+    _print_scale_report(report)
+    if output is None:
+        output = os.path.join(RESULTS_DIR, f"scale-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+    return report
+
+def _find_cliffs(steps: List[dict], cliff_factor: float) -> List[dict]:
+    cliffs = []
+    for before, after in zip(steps, steps[1:]):
+        for name, result in after["operations"].items():
+            previous = before["operations"].get(name)
+            if not result or not previous or not previous["p50_ms"]:
+                continue
+            growth = result["p50_ms"] / previous["p50_ms"]
+            if growth > cliff_factor:
+                cliffs.append({
+                    "operation": name,
+                    "from_documents": before["dataset"]["documents"],
+                    "to_documents": after["dataset"]["documents"],
+                    "p50_growth": growth,
+                })
+    return cliffs
+
+def _print_scale_report(report: dict):
+    names = [name for name, result in report["steps"][0]["operations"].items() if result] if report["steps"] else []
+    print(f"{'documents':>12} {'versions':>12} " + " ".join(f"{name[:18]:>18}" for name in names))
+    for step in report["steps"]:
+        cells = " ".join(
+            f"{step['operations'][name]['p50_ms']:8.1f}/{step['operations'][name]['p99_ms']:<9.1f}" for name in names
+        )
+        print(f"{step['dataset']['documents']:>12} {step['dataset']['versions']:>12} {cells}")
+    print("(p50/p99 ms)")
+    for cliff in report["cliffs"]:
+        print(f"CLIFF: {cliff['operation']} p50 grew {cliff['p50_growth']:.1f}x between "
+              f"{cliff['from_documents']} and {cliff['to_documents']} documents")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic data and measure how the API scales.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="bulk-load synthetic rows and PDFs")
+    generate_parser.add_argument("--users", type=int, default=1000)
+    generate_parser.add_argument("--documents", type=int, default=10000)
+    generate_parser.add_argument("--pdfs", type=int, default=1000, help="distinct PDF files shared by the versions")
+
+    scale_parser = subparsers.add_parser("scale-test", help="grow the dataset in steps and time the API at each")
+    scale_parser.add_argument("--steps", default="10000,100000,1000000", help="comma-separated document counts")
+    scale_parser.add_argument("--users", type=int, default=50000, help="users created before the first step")
+    scale_parser.add_argument("--pdfs-per-document", type=float, default=0.1)
+    scale_parser.add_argument("--samples", type=int, default=50, help="requests timed per operation and step")
+    scale_parser.add_argument("--cliff-factor", type=float, default=3.0, help="p50 growth between steps flagged as a cliff")
+    scale_parser.add_argument("--base-url", default=os.getenv("BENCH_BASE_URL", "http://localhost:8000"))
+    scale_parser.add_argument("--output", help="report path (default: benchmarks/results/scale-<time>.json)")
+
+    for sub in (generate_parser, scale_parser):
+        sub.add_argument("--versions-per-doc", type=int, default=5, help="average versions per document")
+        sub.add_argument("--text", choices=TEXT_MODES, default="latest", help="store extracted text for latest versions")
+        sub.add_argument("--no-index", action="store_true", help="skip search postings (much faster to load)")
+        sub.add_argument("--seed", type=int, default=1)
+        sub.add_argument("--batch-size", type=int, default=5000)
+
+    args = parser.parse_args()
+    from logging_config import configure_logging
+    configure_logging()
+    if args.command == "generate":
+        generate(args.users, args.documents, args.versions_per_doc, args.pdfs, args.seed,
+                 args.text, not args.no_index, args.batch_size)
+    elif args.command == "scale-test":
+        scale_test(args.base_url, [int(step) for step in args.steps.split(",")], args.users, args.versions_per_doc,
+                   args.pdfs_per_document, args.samples, args.seed, args.text, not args.no_index,
+                   args.batch_size, args.cliff_factor, args.output)
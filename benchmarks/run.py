@@ -0,0 +1,376 @@
+# benchmarks/run.py
+# Load benchmarks for the API hot paths, run against a live server (uvicorn
+# main:app backed by a local MySQL loaded with sql.txt). Everything goes
+# through the public HTTP API, so the numbers include auth, (de)serialization
+# and the DB exactly as clients see them.
+#
+#   python -m benchmarks.run seed --users 20 --docs-per-user 25
+#   python -m benchmarks.run run --duration 10 --concurrency 8 --output before.json
+#   python -m benchmarks.run compare before.json after.json --tolerance 0.10
+#
+# `seed` creates a deterministic synthetic dataset (users, recruiters, PDF
+# documents with several versions) and records it in a state file that `run`
+# reads. `run` writes one JSON document with throughput and latency
+# percentiles per scenario; `compare` diffs two of them and exits non-zero on
+# regressions beyond the tolerance.
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.synthetic import SEARCH_TERMS, encode_multipart, random_pdf, title
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+DEFAULT_STATE_FILE = os.path.join(RESULTS_DIR, "state.json")
+BENCH_PASSWORD = "bench-password-1"
+
+class HttpClient:
+    """Keep-alive HTTP client with one connection per thread."""
+
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        parsed = urllib.parse.urlsplit(base_url)
+        self._https = parsed.scheme == "https"
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            connection = self._local.connection = cls(self._host, self._port, timeout=self._timeout)
+        return connection
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+
+    def json(self, method: str, path: str, body: Optional[bytes] = None,
+             headers: Optional[Dict[str, str]] = None, expect=(200,)):
+        status, data = self.request(method, path, body, headers)
+        if status not in expect:
+            raise RuntimeError(f"{method} {path} returned {status}: {data[:300]!r}")
+        return json.loads(data) if data else None
+
+def _form(fields: Dict[str, str]) -> Tuple[bytes, Dict[str, str]]:
+    return urllib.parse.urlencode(fields).encode(), {"Content-Type": "application/x-www-form-urlencoded"}
+
+def _bearer(token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+def login(client: HttpClient, username: str, password: str = BENCH_PASSWORD) -> str:
+    body, headers = _form({"username": username, "password": password})
+    return client.json("POST", "/token", body, headers)["access_token"]
+
+def upload(client: HttpClient, token: str, filename: str, pdf: bytes) -> dict:
+    body, content_type = encode_multipart({}, [("file", filename, pdf, "application/pdf")])
+    return client.json("POST", "/documents/", body, {**_bearer(token), "Content-Type": content_type}, expect=(201,))
+
+# --- Seeding ---
+
+def seed(client: HttpClient, users: int, recruiters: int, docs_per_user: int, versions_per_doc: int,
+         seed_value: int, concurrency: int, state_file: str):
+    """Creates the benchmark dataset through the API and writes its description to `state_file`."""
+    tag = f"bench{seed_value}"
+    accounts = [(f"{tag}_user{i}", "user") for i in range(users)]
+    accounts += [(f"{tag}_recruiter{i}", "recruiter") for i in range(recruiters)]
+
+    def signup(account):
+        username, role = account
+        body = json.dumps({"username": username, "password": BENCH_PASSWORD, "role": role}).encode()
+        status, data = client.request("POST", "/users/signup", body, {"Content-Type": "application/json"})
+        if status not in (201, 400): # 400: already registered by an earlier seed with the same value
+            raise RuntimeError(f"Signup of {username} returned {status}: {data[:300]!r}")
+
+    def seed_user(index: int) -> List[dict]:
+        rng = random.Random(f"{seed_value}-{index}") # Same dataset for the same seed, whatever the thread timing
+        username = f"{tag}_user{index}"
+        token = login(client, username)
+        documents = []
+        for doc_number in range(docs_per_user):
+            filename = f"{title(rng)} {index}-{doc_number}.pdf"
+            for _ in range(versions_per_doc):
+                result = upload(client, token, filename, random_pdf(rng, pages=rng.randint(1, 3)))
+            documents.append({"document_id": result["document_id"], "versions": result["version"], "owner": username})
+        return documents
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(signup, accounts))
+        documents = [doc for docs in executor.map(seed_user, range(users)) for doc in docs]
+
+    os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+    with open(state_file, "w") as f:
+        json.dump({
+            "seed": seed_value,
+            "users": [name for name, role in accounts if role == "user"],
+            "recruiters": [name for name, role in accounts if role == "recruiter"],
+            "documents": documents,
+        }, f, indent=2)
+    print(f"Seeded {users} users, {recruiters} recruiters and {len(documents)} documents "
+          f"({len(documents) * versions_per_doc} versions) in {time.monotonic() - started:.1f}s -> {state_file}")
+
+# --- Scenarios ---
+
+class Context:
+    """Dataset, tokens and pre-generated payloads shared by the scenario builders."""
+
+    def __init__(self, client: HttpClient, state: dict, concurrency: int):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            user_tokens = list(executor.map(lambda name: login(client, name), state["users"]))
+            recruiter_tokens = list(executor.map(lambda name: login(client, name), state["recruiters"]))
+        self.users = state["users"]
+        self.tokens = dict(zip(state["users"], user_tokens))
+        self.recruiter_tokens = recruiter_tokens
+        self.documents = state["documents"]
+        rng = random.Random(state["seed"])
+        self.upload_pdfs = [random_pdf(rng) for _ in range(16)]
+
+Request = Tuple[str, str, Optional[bytes], Dict[str, str], Tuple[int, ...]]
+
+def _user_token(ctx: Context, rng: random.Random) -> str:
+    return ctx.tokens[rng.choice(ctx.users)]
+
+def scenario_login(ctx: Context, rng: random.Random) -> Request:
+    body, headers = _form({"username": rng.choice(ctx.users), "password": BENCH_PASSWORD})
+    return "POST", "/token", body, headers, (200,)
+
+def scenario_users_me(ctx: Context, rng: random.Random) -> Request:
+    return "GET", "/users/me", None, _bearer(_user_token(ctx, rng)), (200,)
+
+def scenario_get_documents(ctx: Context, rng: random.Random) -> Request:
+    return "GET", "/documents/?limit=50", None, _bearer(_user_token(ctx, rng)), (200,)
+
+def scenario_get_applicant_documents(ctx: Context, rng: random.Random) -> Request:
+    return "GET", "/documents/applicant/?limit=50", None, _bearer(rng.choice(ctx.recruiter_tokens)), (200,)
+
+def scenario_search_metadata(ctx: Context, rng: random.Random) -> Request:
+    query = urllib.parse.quote(rng.choice(SEARCH_TERMS))
+    return "GET", f"/documents/search/?query={query}&limit=50", None, _bearer(_user_token(ctx, rng)), (200,)
+
+def scenario_search_content(ctx: Context, rng: random.Random) -> Request:
+    query = urllib.parse.quote(rng.choice(SEARCH_TERMS))
+    path = f"/documents/search/?query={query}&search_content=true&limit=50"
+    return "GET", path, None, _bearer(rng.choice(ctx.recruiter_tokens)), (200,)
+
+def scenario_download(ctx: Context, rng: random.Random) -> Request:
+    doc = rng.choice(ctx.documents)
+    path = f"/documents/{doc['document_id']}/versions/{rng.randint(1, doc['versions'])}/download"
+    return "GET", path, None, _bearer(ctx.tokens[doc["owner"]]), (200,)
+
+def scenario_upload(ctx: Context, rng: random.Random) -> Request:
+    # A unique trailer after %%EOF keeps content dedupe from turning uploads into no-ops
+    pdf = rng.choice(ctx.upload_pdfs) + f"% {uuid.uuid4().hex}\n".encode()
+    filename = f"benchmark upload {rng.randrange(8)}.pdf" # New versions of a few documents per user
+    body, content_type = encode_multipart({}, [("file", filename, pdf, "application/pdf")])
+    return "POST", "/documents/", body, {**_bearer(_user_token(ctx, rng)), "Content-Type": content_type}, (201,)
+
+# Run order: read-only scenarios first, then the ones that add rows or burn bcrypt time
+SCENARIOS: Dict[str, Callable[[Context, random.Random], Request]] = {
+    "users_me": scenario_users_me,
+    "get_documents": scenario_get_documents,
+    "get_applicant_documents": scenario_get_applicant_documents,
+    "search_metadata": scenario_search_metadata,
+    "search_content": scenario_search_content,
+    "download_document_version": scenario_download,
+    "login": scenario_login,
+    "upload_document_or_version": scenario_upload,
+}
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def run_scenario(client: HttpClient, ctx: Context, name: str, duration: float, warmup: float,
+                 concurrency: int, seed_value: int) -> dict:
+    builder = SCENARIOS[name]
+    latencies: List[List[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    first_errors: List[str] = []
+    elapsed = 0.0
+
+    def worker(number: int, until: float, record: bool):
+        rng = random.Random(f"{seed_value}-{name}-{number}")
+        while time.perf_counter() < until:
+            method, path, body, headers, expect = builder(ctx, rng)
+            started = time.perf_counter()
+            try:
+                status, data = client.request(method, path, body, headers)
+                ok = status in expect
+            except (http.client.HTTPException, OSError) as e:
+                status, data, ok = None, repr(e).encode(), False
+            elapsed = time.perf_counter() - started
+            if not record:
+                continue
+            latencies[number].append(elapsed)
+            if not ok:
+                errors[number] += 1
+                if len(first_errors) < 3:
+                    first_errors.append(f"{method} {path} -> {status}: {data[:200]!r}")
+
+    for record, seconds in ((False, warmup), (True, duration)):
+        if seconds <= 0:
+            continue
+        until = time.perf_counter() + seconds
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda number: worker(number, until, record), range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    samples = sorted(value for values in latencies for value in values)
+    total_errors = sum(errors)
+    return {
+        "requests": len(samples),
+        "errors": total_errors,
+        "error_rate": total_errors / len(samples) if samples else 0.0,
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": 1000 * sum(samples) / len(samples) if samples else 0.0,
+            "p50": 1000 * percentile(samples, 0.50),
+            "p90": 1000 * percentile(samples, 0.90),
+            "p99": 1000 * percentile(samples, 0.99),
+            "max": 1000 * samples[-1] if samples else 0.0,
+        },
+        "sample_errors": first_errors,
+    }
+
+def _git_revision() -> Optional[str]:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(client: HttpClient, base_url: str, state_file: str, scenarios: List[str], duration: float,
+        warmup: float, concurrency: int, output: Optional[str]) -> dict:
+    with open(state_file) as f:
+        state = json.load(f)
+    ctx = Context(client, state, concurrency)
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "base_url": base_url,
+            "python": platform.python_version(),
+            "host": platform.node(),
+            "duration_seconds": duration,
+            "warmup_seconds": warmup,
+            "concurrency": concurrency,
+            "dataset": {
+                "seed": state["seed"],
+                "users": len(state["users"]),
+                "recruiters": len(state["recruiters"]),
+                "documents": len(state["documents"]),
+                "versions": sum(doc["versions"] for doc in state["documents"]),
+            },
+        },
+        "scenarios": {},
+    }
+    for name in scenarios:
+        result = run_scenario(client, ctx, name, duration, warmup, concurrency, state["seed"])
+        report["scenarios"][name] = result
+        latency = result["latency_ms"]
+        print(f"{name:28} {result['throughput_rps']:9.1f} req/s  p50 {latency['p50']:8.2f} ms  "
+              f"p99 {latency['p99']:8.2f} ms  errors {result['errors']}/{result['requests']}")
+
+    if output is None:
+        revision = (report["meta"]["git_revision"] or "unknown")[:12]
+        output = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{revision}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+    return report
+
+# --- Comparison ---
+
+def compare(old_file: str, new_file: str, tolerance: float) -> bool:
+    """Prints per-scenario changes; returns False if any scenario regressed beyond `tolerance`."""
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+
+    def change(before: float, after: float) -> float:
+        return (after - before) / before if before else 0.0
+
+    ok = True
+    print(f"{'scenario':28} {'throughput':>12} {'p50':>10} {'p99':>10}")
+    for name, after in new["scenarios"].items():
+        before = old["scenarios"].get(name)
+        if before is None:
+            print(f"{name:28} (new scenario)")
+            continue
+        throughput = change(before["throughput_rps"], after["throughput_rps"])
+        p50 = change(before["latency_ms"]["p50"], after["latency_ms"]["p50"])
+        p99 = change(before["latency_ms"]["p99"], after["latency_ms"]["p99"])
+        regressed = throughput < -tolerance or p50 > tolerance or p99 > tolerance or after["errors"] > before["errors"]
+        ok = ok and not regressed
+        print(f"{name:28} {throughput:+11.1%} {p50:+9.1%} {p99:+9.1%}{'  REGRESSION' if regressed else ''}")
+    if old["meta"].get("dataset") != new["meta"].get("dataset"):
+        print("Warning: the two runs used different datasets; results may not be comparable.")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DocuVault API.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed", help="create the synthetic dataset through the API")
+    seed_parser.add_argument("--users", type=int, default=20)
+    seed_parser.add_argument("--recruiters", type=int, default=3)
+    seed_parser.add_argument("--docs-per-user", type=int, default=25)
+    seed_parser.add_argument("--versions-per-doc", type=int, default=2)
+
+    run_parser = subparsers.add_parser("run", help="run the scenarios and write a JSON report")
+    run_parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                            help="scenario to run (repeatable; default: all)")
+    run_parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario")
+    run_parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds per scenario")
+    run_parser.add_argument("--output", help="report path (default: benchmarks/results/<time>-<revision>.json)")
+
+    for sub in (seed_parser, run_parser):
+        sub.add_argument("--base-url", default=os.getenv("BENCH_BASE_URL", "http://localhost:8000"))
+        sub.add_argument("--state", default=DEFAULT_STATE_FILE, help="dataset description written by seed")
+        sub.add_argument("--concurrency", type=int, default=8)
+    seed_parser.add_argument("--seed", type=int, default=1)
+
+    compare_parser = subparsers.add_parser("compare", help="diff two reports")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        seed(HttpClient(args.base_url), args.users, args.recruiters, args.docs_per_user, args.versions_per_doc,
+             args.seed, args.concurrency, args.state)
+    elif args.command == "run":
+        run(HttpClient(args.base_url), args.base_url, args.state, args.scenario or list(SCENARIOS),
+            args.duration, args.warmup, args.concurrency, args.output)
+    elif args.command == "compare":
+        sys.exit(0 if compare(args.old, args.new, args.tolerance) else 1)
@@ -0,0 +1,86 @@
+# benchmarks/synthetic.py
+# Deterministic synthetic content for benchmarks and data generation: small
+# but valid PDFs (written by hand, so generating thousands costs no PyMuPDF
+# time), word-based titles and text, and multipart form encoding for uploads.
+import random
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+# Common English words plus a few domain terms, so FULLTEXT and content searches have realistic hit rates
+WORDS = (
+    "the be to of and a in that have it for not on with he as you do at this but his by from they we say her "
+    "she or an will my one all would there their what so up out if about who get which go me when make can like "
+    "time no just him know take people into year your good some could them see other than then now look only "
+    "come its over think also back after use two how our work first well way even new want because any these "
+    "give day most us resume curriculum vitae experience education skills project manager engineer developer "
+    "analyst design python java sql cloud data security network sales marketing finance operations research "
+    "bachelor master degree university certificate reference portfolio leadership team agile customer product "
+    "support quality testing release infrastructure platform mobile backend frontend intern senior junior lead"
+).split()
+
+# Words used as search terms by the benchmarks; every generated text contains several of them
+SEARCH_TERMS = ("python", "engineer", "resume", "project", "security", "finance", "design", "cloud")
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def title(rng: random.Random) -> str:
+    return f"{rng.choice(SEARCH_TERMS)} {sentence(rng, rng.randint(1, 4))}"
+
+def document_lines(rng: random.Random, count: int = 30) -> List[str]:
+    lines = [sentence(rng, rng.randint(6, 14)) for _ in range(count)]
+    for term in rng.sample(SEARCH_TERMS, 3):
+        lines[rng.randrange(count)] += f" {term}"
+    return lines
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(pages: List[List[str]]) -> bytes:
+    """Returns a minimal PDF with one Helvetica text page per list of lines."""
+    objects: List[bytes] = []
+    page_ids = [3 + 2 * i for i in range(len(pages))]
+    font_id = 3 + 2 * len(pages)
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    for page_id, lines in zip(page_ids, pages):
+        text = " T* ".join(f"({_pdf_escape(line)}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 14 TL 50 780 Td {text} ET".encode("latin-1", "replace")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {page_id + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_at)
+    return bytes(out)
+
+def random_pdf(rng: random.Random, pages: int = 1, lines_per_page: int = 30) -> bytes:
+    return make_pdf([document_lines(rng, lines_per_page) for _ in range(pages)])
+
+def encode_multipart(fields: Dict[str, str], files: List[Tuple[str, str, bytes, str]],
+                     boundary: Optional[str] = None) -> Tuple[bytes, str]:
+    """Encodes form fields and (field, filename, data, content_type) files; returns (body, content_type)."""
+    boundary = boundary or uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, filename, data, content_type in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
@@ -1,49 +1,536 @@
-# database.py
 import mysql.connector
-from contextlib import contextmanager
+import logging
+from contextlib import contextmanager, asynccontextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
 import os
+import threading
+import time
+from typing import Optional
+
+import tracing
+from metrics import METRICS_ENABLED, call_site, db_query_duration, db_query_errors, db_checkout_wait, db_connect_duration
+
+logger = logging.getLogger(__name__)
 
 # --- Database Configuration ---
 # Replace with your actual database credentials
-DB_HOST = "localhost"
-DB_USER = "root"
-DB_PASSWORD = "password" # Use environment variables in production!
-DB_NAME = "job_tracker"
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "password") # Use environment variables in production!
+DB_NAME = os.getenv("DB_NAME", "job_tracker")
+
+# --- Connection Pool Configuration ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5)) # Connections kept open while idle
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", 10)) # Extra connections allowed under load
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30)) # Seconds to wait for a free connection
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", 3600)) # Reconnect connections older than this (seconds)
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", 30)) # Ping connections idle longer than this (seconds)
+# Threads running blocking driver calls for get_async_db; one per poolable connection by default
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW))
+
+# --- Slow Query Log Configuration ---
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", 0.5)) # Statements slower than this are logged (0 disables)
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", 60)) # Seconds before re-EXPLAINing a statement
+SLOW_QUERY_MAX_PENDING = 16 # EXPLAINs queued at once; further slow statements are logged without one
+
+
+class PoolTimeoutError(mysql.connector.errors.PoolError):
+    """Raised when no pooled connection becomes available within the checkout timeout."""
+
+
+class _PoolEntry:
+    """A pooled connection plus the bookkeeping needed for health checks."""
+    __slots__ = ("connection", "created_at", "last_used")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of mysql.connector connections.
+
+    Keeps up to `size` idle connections open and allows up to `max_overflow`
+    additional connections under load; overflow connections are closed when
+    they are returned and the idle set is already full. Checkout blocks for at
+    most `timeout` seconds. Connections idle longer than `ping_after` are
+    pinged before reuse and connections older than `recycle` are replaced.
+    """
+
+    def __init__(self, size: int, max_overflow: int, timeout: float, recycle: float, ping_after: float, **connect_kwargs):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._connect_kwargs = connect_kwargs
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        # Stats counters, guarded by self._cond
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._created = 0
+        self._discarded = 0
+
+    def _connect(self) -> _PoolEntry:
+        started = time.perf_counter()
+        connection = mysql.connector.connect(**self._connect_kwargs)
+        db_connect_duration.observe(time.perf_counter() - started)
+        with self._cond:
+            self._created += 1
+        return _PoolEntry(connection)
+
+    def _close(self, entry: _PoolEntry):
+        with self._cond:
+            self._discarded += 1
+        try:
+            entry.connection.close()
+        except mysql.connector.Error as err:
+            logger.warning(f"Error closing pooled DB connection: {err}")
+
+    def _ensure_healthy(self, entry: _PoolEntry) -> _PoolEntry:
+        """Replaces stale or broken connections before they are handed out."""
+        now = time.monotonic()
+        if now - entry.created_at > self.recycle:
+            self._close(entry)
+            return self._connect()
+        if now - entry.last_used > self.ping_after:
+            try:
+                entry.connection.ping(reconnect=False)
+            except mysql.connector.Error as err:
+                logger.warning(f"Discarding stale pooled DB connection: {err}")
+                self._close(entry)
+                return self._connect()
+        return entry
+
+    def acquire(self) -> _PoolEntry:
+        """Checks out a connection, opening a new one if the pool has capacity."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop() # LIFO keeps the most recently used connections warm
+                    break
+                if self._in_use < self.size + self.max_overflow:
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.timeout}s waiting for a DB connection "
+                        f"({self._in_use} in use, limit {self.size + self.max_overflow})."
+                    )
+                self._cond.wait(remaining)
+            self._in_use += 1
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        db_checkout_wait.observe(waited)
+
+        try:
+            return self._connect() if entry is None else self._ensure_healthy(entry)
+        except BaseException:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, entry: _PoolEntry, discard: bool = False):
+        """Returns a connection to the pool, closing it if broken or surplus."""
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            keep = not discard and len(self._idle) < self.size
+            if keep:
+                self._idle.append(entry)
+            self._cond.notify()
+        if not keep:
+            self._close(entry)
+
+    def dispose(self):
+        """Closes every idle connection. Checked-out connections close on release."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for entry in idle:
+            self._close(entry)
+
+    def stats(self) -> dict:
+        """Returns a snapshot of pool usage and checkout wait times."""
+        with self._cond:
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_seconds_total": self._wait_total,
+                "wait_seconds_max": self._wait_max,
+                "wait_seconds_avg": self._wait_total / self._checkouts if self._checkouts else 0.0,
+                "connections_created": self._created,
+                "connections_discarded": self._discarded,
+            }
+
+
+pool = ConnectionPool(
+    size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_MAX_OVERFLOW,
+    timeout=DB_POOL_TIMEOUT,
+    recycle=DB_POOL_RECYCLE,
+    ping_after=DB_POOL_PING_AFTER,
+    host=DB_HOST,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    database=DB_NAME,
+)
+
+def get_pool_stats() -> dict:
+    """Returns in-use/idle counts and wait times for the shared connection pool."""
+    return pool.stats()
 
 @contextmanager
 def get_db():
-    """Provides a database connection and cursor with transaction handling."""
-    db = None
+    """Provides a pooled database connection and cursor with transaction handling."""
+    entry = pool.acquire()
+    db = entry.connection
     cursor = None
+    discard = False
     try:
-        db = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
         # Using dictionary=True makes fetching results easier (access by column name)
         cursor = db.cursor(dictionary=True)
-        print("DB connection opened.")
+        logger.debug("DB connection checked out from pool.")
         yield db, cursor # Yield connection and cursor
-        print("Committing transaction.")
+        logger.debug("Committing transaction.")
         db.commit() # Commit if the 'with' block succeeded
     except mysql.connector.Error as err:
-        print(f"Database Error: {err}")
-        if db:
-            print("Rolling back transaction due to DB error.")
-            db.rollback()
+        logger.error("Database Error, rolling back transaction: %s", err)
+        discard = not _safe_rollback(db)
         raise # Re-raise the exception so FastAPI can handle it
-    except Exception as e:
-        print(f"Non-DB Error: {e}")
-        if db:
-            print("Rolling back transaction due to non-DB error.")
-            db.rollback()
+    except BaseException as e:
+        # Usually an HTTPException raised by the endpoint; it reports real failures itself
+        logger.debug("Rolling back transaction due to non-DB error: %r", e)
+        discard = not _safe_rollback(db)
         raise # Re-raise
     finally:
         if cursor:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                discard = True
+        pool.release(entry, discard=discard)
+        logger.debug("DB connection returned to pool.")
+
+def _safe_rollback(db) -> bool:
+    """Rolls back the open transaction; returns False if the connection is unusable."""
+    try:
+        db.rollback()
+        return True
+    except mysql.connector.Error as err:
+        logger.error(f"Rollback failed, discarding connection: {err}")
+        return False
+
+
+# --- Async Data Access ---
+# mysql.connector is a blocking driver, so async endpoints run every driver call
+# on a bounded executor instead of the event loop thread.
+_db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+# Limits concurrent async checkouts to the pool capacity so executor threads never
+# block waiting for a connection that only another queued task could release.
+_async_checkout_gate = None
+
+def _submit_to_db_executor(func, *args, **kwargs) -> asyncio.Future:
+    """Runs a blocking database call on the bounded DB executor (in the caller's context, for log correlation)."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return loop.run_in_executor(_db_executor, functools.partial(context.run, func, *args, **kwargs))
+
+class _Checkout:
+    """
+    Runs the blocking calls of one async connection checkout. Cancelling the
+    awaiting task cannot stop a call already handed to a worker thread, so
+    each call is shielded and, if the task is cancelled meanwhile, left in
+    `in_flight` for get_async_db to wait out before the connection is touched
+    again.
+    """
+
+    def __init__(self):
+        self.in_flight: Optional[asyncio.Future] = None
+
+    async def run(self, func, *args):
+        future = _submit_to_db_executor(func, *args)
+        self.in_flight = future
+        result = await asyncio.shield(future) # Raises CancelledError with in_flight still set
+        self.in_flight = None
+        return result
+
+def _release_checkout(entry: "_PoolEntry", discard: bool, gate: asyncio.Semaphore) -> asyncio.Future:
+    """Returns a connection to the pool on the executor, freeing its checkout slot once that is done."""
+    future = _submit_to_db_executor(pool.release, entry, discard)
+    future.add_done_callback(lambda _: gate.release())
+    return future
+
+def _release_abandoned_acquire(gate: asyncio.Semaphore, future: asyncio.Future):
+    # The task awaiting pool.acquire() was cancelled; hand back whatever the worker thread checked out
+    if future.cancelled() or future.exception() is not None:
+        gate.release()
+    else:
+        _release_checkout(future.result(), False, gate)
+
+def _normalize_sql(operation) -> str:
+    return " ".join(str(operation).split())
+
+def params_shape(params):
+    """Describes statement parameters by type and size only, so values never reach the logs."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: params_shape(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [params_shape(value) for value in params]
+    if isinstance(params, (str, bytes, bytearray)):
+        return f"{type(params).__name__}[{len(params)}]"
+    return type(params).__name__
+
+class SlowQueryLog:
+    """
+    Writes statements slower than SLOW_QUERY_SECONDS to the `slow_query`
+    logger with their SQL, parameter shape and EXPLAIN output. EXPLAIN runs
+    after the statement has finished, on a dedicated autocommit connection in
+    its own thread, so it never delays the request or joins its transaction.
+    Each distinct statement is explained at most once per `explain_interval`.
+    """
+
+    _EXPLAINABLE = ("select", "insert", "update", "delete", "replace", "with")
+
+    def __init__(self, threshold: float, explain_interval: float, **connect_kwargs):
+        self.threshold = threshold
+        self.explain_interval = explain_interval
+        self._connect_kwargs = connect_kwargs
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query")
+        self._connection = None # Only used from the executor thread
+        self._lock = threading.Lock()
+        self._last_explained = {} # normalized SQL -> monotonic time
+        self._pending = 0
+        self.logged = 0
+        self.explained = 0
+
+    def record(self, operation, params, seconds: float, site: str, many: bool = False, error: Exception = None):
+        sql = _normalize_sql(operation)
+        now = time.monotonic()
+        with self._lock:
+            self.logged += 1
+            explain = (
+                not many
+                and sql.split(" ", 1)[0].lower() in self._EXPLAINABLE
+                and now - self._last_explained.get(sql, float("-inf")) >= self.explain_interval
+                and self._pending < SLOW_QUERY_MAX_PENDING
+            )
+            if explain:
+                self._last_explained[sql] = now
+                self._pending += 1
+        if explain:
+            context = contextvars.copy_context()
+            self._executor.submit(context.run, self._explain_and_log, sql, operation, params, seconds, site, error)
+        else:
+            self._log(sql, params, seconds, site, error, None, many)
+
+    def _explain_and_log(self, sql, operation, params, seconds, site, error):
+        try:
+            try:
+                plan = self._explain(operation, params)
+            except mysql.connector.Error as err:
+                plan = f"EXPLAIN failed: {err}"
+                self._reset_connection()
+            self._log(sql, params, seconds, site, error, plan, False)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _explain(self, operation, params):
+        if self._connection is None:
+            self._connection = mysql.connector.connect(**self._connect_kwargs)
+            self._connection.autocommit = True
+        cursor = self._connection.cursor(dictionary=True)
+        try:
+            cursor.execute(f"EXPLAIN {operation}", params)
+            self.explained += 1
+            return cursor.fetchall()
+        finally:
             cursor.close()
-            print("DB cursor closed.")
-        if db and db.is_connected():
-            db.close()
-            print("DB connection closed.")
\ No newline at end of file
+
+    def _reset_connection(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except mysql.connector.Error:
+                pass
+
+    def _log(self, sql, params, seconds, site, error, plan, many):
+        slow_query_logger.warning(
+            "Slow query (%.3fs) at %s", seconds, site,
+            extra={
+                "duration_ms": round(seconds * 1000, 3),
+                "call_site": site,
+                "sql": sql[:4000],
+                "params_shape": f"executemany x{len(params)}: {params_shape(params[0])}" if many and params else params_shape(params),
+                "explain": plan,
+                "error": repr(error) if error else None,
+            },
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "threshold_seconds": self.threshold,
+                "logged": self.logged,
+                "explained": self.explained,
+                "pending_explains": self._pending,
+            }
+
+slow_query_logger = logging.getLogger("slow_query")
+slow_query_log = SlowQueryLog(
+    SLOW_QUERY_SECONDS,
+    SLOW_QUERY_EXPLAIN_INTERVAL,
+    host=DB_HOST,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    database=DB_NAME,
+)
+
+def _timed_statement(method, site: str, operation, params):
+    """Runs one cursor call in the executor thread; returns (seconds, exception or None)."""
+    started = time.perf_counter()
+    error = None
+    try:
+        method(operation, params)
+    except Exception as e:
+        error = e
+    seconds = time.perf_counter() - started
+    if METRICS_ENABLED:
+        db_query_duration.observe(seconds, site)
+        if error is not None:
+            db_query_errors.inc(site)
+    return seconds, error
+
+class AsyncCursor:
+    """Awaitable wrapper around a buffered dictionary cursor."""
+
+    def __init__(self, cursor, checkout: _Checkout):
+        self._cursor = cursor
+        self._checkout = checkout
+
+    async def execute(self, operation, params=None):
+        await self._run(self._cursor.execute, operation, params, False)
+
+    async def executemany(self, operation, seq_params):
+        await self._run(self._cursor.executemany, operation, seq_params, True)
+
+    async def _run(self, method, operation, params, many: bool):
+        # Each statement is timed in the executor thread (excluding executor queueing),
+        # traced, and attributed to the function that awaited execute()/executemany().
+        site = call_site(3)
+        with tracing.span("db.query", {"code.function": site}) as query_span:
+            if query_span is not None:
+                query_span.set_attribute("db.statement", _normalize_sql(operation)[:1000])
+            seconds, error = await self._checkout.run(_timed_statement, method, site, operation, params)
+            if slow_query_log.threshold and seconds >= slow_query_log.threshold:
+                slow_query_log.record(operation, params, seconds, site, many, error)
+            if error is not None:
+                raise error
+
+    # The cursor is buffered, so rows are already in memory after execute().
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+    async def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+class AsyncConnection:
+    """Awaitable wrapper exposing transaction control for a pooled connection."""
+
+    def __init__(self, connection, checkout: _Checkout):
+        self._connection = connection
+        self._checkout = checkout
+
+    async def commit(self):
+        await self._checkout.run(self._connection.commit)
+
+    async def rollback(self):
+        await self._checkout.run(self._connection.rollback)
+
+async def _acquire_async_checkout_slot():
+    global _async_checkout_gate
+    if _async_checkout_gate is None:
+        _async_checkout_gate = asyncio.Semaphore(pool.size + pool.max_overflow)
+    try:
+        await asyncio.wait_for(_async_checkout_gate.acquire(), timeout=pool.timeout)
+    except asyncio.TimeoutError:
+        raise PoolTimeoutError(f"Timed out after {pool.timeout}s waiting for a DB connection.")
+    return _async_checkout_gate
+
+@asynccontextmanager
+async def get_async_db():
+    """Async counterpart of get_db: yields (AsyncConnection, AsyncCursor) with transaction handling."""
+    gate = await _acquire_async_checkout_slot()
+    checkout = _Checkout()
+    try:
+        entry = await checkout.run(pool.acquire)
+    except BaseException:
+        if checkout.in_flight is not None:
+            checkout.in_flight.add_done_callback(functools.partial(_release_abandoned_acquire, gate))
+        else:
+            gate.release()
+        raise
+    db = entry.connection
+    cursor = None
+    discard = False
+    try:
+        cursor = db.cursor(dictionary=True, buffered=True)
+        yield AsyncConnection(db, checkout), AsyncCursor(cursor, checkout)
+        await checkout.run(db.commit) # Commit if the 'async with' block succeeded
+    except mysql.connector.Error as err:
+        logger.error("Database Error, rolling back transaction: %s", err)
+        discard = not await checkout.run(_safe_rollback, db)
+        raise
+    except BaseException as e:
+        if checkout.in_flight is None:
+            logger.debug("Rolling back transaction due to non-DB error: %r", e)
+            discard = not await checkout.run(_safe_rollback, db)
+        raise
+    finally:
+        interrupted = checkout.in_flight
+        if interrupted is not None:
+            # Cancelled mid-statement: the statement still runs in a worker thread, so the
+            # connection is neither rolled back nor reused; it is closed once the thread is done
+            logger.debug("Discarding DB connection with an interrupted statement")
+            interrupted.add_done_callback(lambda _: _release_checkout(entry, True, gate))
+        else:
+            if cursor:
+                try:
+                    cursor.close() # Buffered cursor: no pending network reads
+                except mysql.connector.Error:
+                    discard = True
+            # Shielded: a second cancellation must not skip returning the connection
+            await asyncio.shield(_release_checkout(entry, discard, gate))
@@ -0,0 +1,119 @@
+# documents/compression.py
+# Optional compression of version files at rest. A stored file's codec is
+# recorded in the DB (blobs.codec / document_versions.codec) and mirrored in its
+# file name suffix (".pdf.gz", ".pdf.zst"), so readers holding only a path can
+# still decode it. Codec names are HTTP content-codings, which lets downloads
+# send a compressed file as-is to clients that accept that encoding.
+#
+# zstd needs the optional `zstandard` package; gzip is always available.
+import os
+import logging
+import gzip
+import shutil
+from typing import Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError: # Optional dependency
+    zstandard = None
+
+CODEC_IDENTITY = "identity"
+CODEC_GZIP = "gzip"
+CODEC_ZSTD = "zstd"
+CODEC_SUFFIXES = {CODEC_GZIP: ".gz", CODEC_ZSTD: ".zst"}
+
+# identity (store raw, the default), gzip or zstd
+STORAGE_CODEC = os.getenv("STORAGE_CODEC", CODEC_IDENTITY).lower()
+STORAGE_COMPRESSION_LEVEL = os.getenv("STORAGE_COMPRESSION_LEVEL") # Codec default when unset
+# Keep the raw file unless compression saves at least this fraction of its size
+STORAGE_MIN_SAVINGS = float(os.getenv("STORAGE_MIN_SAVINGS", 0.1))
+COMPRESSION_CHUNK_SIZE = 256 * 1024
+
+def available_codecs() -> Tuple[str, ...]:
+    """Codecs usable in this process."""
+    codecs = [CODEC_IDENTITY, CODEC_GZIP]
+    if zstandard is not None:
+        codecs.append(CODEC_ZSTD)
+    return tuple(codecs)
+
+def resolve_codec(codec: Optional[str] = None) -> str:
+    """Returns `codec` (or STORAGE_CODEC), falling back to gzip when zstd is not installed."""
+    codec = (codec or STORAGE_CODEC).lower()
+    if codec == CODEC_ZSTD and zstandard is None:
+        logger.warning("zstd storage requested but the 'zstandard' package is not installed; using gzip.")
+        return CODEC_GZIP
+    if codec not in available_codecs():
+        raise ValueError(f"Unknown storage codec: {codec}")
+    return codec
+
+def codec_for_path(file_path: str) -> str:
+    """Returns the codec a stored file was written with, from its suffix."""
+    for codec, suffix in CODEC_SUFFIXES.items():
+        if file_path.endswith(suffix):
+            return codec
+    return CODEC_IDENTITY
+
+def strip_codec_suffix(file_path: str) -> str:
+    """Returns the path of the uncompressed file name ("x.pdf.gz" -> "x.pdf")."""
+    codec = codec_for_path(file_path)
+    if codec == CODEC_IDENTITY:
+        return file_path
+    return file_path[: -len(CODEC_SUFFIXES[codec])]
+
+def with_codec_suffix(file_path: str, codec: str) -> str:
+    """Returns the stored file name for `file_path` written with `codec`."""
+    return file_path + CODEC_SUFFIXES.get(codec, "")
+
+def _open_compressed_writer(target, codec: str):
+    if codec == CODEC_GZIP:
+        level = int(STORAGE_COMPRESSION_LEVEL) if STORAGE_COMPRESSION_LEVEL else 6
+        # mtime=0 keeps the output deterministic for identical content
+        return gzip.GzipFile(fileobj=target, mode="wb", compresslevel=level, mtime=0)
+    level = int(STORAGE_COMPRESSION_LEVEL) if STORAGE_COMPRESSION_LEVEL else 3
+    return zstandard.ZstdCompressor(level=level).stream_writer(target, closefd=False)
+
+def compress_file(source_path: str, target_path: str, codec: str) -> bool:
+    """
+    Writes `source_path` compressed with `codec` to `target_path` (blocking).
+    Returns False, leaving no target behind, when compression would not save at
+    least STORAGE_MIN_SAVINGS (already-compressed PDFs), so callers store raw.
+    """
+    raw_size = os.path.getsize(source_path)
+    partial_path = target_path + ".part"
+    try:
+        with open(source_path, "rb") as source, open(partial_path, "wb") as target:
+            with _open_compressed_writer(target, codec) as writer:
+                shutil.copyfileobj(source, writer, COMPRESSION_CHUNK_SIZE)
+        if os.path.getsize(partial_path) > raw_size * (1 - STORAGE_MIN_SAVINGS):
+            os.remove(partial_path)
+            return False
+        os.replace(partial_path, target_path)
+        return True
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+def open_decompressed(file_path: str):
+    """Opens a stored file for reading its original bytes (blocking)."""
+    codec = codec_for_path(file_path)
+    if codec == CODEC_GZIP:
+        return gzip.open(file_path, "rb")
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError(f"Cannot read {file_path}: the 'zstandard' package is not installed.")
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, "rb"), closefd=True)
+    return open(file_path, "rb")
+
+def read_decompressed(file_path: str) -> bytes:
+    """Returns the original bytes of a stored file (blocking)."""
+    with open_decompressed(file_path) as f:
+        return f.read()
+
+def iter_decompressed(file_path: str, chunk_size: int = COMPRESSION_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yields the original bytes of a stored file in chunks (blocking)."""
+    with open_decompressed(file_path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
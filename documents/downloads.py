@@ -0,0 +1,207 @@
+# documents/downloads.py
+# HTTP validators, conditional GET and byte ranges for version downloads.
+# Version files never change once uploaded, so a download is identified by a
+# strong ETag (the blob's SHA-256), may be cached by the browser indefinitely,
+# and can be fetched piecewise by PDF viewers with Range requests. Files stored
+# compressed are sent as-is to clients accepting their encoding, and decoded
+# on the fly for everyone else.
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+from fastapi import Request, Response, status
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+
+from documents.compression import CODEC_IDENTITY, open_decompressed
+
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", 256 * 1024)) # Bytes read per step of a range response
+# Versions are immutable: let the (private) browser cache keep them for a year without revalidating
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def version_etag(blob_sha256: Optional[str], version_id: int, size_bytes: int) -> str:
+    """Strong ETag for a version: its content digest, or its immutable row id for pre-blob versions."""
+    if blob_sha256:
+        return f'"{blob_sha256}"'
+    return f'"v{version_id}-{size_bytes}"'
+
+def http_date(value: datetime) -> str:
+    """Formats a datetime (naive values are taken as UTC) as an HTTP-date."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+def _etag_matches(header_value: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match list against our ETag (RFC 9110 13.1.2)."""
+    if header_value.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header_value.split(","))
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    """True if the client's validators show its cached copy is current."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since when both are sent
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        modified = last_modified if last_modified.tzinfo else last_modified.replace(tzinfo=timezone.utc)
+        # HTTP-dates have one-second resolution
+        return modified.replace(microsecond=0) <= since
+    return False
+
+def parse_byte_range(range_header: str, size_bytes: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single "bytes=start-end" / "bytes=start-" / "bytes=-suffix" range into an
+    inclusive (start, end) pair. Returns None for headers we serve as a full 200
+    (multiple ranges, other units, malformed values). Raises ValueError when the
+    range cannot be satisfied for a file of `size_bytes`.
+    """
+    units, _, spec = range_header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    first, last = first.strip(), last.strip()
+    if not (first.isdigit() or first == "") or not (last.isdigit() or last == "") or first == last == "":
+        return None
+    if first == "":
+        suffix = int(last)
+        if suffix == 0 or size_bytes == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size_bytes - suffix), size_bytes - 1
+    start = int(first)
+    end = int(last) if last else size_bytes - 1
+    if end < start:
+        return None
+    if start >= size_bytes:
+        raise ValueError("range starts past the end of the file")
+    return start, min(end, size_bytes - 1)
+
+def _read_file_range(file_path: str, start: int, length: int) -> bytes:
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+async def _iter_file_range(file_path: str, start: int, end: int):
+    """Yields bytes start..end (inclusive) of a file, reading off the event loop."""
+    position = start
+    while position <= end:
+        length = min(DOWNLOAD_CHUNK_SIZE, end - position + 1)
+        chunk = await run_in_threadpool(_read_file_range, file_path, position, length)
+        if not chunk:
+            break
+        position += len(chunk)
+        yield chunk
+
+def _read_chunk(handle, size: int) -> bytes:
+    return handle.read(size)
+
+async def _iter_decompressed(file_path: str):
+    """Yields the original bytes of a compressed file, decoding off the event loop."""
+    handle = await run_in_threadpool(open_decompressed, file_path)
+    try:
+        while True:
+            chunk = await run_in_threadpool(_read_chunk, handle, DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await run_in_threadpool(handle.close)
+
+def accepts_encoding(request: Request, coding: str) -> bool:
+    """True if the Accept-Encoding header allows `coding` (q > 0)."""
+    for entry in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if name.strip().lower() not in (coding, "*"):
+            continue
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+def content_disposition(filename: str) -> str:
+    """attachment header with an ASCII fallback plus the RFC 5987 UTF-8 name."""
+    ascii_name = filename.encode("ascii", "replace").decode("ascii").replace('"', "")
+    return f'attachment; filename="{ascii_name}"; filename*=utf-8\'\'{quote(filename)}'
+
+def version_file_response(
+    request: Request,
+    file_path: str,
+    etag: str,
+    last_modified: datetime,
+    filename: str,
+    media_type: str,
+    codec: str = CODEC_IDENTITY,
+) -> Response:
+    """
+    Builds the response for downloading an immutable version file: 304 when the
+    client's copy is current, 206 for a satisfiable single byte range, 416 for an
+    unsatisfiable one, otherwise the whole file. Compressed files (`codec` other
+    than identity) are served without ranges, encoded or decoded per Accept-Encoding.
+    """
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if codec != CODEC_IDENTITY:
+        # Range requests get the decoded body (in full): ranges over encoded bytes are useless to viewers
+        send_encoded = accepts_encoding(request, codec) and "range" not in request.headers
+        headers["Accept-Ranges"] = "none"
+        headers["Vary"] = "Accept-Encoding"
+        if send_encoded:
+            # A different representation needs its own strong validator
+            headers["ETag"] = etag = f'{etag[:-1]}-{codec}"'
+            headers["Content-Encoding"] = codec
+        if is_not_modified(request, etag, last_modified):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        headers["Content-Disposition"] = content_disposition(filename)
+        if send_encoded:
+            # Fast path: the bytes on disk already are the response body
+            return FileResponse(path=file_path, media_type=media_type, headers=headers)
+        return StreamingResponse(_iter_decompressed(file_path), media_type=media_type, headers=headers)
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    size_bytes = os.path.getsize(file_path)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # A stale If-Range (anything but our strong ETag or date) means "send the whole file"
+    if range_header and (if_range is None or if_range in (etag, headers["Last-Modified"])):
+        try:
+            byte_range = parse_byte_range(range_header, size_bytes)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{size_bytes}"},
+            )
+        if byte_range is not None:
+            start, end = byte_range
+            return StreamingResponse(
+                _iter_file_range(file_path, start, end),
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                media_type=media_type,
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {start}-{end}/{size_bytes}",
+                    "Content-Length": str(end - start + 1),
+                    "Content-Disposition": content_disposition(filename),
+                },
+            )
+
+    return FileResponse(path=file_path, filename=filename, media_type=media_type, headers=headers)
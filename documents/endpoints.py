@@ -1,77 +1,107 @@
 # documents/endpoints.py
 import os
-import shutil
-import time
+import logging
 import mimetypes
-import traceback
+import json
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
 from typing import List, Optional, Dict # Import Dict
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, Depends, Query
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, Depends, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 import mysql.connector
 
-# Import PyMuPDF for PDF text extraction
-import fitz # PyMuPDF
-
-from database import get_db
+from database import get_async_db
+from tracing import traced
+from pagination import NEXT_CURSOR_HEADER, decode_cursor, next_cursor
 from auth import get_current_user, require_role, UserInDB # Import authentication dependency, role checker, and UserInDB model
 # Import Document model and add owner_username to it for the response
 from documents.models import Document, DocumentVersion, SearchResults # Import models
-from documents.utils import sanitize_filename # Import utility function
+from documents.utils import sanitize_filename, escape_like # Import utility functions
+from documents.storage import is_within_upload_dir, resolve_stored_path, remove_stored_file
+from documents import storage
+from documents.extraction import text_cache
+from documents.jobs import EXTRACT_TEXT_JOB, VERIFY_BLOB_JOB, RENDER_PREVIEW_JOB
+from jobs.queue import job_queue, enqueue as enqueue_job, enqueue_many as enqueue_many_jobs
+from documents import search_index, text_store
+from documents.downloads import (
+    IMMUTABLE_CACHE_CONTROL, version_etag, version_file_response, content_disposition, is_not_modified,
+)
+from documents.previews import PREVIEW_DEFAULT_WIDTH, PREVIEW_MAX_PAGE, snap_width, get_preview, content_key as preview_content_key
+from documents.export import EXPORT_MAX_DOCUMENTS, iter_zip
+from documents.compression import CODEC_IDENTITY, strip_codec_suffix
+
+logger = logging.getLogger(__name__)
 
-# Configuration (can move to a separate config file if needed)
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True) # Ensure upload directory exists
+# Matches fetched per query while streaming search results
+SEARCH_STREAM_BATCH_SIZE = int(os.getenv("SEARCH_STREAM_BATCH_SIZE", 20))
 
 router = APIRouter(
     prefix="/documents",
     tags=["documents"]
 )
 
-def read_text_from_file(file_path: str) -> str:
-    """Reads text content from a file, supporting PDF and plain text."""
-    try:
-        # Check if the file exists and is within the allowed upload directory
-        if not os.path.exists(file_path) or not os.path.isfile(file_path):
-            print(f"Warning: File not found for content search: {file_path}")
-            return "" # Return empty string if file not found
-
+@traced("storage.remove_version_files")
+def _remove_version_files(file_paths: List[str]) -> int:
+    """Deletes version files inside UPLOAD_DIR (blocking; run in the threadpool). Returns the count removed."""
+    deleted_count = 0
+    for file_path in file_paths:
         # Security check: Ensure the file path is within the UPLOAD_DIR
-        # This prevents directory traversal attacks
-        if not os.path.commonpath([os.path.abspath(UPLOAD_DIR), os.path.abspath(file_path)]) == os.path.abspath(UPLOAD_DIR):
-             print(f"Security Alert: Attempted to read file outside UPLOAD_DIR during content search: {file_path}")
-             return "" # Return empty string for invalid path
+        if not is_within_upload_dir(file_path):
+             logger.warning(f"Security Alert: Attempted to delete file outside UPLOAD_DIR: {file_path}")
+             # Log the security attempt but continue with DB deletion
+             continue # Skip deleting this specific file, but don't fail the request
 
-        mime_type, _ = mimetypes.guess_type(file_path)
+        text_cache.invalidate(file_path)
+        try:
+            if remove_stored_file(file_path): # Covers both layouts while a shard migration runs
+                deleted_count += 1
+                logger.debug("Deleted file: %s", file_path)
+        except OSError as e:
+            logger.error(f"Error deleting file {file_path}: {e}")
+            # Log the error but continue if other files/DB deletion succeeded
+    return deleted_count
 
-        if mime_type == 'application/pdf':
-            try:
-                doc = fitz.open(file_path)
-                text = ""
-                for page_num in range(doc.page_count):
-                    page = doc.load_page(page_num)
-                    text += page.get_text()
-                doc.close()
-                return text
-            except Exception as pdf_error:
-                print(f"Error reading PDF file {file_path}: {pdf_error}")
-                return "" # Return empty string on PDF read error
-        elif mime_type and mime_type.startswith('text/'):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except Exception as text_error:
-                print(f"Error reading text file {file_path}: {text_error}")
-                return "" # Return empty string on text file read error
-        else:
-            # Handle other known types or skip unsupported ones
-            # For simplicity, we only support PDF and basic text files for content search
-            print(f"Info: Skipping content search for unsupported file type: {mime_type} ({file_path})")
-            return "" # Skip unsupported types
 
-    except Exception as general_error:
-        print(f"Unexpected error in read_text_from_file for {file_path}: {general_error}")
-        return "" # Catch any other unexpected errors
+def _can_access(current_user: UserInDB, owner_id: int, owner_role: str) -> bool:
+    """Owner OR recruiter viewing a document owned by a 'user' (applicant)."""
+    is_owner = owner_id == current_user.id
+    is_recruiter_viewing_user_doc = current_user.role == 'recruiter' and owner_role == 'user'
+    return is_owner or is_recruiter_viewing_user_doc
+
+async def _receive_version_file(file: UploadFile, file_ext: str):
+    """
+    Copies an upload to a unique temp file in chunks, hashing as it goes (disk
+    writes run in the threadpool so the event loop keeps serving other requests).
+    Returns (temp_path, sha256, size_bytes); raises 413/415/500 HTTPExceptions.
+    """
+    try:
+        return await storage.receive_upload(file, file_ext)
+    except storage.UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except storage.UnsupportedUploadError as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+    except Exception as e:
+        logger.exception(f"Error saving file: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to save file: {e}",
+        )
+    finally:
+        await file.close()
 
+@traced("storage.remove_temp_files")
+def _remove_temp_files(file_paths: List[str]):
+    """Removes staged upload files left behind by a failed request (blocking)."""
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+                logger.debug("Cleaned up temporary file: %s", file_path)
+            except OSError as rm_err:
+                logger.error(f"Error removing temporary file {file_path}: {rm_err}")
 
 # Only users with the 'user' role (Applicants) can upload documents
 @router.post("/", status_code=status.HTTP_201_CREATED)
@@ -94,30 +124,18 @@ async def upload_document_or_version(
     file_ext = os.path.splitext(original_filename)[1]
     # Use the sanitized filename as the document title
     document_slug = sanitize_filename(original_filename)
-    timestamp = int(time.time())
-    temp_save_path = os.path.join(UPLOAD_DIR, f"temp_{timestamp}_{original_filename.replace(' ', '_')}")
 
-    try:
-        with open(temp_save_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        print(f"Error saving file: {e}")
-        traceback.print_exc()
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to save file: {e}",
-        )
-    finally:
-        await file.close()
+    temp_save_path, content_sha256, size_bytes = await _receive_version_file(file, file_ext)
 
     final_file_path = None # Initialize to None
+    written_blobs = [] # Blob files this request creates, removed again if its transaction rolls back
     try:
-        with get_db() as (db, cursor):
+        async with get_async_db() as (db, cursor):
             # FIX: Modify the query to check for a document with the same title AND owned by the current user
-            cursor.execute(
+            await cursor.execute(
                 "SELECT id, owner_id FROM documents WHERE title = %s AND owner_id = %s", (document_slug, current_user.id)
             )
-            doc_result = cursor.fetchone()
+            doc_result = await cursor.fetchone()
 
             document_id: int
             version: int
@@ -127,23 +145,23 @@ async def upload_document_or_version(
                 document_id = doc_result["id"]
                 # No need to check owner_id again here, as the query already filtered by it.
 
-                cursor.execute(
+                await cursor.execute(
                     "SELECT MAX(version) AS max_version FROM document_versions WHERE document_id = %s",
                     (document_id,),
                 )
-                version_result = cursor.fetchone()
+                version_result = await cursor.fetchone()
                 version = (version_result["max_version"] or 0) + 1
 
                 # Update document description only if provided
                 if description is not None:
-                    cursor.execute(
+                    await cursor.execute(
                         "UPDATE documents SET description = %s WHERE id = %s",
                         (description, document_id),
                     )
             else:
                 # No document with this title owned by this user exists. Create a new document.
                 version = 1
-                cursor.execute(
+                await cursor.execute(
                     "INSERT INTO documents (title, description, owner_id, created_at) VALUES (%s, %s, %s, NOW())",
                     (document_slug, description, current_user.id),
                 )
@@ -151,22 +169,20 @@ async def upload_document_or_version(
                 if not document_id:
                     raise Exception("Failed to get last insert ID for new document.")
 
-            # Construct the final file path using the document slug, version, timestamp, and extension
-            final_filename = f"{document_slug}_v{version}_{timestamp}{file_ext}"
-            final_file_path = os.path.join(UPLOAD_DIR, final_filename)
-
             try:
-                # Rename the temporary file to its final name and location
-                os.rename(temp_save_path, final_file_path)
+                # Store the bytes content-addressed: identical uploads share one blob on disk
+                final_file_path, storage_codec = await storage.store_blob(
+                    cursor, temp_save_path, content_sha256, file_ext, size_bytes=size_bytes, written=written_blobs
+                )
             except OSError as e:
-                print(f"Error renaming file from {temp_save_path} to {final_file_path}: {e}")
+                logger.error(f"Error moving file {temp_save_path} into the blob store: {e}")
                 # Attempt to clean up the temporary file if renaming fails
                 if os.path.exists(temp_save_path):
                     try:
                         os.remove(temp_save_path)
-                        print(f"Cleaned up temporary file: {temp_save_path}")
+                        logger.debug("Cleaned up temporary file: %s", temp_save_path)
                     except OSError as rm_err:
-                        print(f"Error cleaning up temporary file {temp_save_path} after rename failure: {rm_err}")
+                        logger.error(f"Error cleaning up temporary file {temp_save_path} after rename failure: {rm_err}")
                 # Re-raise the exception to indicate failure
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -174,20 +190,27 @@ async def upload_document_or_version(
                 )
 
             # Insert the new version into the document_versions table
-            cursor.execute(
-                "INSERT INTO document_versions (document_id, version, file_path, uploaded_at) VALUES (%s, %s, %s, NOW())",
-                (document_id, version, final_file_path),
+            await cursor.execute(
+                "INSERT INTO document_versions (document_id, version, file_path, blob_sha256, codec, uploaded_at) VALUES (%s, %s, %s, %s, %s, NOW())",
+                (document_id, version, final_file_path, content_sha256, storage_codec),
             )
             version_id = cursor.lastrowid
             if not version_id:
                 raise Exception("Failed to get last insert ID for new version.")
 
             # Update the latest_file_path in the documents table
-            cursor.execute(
+            await cursor.execute(
                 "UPDATE documents SET latest_file_path = %s WHERE id = %s",
                 (final_file_path, document_id),
             )
 
+            # Text extraction and re-indexing run in the background once this commits
+            await enqueue_job(cursor, EXTRACT_TEXT_JOB, {"version_id": version_id})
+            await enqueue_job(cursor, RENDER_PREVIEW_JOB, {"version_id": version_id})
+            if storage_codec != CODEC_IDENTITY:
+                await enqueue_job(cursor, VERIFY_BLOB_JOB, {"sha256": content_sha256})
+        job_queue.notify()
+
         # Return a success response with details about the upload
         return {
             "message": f"File '{original_filename}' uploaded successfully as version {version} for document '{document_slug}'.",
@@ -202,60 +225,267 @@ async def upload_document_or_version(
         # Handle specific database or HTTP exceptions
         # Attempt to clean up the temporary file in case of error
         if os.path.exists(temp_save_path):
-            print(f"Cleaning up temporary file due to DB/HTTP error: {temp_save_path}")
+            logger.debug("Cleaning up temporary file due to DB/HTTP error: %s", temp_save_path)
             try:
                 os.remove(temp_save_path)
             except OSError as rm_err:
-                print(f"Error removing temporary file {temp_save_path}: {rm_err}")
+                logger.error(f"Error removing temporary file {temp_save_path}: {rm_err}")
+        await storage.discard_uncommitted_blobs(written_blobs)
         raise e # Re-raise the exception
 
     except Exception as e:
         # Handle any other unexpected errors
-        print(f"Unexpected error during DB operations, file rename, or other: {e}")
-        traceback.print_exc()
+        logger.exception(f"Unexpected error during DB operations, file rename, or other: {e}")
         # Attempt to clean up the temporary file in case of unexpected error
         if os.path.exists(temp_save_path):
-            print(f"Cleaning up temporary file due to unexpected error: {temp_save_path}")
+            logger.debug("Cleaning up temporary file due to unexpected error: %s", temp_save_path)
             try:
                 os.remove(temp_save_path)
             except OSError as rm_err:
-                print(f"Error removing temporary file {temp_save_path}: {rm_err}")
+                logger.error(f"Error removing temporary file {temp_save_path}: {rm_err}")
+        await storage.discard_uncommitted_blobs(written_blobs)
         # Raise a generic internal server error
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An internal server error occurred: {e}",
         )
-    
+
+
+def _placeholders(values) -> str:
+    return ", ".join(["%s"] * len(values))
+
+# Only users with the 'user' role (Applicants) can upload documents
+@router.post("/batch", status_code=status.HTTP_201_CREATED)
+async def upload_documents_batch(
+    description: Optional[str] = Form(None),
+    files: List[UploadFile] = File(...),
+    current_user: UserInDB = Depends(require_role(["user"])),
+):
+    """
+    Uploads several files in one request. Each file becomes a new document or a
+    new version of the caller's document with the same title, exactly as with
+    POST /documents/, but all rows are written in a single transaction.
+    Returns one result per file, in request order; files that cannot be
+    accepted (empty name, too large, not a PDF) are reported without failing
+    the rest of the batch.
+    """
+    if len(files) > storage.MAX_BATCH_UPLOAD_FILES:
+        for file in files:
+            await file.close()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {storage.MAX_BATCH_UPLOAD_FILES} files can be uploaded per batch.",
+        )
+
+    # 1. Stream every file to storage; per-file rejections do not stop the batch
+    results: List[Dict] = []
+    accepted: List[Dict] = []
+    for file in files:
+        original_filename = file.filename
+        if not original_filename:
+            await file.close()
+            results.append({"filename": original_filename, "status_code": status.HTTP_400_BAD_REQUEST,
+                            "detail": "Filename cannot be empty."})
+            continue
+        file_ext = os.path.splitext(original_filename)[1]
+        try:
+            temp_path, content_sha256, size_bytes = await _receive_version_file(file, file_ext)
+        except HTTPException as e:
+            if e.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR:
+                await run_in_threadpool(_remove_temp_files, [item["temp_path"] for item in accepted])
+                raise
+            results.append({"filename": original_filename, "status_code": e.status_code, "detail": e.detail})
+            continue
+        item = {
+            "filename": original_filename,
+            "title": sanitize_filename(original_filename),
+            "file_ext": file_ext,
+            "temp_path": temp_path,
+            "sha256": content_sha256,
+            "size_bytes": size_bytes,
+        }
+        accepted.append(item)
+        results.append(item)
+
+    if not accepted:
+        return {"uploaded": 0, "results": results}
+
+    written_blobs = [] # Blob files this batch creates, removed again if its transaction rolls back
+    try:
+        async with get_async_db() as (db, cursor):
+            titles = list(dict.fromkeys(item["title"] for item in accepted))
+
+            # 2. Resolve titles to documents: existing ones are locked so version numbers cannot race
+            await cursor.execute(
+                f"SELECT id, title FROM documents WHERE owner_id = %s AND title IN ({_placeholders(titles)}) FOR UPDATE",
+                (current_user.id, *titles),
+            )
+            document_ids = {row["title"]: row["id"] for row in await cursor.fetchall()}
+            existing_ids = list(document_ids.values())
+            new_titles = [title for title in titles if title not in document_ids]
+            if new_titles:
+                # A concurrent upload may have created the same title meanwhile: keep its row
+                await cursor.executemany(
+                    """
+                    INSERT INTO documents (title, description, owner_id, created_at) VALUES (%s, %s, %s, NOW())
+                    ON DUPLICATE KEY UPDATE id = id
+                    """,
+                    [(title, description, current_user.id) for title in new_titles],
+                )
+                await cursor.execute(
+                    f"SELECT id, title FROM documents WHERE owner_id = %s AND title IN ({_placeholders(new_titles)}) FOR UPDATE",
+                    (current_user.id, *new_titles),
+                )
+                document_ids.update({row["title"]: row["id"] for row in await cursor.fetchall()})
+            if description is not None and existing_ids:
+                await cursor.execute(
+                    f"UPDATE documents SET description = %s WHERE id IN ({_placeholders(existing_ids)})",
+                    (description, *existing_ids),
+                )
+
+            # 3. Next version number of every document in one query
+            all_ids = list(document_ids.values())
+            await cursor.execute(
+                f"""
+                SELECT document_id, MAX(version) AS max_version FROM document_versions
+                WHERE document_id IN ({_placeholders(all_ids)})
+                GROUP BY document_id
+                """,
+                tuple(all_ids),
+            )
+            max_versions = {row["document_id"]: row["max_version"] for row in await cursor.fetchall()}
+            for item in accepted:
+                item["document_id"] = document_ids[item["title"]]
+                item["version"] = max_versions.get(item["document_id"], 0) + 1
+                max_versions[item["document_id"]] = item["version"] # Same title twice: consecutive versions
+
+            # 4. Store the files content-addressed, then insert every version row at once
+            for item in accepted:
+                item["file_path"], item["codec"] = await storage.store_blob(
+                    cursor, item.pop("temp_path"), item["sha256"], item["file_ext"], size_bytes=item["size_bytes"],
+                    written=written_blobs,
+                )
+            await cursor.executemany(
+                "INSERT INTO document_versions (document_id, version, file_path, blob_sha256, codec, uploaded_at) VALUES (%s, %s, %s, %s, %s, NOW())",
+                [(item["document_id"], item["version"], item["file_path"], item["sha256"], item["codec"]) for item in accepted],
+            )
+            version_keys = [(item["document_id"], item["version"]) for item in accepted]
+            await cursor.execute(
+                f"""
+                SELECT id, document_id, version FROM document_versions
+                WHERE (document_id, version) IN ({", ".join(["(%s, %s)"] * len(version_keys))})
+                """,
+                tuple(value for key in version_keys for value in key),
+            )
+            version_ids = {(row["document_id"], row["version"]): row["id"] for row in await cursor.fetchall()}
+            latest = {}
+            for item in accepted:
+                item["version_id"] = version_ids[(item["document_id"], item["version"])]
+                latest[item["document_id"]] = item # Later files of the same title win
+            await cursor.executemany(
+                "UPDATE documents SET latest_file_path = %s WHERE id = %s",
+                [(item["file_path"], document_id) for document_id, item in latest.items()],
+            )
+
+            # 5. Text extraction and re-indexing run in the background once this commits
+            await enqueue_many_jobs(cursor, EXTRACT_TEXT_JOB, [{"version_id": item["version_id"]} for item in accepted])
+            await enqueue_many_jobs(cursor, RENDER_PREVIEW_JOB, [{"version_id": item["version_id"]} for item in accepted])
+            await enqueue_many_jobs(
+                cursor, VERIFY_BLOB_JOB,
+                [{"sha256": sha256} for sha256 in dict.fromkeys(
+                    item["sha256"] for item in accepted if item["codec"] != CODEC_IDENTITY
+                )],
+            )
+        job_queue.notify()
+
+    except mysql.connector.Error as e:
+        logger.error(f"DB Error during batch upload for user {current_user.id}: {e}")
+        await run_in_threadpool(_remove_temp_files, [item["temp_path"] for item in accepted if "temp_path" in item])
+        await storage.discard_uncommitted_blobs(written_blobs)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error during batch upload.",
+        )
+    except Exception as e:
+        logger.exception(f"Unexpected error during batch upload for user {current_user.id}: {e}")
+        await run_in_threadpool(_remove_temp_files, [item["temp_path"] for item in accepted if "temp_path" in item])
+        await storage.discard_uncommitted_blobs(written_blobs)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An internal server error occurred: {e}",
+        )
+
+    for item in accepted:
+        item.update({
+            "status_code": status.HTTP_201_CREATED,
+            "detail": f"Uploaded as version {item['version']} for document '{item['title']}'.",
+        })
+    return {
+        "uploaded": len(accepted),
+        "results": [
+            {
+                key: item[key]
+                for key in ("filename", "status_code", "detail", "document_id", "version_id", "version", "title")
+                if key in item
+            }
+            for item in results
+        ],
+    }
+
+def _created_at_keyset(cursor: Optional[str], skip: int, limit: int, prefix: str):
+    """
+    Returns (sql, params) paging a newest-first (created_at, id) listing: a keyset
+    condition plus LIMIT params when a cursor is given, otherwise LIMIT/OFFSET params.
+    `prefix` is the table alias ("d.") or "" for unaliased queries.
+    """
+    if not cursor:
+        return "", (limit, skip)
+    created_at, last_id = decode_cursor(cursor, (datetime.fromisoformat, int))
+    keyset_sql = f"AND ({prefix}created_at < %s OR ({prefix}created_at = %s AND {prefix}id < %s))"
+    return keyset_sql, (created_at, created_at, last_id, limit)
+
+def _set_next_cursor(response: Response, docs: List[dict], limit: int):
+    """Adds the X-Next-Cursor header for a newest-first document page."""
+    cursor = next_cursor(docs, limit, lambda doc: (doc["created_at"], doc["id"]))
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+
 # Users can only get documents they own
 # Recruiters will use a different endpoint to see applicant documents
 @router.get("/", response_model=List[Document])
 async def get_documents(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header; replaces skip"),
     current_user: UserInDB = Depends(require_role(["user"])), # Restrict to 'user' role
 ):
-    """Retrieves a list of documents owned by the current user (Applicant)."""
+    """
+    Retrieves a list of documents owned by the current user (Applicant), newest first.
+    The cursor for the next page is returned in the X-Next-Cursor header.
+    """
+    keyset_sql, page_params = _created_at_keyset(cursor, skip, limit, "")
     try:
-        with get_db() as (db, cursor):
-            query = """
+        async with get_async_db() as (db, db_cursor):
+            query = f"""
                 SELECT id, title, description, latest_file_path, created_at
                 FROM documents
-                WHERE owner_id = %s
-                ORDER BY created_at DESC
-                LIMIT %s OFFSET %s
+                WHERE owner_id = %s {keyset_sql}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s {"" if cursor else "OFFSET %s"}
             """
-            cursor.execute(query, (current_user.id, limit, skip))
-            docs = cursor.fetchall()
+            await db_cursor.execute(query, (current_user.id, *page_params))
+            docs = await db_cursor.fetchall()
+            _set_next_cursor(response, docs, limit)
             return docs
     except mysql.connector.Error as e:
-        print(f"DB Error fetching documents for user {current_user.id}: {e}")
+        logger.error(f"DB Error fetching documents for user {current_user.id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database error fetching documents.",
         )
     except Exception as e:
-        print(f"Error fetching documents for user {current_user.id}: {e}")
-        traceback.print_exc()
+        logger.exception(f"Error fetching documents for user {current_user.id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Server error fetching documents.",
@@ -265,124 +495,184 @@ async def get_documents(
 # Use List[Dict] to explicitly allow the extra 'owner_username' field
 @router.get("/applicant/", response_model=List[Dict]) # FIX: Changed response_model to List[Dict]
 async def get_applicant_documents(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header; replaces skip"),
     current_user: UserInDB = Depends(require_role(["recruiter"])), # Restrict to 'recruiter' role
 ):
     """
-    Retrieves a list of documents uploaded by users with the 'user' role (Applicants).
+    Retrieves a list of documents uploaded by users with the 'user' role (Applicants), newest first.
     Includes the owner's username. Only accessible by recruiters.
+    The cursor for the next page is returned in the X-Next-Cursor header.
     """
+    keyset_sql, page_params = _created_at_keyset(cursor, skip, limit, "d.")
     try:
-        with get_db() as (db, cursor):
+        async with get_async_db() as (db, db_cursor):
             # CRITICAL: Ensure u.username AS owner_username is selected here
-            query = """
+            query = f"""
                 SELECT d.id, d.title, d.description, d.latest_file_path, d.created_at, u.username AS owner_username
                 FROM documents d
                 JOIN users u ON d.owner_id = u.id
                 WHERE u.role = 'user' -- Filter for documents owned by 'user' role
-                ORDER BY d.created_at DESC
-                LIMIT %s OFFSET %s
+                {keyset_sql}
+                ORDER BY d.created_at DESC, d.id DESC
+                LIMIT %s {"" if cursor else "OFFSET %s"}
             """
-            cursor.execute(query, (limit, skip))
-            docs = cursor.fetchall()
+            await db_cursor.execute(query, page_params)
+            docs = await db_cursor.fetchall()
+            _set_next_cursor(response, docs, limit)
             # Return as a list of dictionaries to ensure the extra field is kept.
             return docs # Return the raw fetched data
 
     except mysql.connector.Error as e:
-        print(f"DB Error fetching applicant documents for recruiter {current_user.id}: {e}")
+        logger.error(f"DB Error fetching applicant documents for recruiter {current_user.id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database error fetching documents.",
         )
     except Exception as e:
-        print(f"Error fetching applicant documents for recruiter {current_user.id}: {e}")
-        traceback.print_exc()
+        logger.exception(f"Error fetching applicant documents for recruiter {current_user.id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Server error fetching documents.",
         )
 
 
+def _search_scope(current_user: UserInDB):
+    """
+    Returns the base SQL (documents aliased `d`, with {extra_columns} and
+    {extra_joins} slots) and params restricting a search to what the user may see:
+    - Users ('user' role) search documents they own.
+    - Recruiters ('recruiter' role) search documents owned by users with the 'user' role.
+    """
+    if current_user.role == 'user':
+        # User searches their own documents
+        base_sql = """
+            SELECT d.id, d.title, d.description, d.latest_file_path, d.created_at{extra_columns}
+            FROM documents d
+            {extra_joins}
+            WHERE d.owner_id = %s
+        """
+        return base_sql, (current_user.id,)
+    if current_user.role == 'recruiter':
+        # Recruiter searches documents owned by 'user' roles
+        # CRITICAL: Ensure u.username AS owner_username is selected for recruiters
+        base_sql = """
+            SELECT d.id, d.title, d.description, d.latest_file_path, d.created_at, u.username AS owner_username{extra_columns}
+            FROM documents d
+            JOIN users u ON d.owner_id = u.id
+            {extra_joins}
+            WHERE u.role = 'user'
+        """
+        return base_sql, () # No specific user ID needed for recruiter search
+    # Handle other roles if necessary, or raise an error
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized role for search.")
+
+# Relevance of a metadata row for a boolean-mode FULLTEXT query (uses ft_documents_title_description)
+FULLTEXT_MATCH_SQL = "MATCH(d.title_words, d.description) AGAINST (%s IN BOOLEAN MODE)"
+# Rounded so relevance values round-trip exactly through pagination cursors
+FULLTEXT_RELEVANCE_SQL = f"ROUND({FULLTEXT_MATCH_SQL}, 6)"
+
+def _search_filter(base_sql: str, base_params: tuple, query: str, search_content: bool, fulltext_query: Optional[str] = None):
+    """
+    Appends the content or metadata match conditions to a search scope.
+    Metadata search uses the FULLTEXT index when `fulltext_query` is given (and
+    selects its `relevance`) and substring matching otherwise.
+    Returns (sql, params).
+    """
+    search_term_lower = query.lower()
+    if search_content:
+        # Look the query terms up in the inverted index instead of re-reading every file,
+        # then confirm the exact phrase against the stored text of the latest version
+        sql = base_sql.format(extra_columns="", extra_joins=text_store.LATEST_TEXT_JOIN)
+        params = list(base_params)
+        index_filter = search_index.postings_filter(query)
+        if index_filter is not None:
+            index_sql, index_params = index_filter
+            sql += f" AND {index_sql}"
+            params += index_params
+        # else: nothing indexable (e.g. "c++" or only one-letter words), so the phrase match scans the stored text
+        sql += """
+            AND LOWER(t.content) LIKE %s
+        """
+        return sql, params + [f"%{escape_like(search_term_lower)}%"]
+    if fulltext_query is not None:
+        # Metadata search through the FULLTEXT index on (title words, description)
+        extra_columns = f", {FULLTEXT_RELEVANCE_SQL} AS relevance"
+        sql = base_sql.format(extra_columns=extra_columns, extra_joins="") + f"""
+            AND {FULLTEXT_MATCH_SQL}
+        """
+        return sql, [fulltext_query] + list(base_params) + [fulltext_query]
+    # Metadata search (title/description) by substring; cannot use an index
+    sql = base_sql.format(extra_columns="", extra_joins="") + """
+        AND (LOWER(title) LIKE %s OR LOWER(description) LIKE %s)
+    """
+    return sql, list(base_params) + [f"%{search_term_lower}%", f"%{search_term_lower}%"]
+
 # Modify search to handle roles: Users search their own, Recruiters search applicant docs
 @router.get("/search/", response_model=SearchResults)
 async def search_documents(
     query: str,
     search_content: bool = Query(False),
+    match_mode: str = Query("fulltext", pattern="^(fulltext|substring)$"),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Opaque next_cursor from a previous page; replaces skip"),
     current_user: UserInDB = Depends(get_current_user), # Authentication check (role handled inside)
 ):
     """
     Searches for documents based on role:
     - Users ('user' role) search documents they own.
     - Recruiters ('recruiter' role) search documents owned by users with the 'user' role.
+    Metadata search defaults to FULLTEXT word-prefix matching ordered by relevance;
+    `match_mode=substring` keeps the original LIKE '%term%' matching ordered by title.
+    Pass the returned `next_cursor` back as `cursor` to fetch the next page.
     """
-    search_term_lower = query.lower()
-    matching_documents = []
-
     try:
-        with get_db() as (db, cursor):
-            # Determine the base query based on the user's role
-            if current_user.role == 'user':
-                # User searches their own documents
-                base_sql = """
-                    SELECT id, title, description, latest_file_path, created_at
-                    FROM documents
-                    WHERE owner_id = %s
-                """
-                base_params = (current_user.id,)
-            elif current_user.role == 'recruiter':
-                # Recruiter searches documents owned by 'user' roles
-                # CRITICAL: Ensure u.username AS owner_username is selected for recruiters
-                base_sql = """
-                    SELECT d.id, d.title, d.description, d.latest_file_path, d.created_at, u.username AS owner_username
-                    FROM documents d
-                    JOIN users u ON d.owner_id = u.id
-                    WHERE u.role = 'user'
-                """
-                base_params = () # No specific user ID needed for recruiter search
+        base_sql, base_params = _search_scope(current_user)
+        fulltext_query = _metadata_fulltext_query(query, search_content, match_mode)
+        filter_sql, filter_params = _search_filter(base_sql, base_params, query, search_content, fulltext_query)
 
-            else:
-                 # Handle other roles if necessary, or raise an error
-                 raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized role for search.")
-
-
-            if search_content:
-                # Fetch all potentially matching documents first based on role criteria
-                sql_fetch_all = base_sql + " ORDER BY created_at DESC" # Order before fetching for consistency
-                cursor.execute(sql_fetch_all, base_params)
-                potential_docs = cursor.fetchall()
-
-                # Filter by content
-                for doc in potential_docs:
-                    file_path = doc.get('latest_file_path')
-                    if file_path:
-                        content = read_text_from_file(file_path)
-                        if search_term_lower in content.lower():
-                            # Append the raw dictionary which includes owner_username for recruiters
-                            matching_documents.append(doc)
-
-                # Apply pagination to the content-matched results
-                paginated_results = matching_documents[skip : skip + limit]
-                # Return the raw list of dictionaries
-                return {"results": paginated_results}
+        # Each mode pages on its own sort key: (sort value, id) keyset conditions when a
+        # cursor is given, LIMIT/OFFSET otherwise
+        if search_content:
+            # Newest first: MySQL walks the (owner_id/created_at, id) indexes in order and
+            # stops as soon as it has a page of matches instead of scanning every candidate
+            order_sql = "d.created_at DESC, d.id DESC"
+            row_key = lambda doc: (doc["created_at"], doc["id"])
+            key_types = (datetime.fromisoformat, int)
+            keyset_sql = "AND (d.created_at < %s OR (d.created_at = %s AND d.id < %s))"
+            keyset_params = lambda key: [key[0], key[0], key[1]]
+        elif fulltext_query is not None:
+            # Most relevant first
+            order_sql = "relevance DESC, d.id DESC"
+            row_key = lambda doc: (doc["relevance"], doc["id"])
+            key_types = (float, int)
+            keyset_sql = f"AND ({FULLTEXT_RELEVANCE_SQL} < %s OR ({FULLTEXT_RELEVANCE_SQL} = %s AND d.id < %s))"
+            keyset_params = lambda key: [fulltext_query, key[0], fulltext_query, key[0], key[1]]
+        else:
+            order_sql = "d.title, d.id"
+            row_key = lambda doc: (doc["title"], doc["id"])
+            key_types = (str, int)
+            keyset_sql = "AND (d.title > %s OR (d.title = %s AND d.id > %s))"
+            keyset_params = lambda key: [key[0], key[0], key[1]]
 
-            else:
-                # Metadata search (title/description)
-                sql_metadata_search = base_sql + """
-                    AND (LOWER(title) LIKE %s OR LOWER(description) LIKE %s)
-                    ORDER BY title
-                    LIMIT %s OFFSET %s
-                """
-                metadata_params = list(base_params) + [f"%{search_term_lower}%", f"%{search_term_lower}%", limit, skip]
-                cursor.execute(sql_metadata_search, tuple(metadata_params))
-                results = cursor.fetchall()
-                # Return the raw list of dictionaries
-                return {"results": results}
+        if cursor:
+            page_sql = f"{keyset_sql} ORDER BY {order_sql} LIMIT %s"
+            page_params = keyset_params(decode_cursor(cursor, key_types)) + [limit]
+        else:
+            page_sql = f"ORDER BY {order_sql} LIMIT %s OFFSET %s"
+            page_params = [limit, skip]
+
+        async with get_async_db() as (db, db_cursor):
+            await db_cursor.execute(filter_sql + page_sql, tuple(filter_params + page_params))
+            results = await db_cursor.fetchall()
+            # Return the raw list of dictionaries (includes owner_username for recruiters)
+            return {"results": results, "next_cursor": next_cursor(results, limit, row_key)}
 
     except mysql.connector.Error as e:
-        print(f"DB Error searching documents for user {current_user.id}: {e}")
+        logger.error(f"DB Error searching documents for user {current_user.id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database error searching documents.",
@@ -390,13 +680,190 @@ async def search_documents(
     except HTTPException:
          raise # Re-raise explicit HTTPExceptions (like the 403)
     except Exception as e:
-        print(f"Error searching documents for user {current_user.id}: {e}")
-        traceback.print_exc()
+        logger.exception(f"Error searching documents for user {current_user.id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Server error searching documents.",
         )
 
+def _metadata_fulltext_query(query: str, search_content: bool, match_mode: str) -> Optional[str]:
+    """Returns the boolean FULLTEXT query for a metadata search, or None to match by substring."""
+    if search_content or match_mode != "fulltext":
+        return None
+    # Queries made only of short words/stopwords cannot use the index; fall back to substring matching
+    return search_index.fulltext_boolean_query(query)
+
+async def _iter_search_matches(filter_sql: str, filter_params: list, limit: int, batch_size: int):
+    """
+    Yields matching documents newest first, fetching them in small keyset batches.
+    Each batch uses its own short-lived connection, so a slow client never pins a
+    pooled connection, and the scan stops as soon as `limit` matches were sent.
+    """
+    sent = 0
+    last_key = None # (created_at, id) of the last document sent
+    while sent < limit:
+        keyset_sql = ""
+        keyset_params = []
+        if last_key is not None:
+            keyset_sql = "AND (d.created_at < %s OR (d.created_at = %s AND d.id < %s))"
+            keyset_params = [last_key[0], last_key[0], last_key[1]]
+        batch_sql = filter_sql + keyset_sql + """
+            ORDER BY d.created_at DESC, d.id DESC
+            LIMIT %s
+        """
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(batch_sql, tuple(filter_params + keyset_params + [min(batch_size, limit - sent)]))
+            batch = await cursor.fetchall()
+        for doc in batch:
+            yield doc
+        sent += len(batch)
+        if len(batch) < batch_size:
+            return # Scan exhausted
+        last_key = (batch[-1]["created_at"], batch[-1]["id"])
+
+@router.get("/search/stream")
+async def stream_search_documents(
+    query: str,
+    search_content: bool = Query(False),
+    match_mode: str = Query("fulltext", pattern="^(fulltext|substring)$"),
+    limit: int = Query(1000, ge=1, le=10000),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    current_user: UserInDB = Depends(get_current_user), # Authentication check (role handled inside)
+):
+    """
+    Streams search results (same access rules as /search/) newest first, sending
+    each match as soon as it is found. `format=ndjson` writes one JSON object per
+    line; `format=sse` sends Server-Sent Events ("result" events, then "end").
+    """
+    base_sql, base_params = _search_scope(current_user)
+    fulltext_query = _metadata_fulltext_query(query, search_content, match_mode)
+    filter_sql, filter_params = _search_filter(base_sql, base_params, query, search_content, fulltext_query)
+
+    async def event_stream():
+        count = 0
+        try:
+            async for doc in _iter_search_matches(filter_sql, filter_params, limit, SEARCH_STREAM_BATCH_SIZE):
+                payload = json.dumps(jsonable_encoder(doc))
+                count += 1
+                yield f"event: result\ndata: {payload}\n\n" if format == "sse" else payload + "\n"
+        except Exception as e:
+            # Headers are already sent, so the error can only be reported in-band
+            logger.exception(f"Error streaming search results for user {current_user.id}: {e}")
+            if format == "sse":
+                yield f"event: error\ndata: {json.dumps({'detail': 'Server error searching documents.'})}\n\n"
+            return
+        if format == "sse":
+            yield f"event: end\ndata: {json.dumps({'count': count})}\n\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        event_stream(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # Disable proxy buffering
+    )
+
+# Owners export their own documents; recruiters export applicant documents
+@router.get("/export")
+async def export_documents(
+    document_ids: Optional[List[int]] = Query(None, alias="document_id"),
+    query: Optional[str] = None,
+    search_content: bool = Query(False),
+    match_mode: str = Query("fulltext", pattern="^(fulltext|substring)$"),
+    versions: str = Query("latest", pattern="^(latest|all)$"),
+    current_user: UserInDB = Depends(get_current_user),
+):
+    """
+    Streams a ZIP archive of document versions, selected either by repeated
+    `document_id` parameters or by a search `query` (same matching as /search/).
+    `versions=latest` exports the latest version of each document, `all` every
+    version. Entries are named `<owner>/<title>_v<version><ext>`.
+    """
+    if bool(document_ids) == bool(query):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide either document_id values or a search query.",
+        )
+
+    try:
+        async with get_async_db() as (db, cursor):
+            if query:
+                fulltext_query = search_index.fulltext_boolean_query(query) if match_mode == "fulltext" else None
+                search_sql, search_params = _search_filter(*_search_scope(current_user), query, search_content, fulltext_query)
+                await cursor.execute(
+                    f"SELECT matches.id FROM ({search_sql}) AS matches LIMIT %s",
+                    tuple(search_params) + (EXPORT_MAX_DOCUMENTS + 1,),
+                )
+                document_ids = [row["id"] for row in await cursor.fetchall()]
+            document_ids = list(dict.fromkeys(document_ids))
+            if len(document_ids) > EXPORT_MAX_DOCUMENTS:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"At most {EXPORT_MAX_DOCUMENTS} documents can be exported at once.",
+                )
+
+            rows = []
+            if document_ids:
+                latest_only = (
+                    "AND dv.version = (SELECT MAX(v.version) FROM document_versions v WHERE v.document_id = d.id)"
+                    if versions == "latest" else ""
+                )
+                await cursor.execute(
+                    f"""
+                    SELECT d.id AS document_id, d.title, d.owner_id, u.username AS owner_username,
+                           u.role AS owner_role, dv.version, dv.file_path, dv.uploaded_at
+                    FROM documents d
+                    JOIN users u ON d.owner_id = u.id
+                    JOIN document_versions dv ON dv.document_id = d.id
+                    WHERE d.id IN ({_placeholders(document_ids)}) {latest_only}
+                    ORDER BY u.username, d.title, dv.version
+                    """,
+                    tuple(document_ids),
+                )
+                rows = await cursor.fetchall()
+
+        # Same owner/recruiter check as a single download, applied to every entry
+        found_ids = {row["document_id"] for row in rows}
+        missing_ids = [doc_id for doc_id in document_ids if doc_id not in found_ids]
+        if missing_ids:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Documents not found: {', '.join(map(str, missing_ids))}.",
+            )
+        denied_ids = sorted({
+            row["document_id"] for row in rows
+            if not _can_access(current_user, row["owner_id"], row["owner_role"])
+        })
+        if denied_ids:
+            logger.warning(f"AuthZ Error: User {current_user.id} ({current_user.username}, role={current_user.role}) attempted to export docs {denied_ids}")
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to export these documents.")
+
+        entries = []
+        for row in rows:
+            if not is_within_upload_dir(row["file_path"]):
+                logger.warning(f"Security Alert: Attempted to export file outside UPLOAD_DIR: {row['file_path']}")
+                continue
+            file_ext = os.path.splitext(strip_codec_suffix(row["file_path"]))[1]
+            entries.append({
+                "arcname": f"{row['owner_username']}/{row['title']}_v{row['version']}{file_ext}",
+                "file_path": row["file_path"],
+                "modified": row["uploaded_at"],
+            })
+    except mysql.connector.Error as e:
+        logger.error(f"DB Error preparing export for user {current_user.id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error during export.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error preparing export for user {current_user.id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Server error during export.")
+
+    archive_name = f"documents_export_{datetime.now(timezone.utc):%Y%m%d_%H%M%S}.zip"
+    return StreamingResponse(
+        iter_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(archive_name)},
+    )
+
 # Modify version access: Allow owner OR recruiter if owner is 'user'
 @router.get("/{document_id}/versions/")
 async def get_document_versions(
@@ -408,13 +875,13 @@ async def get_document_versions(
     Accessible by the document owner OR by a recruiter if the owner has the 'user' role.
     """
     try:
-        with get_db() as (db, cursor):
+        async with get_async_db() as (db, cursor):
             # Modified query to join with users table and select owner_role
-            cursor.execute(
+            await cursor.execute(
                 "SELECT d.id, d.title, d.description, d.latest_file_path, d.created_at, d.owner_id, u.role AS owner_role FROM documents d JOIN users u ON d.owner_id = u.id WHERE d.id = %s",
                 (document_id,),
             )
-            doc = cursor.fetchone()
+            doc = await cursor.fetchone()
             if not doc:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -422,13 +889,8 @@ async def get_document_versions(
                 )
 
             # Access Control Check: Owner OR Recruiter viewing user's doc
-            is_owner = doc["owner_id"] == current_user.id
-            is_recruiter_viewing_user_doc = (
-                current_user.role == 'recruiter' and doc["owner_role"] == 'user'
-            )
-
-            if not (is_owner or is_recruiter_viewing_user_doc):
-                print(
+            if not _can_access(current_user, doc["owner_id"], doc["owner_role"]):
+                logger.warning(
                     f"AuthZ Error: User {current_user.id} ({current_user.username}, role={current_user.role}) attempted to view versions for doc {document_id} owned by {doc['owner_id']} (role={doc['owner_role']})"
                 )
                 raise HTTPException(
@@ -436,11 +898,11 @@ async def get_document_versions(
                     detail="Not authorized to view this document's versions",
                 )
 
-            cursor.execute(
+            await cursor.execute(
                 "SELECT id, version, file_path, uploaded_at FROM document_versions WHERE document_id = %s ORDER BY version DESC",
                 (document_id,),
             )
-            versions = cursor.fetchall()
+            versions = await cursor.fetchall()
             latest_version = max([v["version"] for v in versions]) if versions else 0
             # Create a Document model instance, excluding owner_id and owner_role
             doc_details = Document(**{k: v for k, v in doc.items() if k != "owner_id" and k != "owner_role"})
@@ -452,7 +914,7 @@ async def get_document_versions(
                 "latest_version": latest_version
             }
     except mysql.connector.Error as e:
-        print(
+        logger.error(
             f"DB Error fetching versions for doc {document_id}, user {current_user.id}: {e}"
         )
         raise HTTPException(
@@ -462,10 +924,9 @@ async def get_document_versions(
     except HTTPException:
         raise
     except Exception as e:
-        print(
+        logger.exception(
             f"Error fetching versions for doc {document_id}, user {current_user.id}: {e}"
         )
-        traceback.print_exc()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Server error fetching versions.",
@@ -476,18 +937,20 @@ async def get_document_versions(
 async def download_document_version(
     document_id: int,
     version_number: int,
+    request: Request,
     current_user: UserInDB = Depends(get_current_user) # Authentication check (role handled inside)
 ):
     """
     Downloads a specific document version.
     Accessible by the document owner OR by a recruiter if the owner has the 'user' role.
+    Supports conditional requests (ETag / Last-Modified -> 304) and single byte ranges (206).
     """
     try:
-        with get_db() as (db, cursor):
+        async with get_async_db() as (db, cursor):
             # Modified query to join with users table and select owner_role
-            cursor.execute(
+            await cursor.execute(
                 """
-                SELECT dv.file_path, d.title, d.owner_id, u.role AS owner_role
+                SELECT dv.id, dv.file_path, dv.blob_sha256, dv.codec, dv.uploaded_at, d.title, d.owner_id, u.role AS owner_role
                 FROM document_versions dv
                 JOIN documents d ON dv.document_id = d.id
                 JOIN users u ON d.owner_id = u.id
@@ -495,59 +958,134 @@ async def download_document_version(
                 """,
                 (document_id, version_number)
             )
-            version_record = cursor.fetchone()
+            version_record = await cursor.fetchone()
             if not version_record:
-                cursor.execute("SELECT id FROM documents WHERE id = %s", (document_id,))
-                doc_exists = cursor.fetchone()
+                await cursor.execute("SELECT id FROM documents WHERE id = %s", (document_id,))
+                doc_exists = await cursor.fetchone()
                 if not doc_exists:
                     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Document with ID {document_id} not found.")
                 else:
                      raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Version {version_number} for document ID {document_id} not found.")
 
             # Access Control Check: Owner OR Recruiter viewing user's doc
-            is_owner = version_record['owner_id'] == current_user.id
-            is_recruiter_viewing_user_doc = (
-                current_user.role == 'recruiter' and version_record['owner_role'] == 'user'
-            )
-
-            if not (is_owner or is_recruiter_viewing_user_doc):
-                 print(f"AuthZ Error: User {current_user.id} ({current_user.username}, role={current_user.role}) attempted to download version {version_number} for doc {document_id} owned by {version_record['owner_id']} (role={version_record['owner_role']})")
+            if not _can_access(current_user, version_record['owner_id'], version_record['owner_role']):
+                 logger.warning(f"AuthZ Error: User {current_user.id} ({current_user.username}, role={current_user.role}) attempted to download version {version_number} for doc {document_id} owned by {version_record['owner_id']} (role={version_record['owner_role']})")
                  raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to download this document version")
 
             file_path = version_record['file_path']
-            if not os.path.commonpath([os.path.abspath(UPLOAD_DIR), os.path.abspath(file_path)]) == os.path.abspath(UPLOAD_DIR):
-                 print(f"Security Alert: Attempted to access file outside UPLOAD_DIR: {file_path}")
+            if not is_within_upload_dir(file_path):
+                 logger.warning(f"Security Alert: Attempted to access file outside UPLOAD_DIR: {file_path}")
                  raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file path.")
 
-            if not os.path.exists(file_path) or not os.path.isfile(file_path):
-                 print(f"Error: File not found on disk at path: {file_path} (DB record exists)")
+            stored_path = await run_in_threadpool(resolve_stored_path, file_path)
+            if stored_path is None:
+                 logger.error(f"File not found on disk at path: {file_path} (DB record exists)")
                  raise HTTPException(
                      status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                      detail="File record exists but file not found on server."
                  )
 
-            base_filename = os.path.basename(file_path)
-            suggested_filename = base_filename
+            # Blobs are named by digest, so suggest a name derived from the document instead
+            # (and describe the original file, not its compressed-at-rest form)
+            original_name = strip_codec_suffix(file_path)
+            file_ext = os.path.splitext(original_name)[1]
+            suggested_filename = f"{version_record['title']}_v{version_number}{file_ext}"
 
-            media_type, _ = mimetypes.guess_type(file_path)
+            media_type, _ = mimetypes.guess_type(original_name)
             media_type = media_type or 'application/octet-stream'
 
-            return FileResponse(
-                path=file_path,
+            # Access is checked above on every request; only then may a cached copy be confirmed
+            file_stat = os.stat(stored_path)
+            last_modified = version_record['uploaded_at'] or datetime.fromtimestamp(file_stat.st_mtime, tz=timezone.utc)
+            return version_file_response(
+                request,
+                stored_path,
+                etag=version_etag(version_record['blob_sha256'], version_record['id'], file_stat.st_size),
+                last_modified=last_modified,
                 filename=suggested_filename,
-                media_type=media_type
+                media_type=media_type,
+                codec=version_record['codec'],
             )
 
     except mysql.connector.Error as e:
-        print(f"DB Error downloading version {version_number} for doc {document_id}, user {current_user.id}: {e}")
+        logger.error(f"DB Error downloading version {version_number} for doc {document_id}, user {current_user.id}: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error during download.")
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Error downloading version {version_number} for doc {document_id}, user {current_user.id}: {e}")
-        traceback.print_exc()
+        logger.exception(f"Error downloading version {version_number} for doc {document_id}, user {current_user.id}: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Server error during download.")
 
+# Same access rule as downloads: owner OR recruiter if owner is 'user'
+@router.get("/{document_id}/versions/{version_number}/preview")
+async def preview_document_version(
+    document_id: int,
+    version_number: int,
+    request: Request,
+    page: int = Query(1, ge=1, le=PREVIEW_MAX_PAGE),
+    width: int = Query(PREVIEW_DEFAULT_WIDTH, ge=16, le=4096),
+    current_user: UserInDB = Depends(get_current_user),
+):
+    """
+    Returns a PNG thumbnail of one page (the first by default) of a document
+    version, `width` pixels wide (rounded up to a cached preview size).
+    Rendered pages are cached on disk, so repeat views are a static file read.
+    """
+    try:
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
+                """
+                SELECT dv.id, dv.file_path, dv.blob_sha256, dv.uploaded_at, d.owner_id, u.role AS owner_role
+                FROM document_versions dv
+                JOIN documents d ON dv.document_id = d.id
+                JOIN users u ON d.owner_id = u.id
+                WHERE dv.document_id = %s AND dv.version = %s
+                """,
+                (document_id, version_number),
+            )
+            version_record = await cursor.fetchone()
+        if not version_record:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Version {version_number} for document ID {document_id} not found.")
+        if not _can_access(current_user, version_record['owner_id'], version_record['owner_role']):
+            logger.warning(f"AuthZ Error: User {current_user.id} ({current_user.username}, role={current_user.role}) attempted to preview version {version_number} for doc {document_id} owned by {version_record['owner_id']} (role={version_record['owner_role']})")
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to preview this document version")
+
+        file_path = version_record['file_path']
+        if not is_within_upload_dir(file_path):
+            logger.warning(f"Security Alert: Attempted to preview file outside UPLOAD_DIR: {file_path}")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file path.")
+        if os.path.splitext(strip_codec_suffix(file_path))[1].lower() != ".pdf":
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Previews are only available for PDF files.")
+
+        width = snap_width(width)
+        key = preview_content_key(version_record['blob_sha256'], version_record['id'])
+        etag = f'"{key}-p{page}-w{width}"'
+        headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+        last_modified = version_record['uploaded_at'] or datetime.now(timezone.utc)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        stored_path = await run_in_threadpool(resolve_stored_path, file_path)
+        if stored_path is None:
+            logger.error(f"File not found on disk at path: {file_path} (DB record exists)")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="File record exists but file not found on server.")
+        preview_path = await get_preview(stored_path, key, page, width)
+        if preview_path is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Page {page} does not exist in this version.")
+        return FileResponse(preview_path, media_type="image/png", headers=headers)
+
+    except mysql.connector.Error as e:
+        logger.error(f"DB Error previewing version {version_number} for doc {document_id}, user {current_user.id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error during preview.")
+    except HTTPException:
+        raise
+    except (asyncio.TimeoutError, BrokenProcessPool) as e:
+        logger.error(f"Error rendering preview of version {version_number} for doc {document_id}: {e!r}")
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="This document could not be rendered.")
+    except Exception as e:
+        logger.exception(f"Error previewing version {version_number} for doc {document_id}, user {current_user.id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Server error during preview.")
+
 @router.delete("/{document_id}", status_code=status.HTTP_200_OK)
 async def delete_document(
     document_id: int,
@@ -558,12 +1096,12 @@ async def delete_document(
     Only accessible by the document owner with the 'user' role.
     """
     try:
-        with get_db() as (db, cursor):
+        async with get_async_db() as (db, cursor):
             # 1. Verify document exists and is owned by the current user
-            cursor.execute(
+            await cursor.execute(
                 "SELECT id, owner_id FROM documents WHERE id = %s", (document_id,)
             )
-            doc = cursor.fetchone()
+            doc = await cursor.fetchone()
 
             if not doc:
                 raise HTTPException(
@@ -572,7 +1110,7 @@ async def delete_document(
                 )
 
             if doc["owner_id"] != current_user.id:
-                print(
+                logger.warning(
                     f"AuthZ Error: User {current_user.id} ({current_user.username}) attempted to delete doc {document_id} owned by {doc['owner_id']}"
                 )
                 raise HTTPException(
@@ -581,16 +1119,19 @@ async def delete_document(
                 )
 
             # 2. Get file paths for all versions of this document
-            cursor.execute(
-                "SELECT file_path FROM document_versions WHERE document_id = %s",
+            await cursor.execute(
+                "SELECT file_path, blob_sha256 FROM document_versions WHERE document_id = %s",
                 (document_id,),
             )
-            version_file_paths = cursor.fetchall()
+            version_file_paths = await cursor.fetchall()
+
+            # Drop the document's search postings along with it
+            await search_index.remove_document(cursor, document_id)
 
             # 3. Delete database entries (documents and document_versions)
             # Due to ON DELETE CASCADE on the foreign key in document_versions,
             # deleting from the documents table should also delete related versions.
-            cursor.execute("DELETE FROM documents WHERE id = %s", (document_id,))
+            await cursor.execute("DELETE FROM documents WHERE id = %s", (document_id,))
             # Check if any rows were affected (optional, but good practice)
             if cursor.rowcount == 0:
                  # This case should ideally be caught by the initial SELECT,
@@ -601,30 +1142,21 @@ async def delete_document(
                  )
 
 
-            # 4. Delete the actual files from the file system
-            deleted_count = 0
-            for path_record in version_file_paths:
-                file_path = path_record["file_path"]
-                # Security check: Ensure the file path is within the UPLOAD_DIR
-                if not os.path.commonpath([os.path.abspath(UPLOAD_DIR), os.path.abspath(file_path)]) == os.path.abspath(UPLOAD_DIR):
-                     print(f"Security Alert: Attempted to delete file outside UPLOAD_DIR: {file_path}")
-                     # Log the security attempt but continue with DB deletion
-                     continue # Skip deleting this specific file, but don't fail the request
+            # 4. Release blob references; blobs still used by other versions stay on disk
+            unreferenced_paths = await storage.release_blobs(
+                cursor, [record["blob_sha256"] for record in version_file_paths if record["blob_sha256"]]
+            )
+            # Versions stored before content addressing own their file outright
+            unreferenced_paths += [record["file_path"] for record in version_file_paths if not record["blob_sha256"]]
 
-                if os.path.exists(file_path) and os.path.isfile(file_path):
-                    try:
-                        os.remove(file_path)
-                        deleted_count += 1
-                        print(f"Deleted file: {file_path}")
-                    except OSError as e:
-                        print(f"Error deleting file {file_path}: {e}")
-                        # Log the error but continue if other files/DB deletion succeeded
-
-            # 5. Return success response
+            # 5. Delete the actual files from the file system
+            deleted_count = await run_in_threadpool(_remove_version_files, unreferenced_paths)
+
+            # 6. Return success response
             return {"message": f"Document with ID {document_id} and its {len(version_file_paths)} versions ({deleted_count} files deleted) successfully deleted."}
 
     except mysql.connector.Error as e:
-        print(f"DB Error deleting document {document_id} for user {current_user.id}: {e}")
+        logger.error(f"DB Error deleting document {document_id} for user {current_user.id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database error during document deletion.",
@@ -632,8 +1164,7 @@ async def delete_document(
     except HTTPException as e:
         raise e # Re-raise explicit HTTPExceptions (like 403, 404)
     except Exception as e:
-        print(f"Error deleting document {document_id} for user {current_user.id}: {e}")
-        traceback.print_exc()
+        logger.exception(f"Error deleting document {document_id} for user {current_user.id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Server error during document deletion.",
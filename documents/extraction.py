@@ -0,0 +1,362 @@
+# documents/extraction.py
+import os
+import logging
+import sys
+import asyncio
+import mimetypes
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, CancelledError, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+# Import PyMuPDF for PDF text extraction
+import fitz # PyMuPDF
+
+from documents.storage import is_within_upload_dir, resolve_stored_path
+from documents.compression import CODEC_IDENTITY, codec_for_path, strip_codec_suffix, read_decompressed
+from metrics import extraction_duration
+from logging_config import configure_logging
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Memory ceiling for cached extracted text; keep it small on low-memory worker boxes
+TEXT_CACHE_MAX_BYTES = int(os.getenv("TEXT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Worker processes for PDF text extraction (0 extracts in-process, without crash isolation)
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", os.cpu_count() or 1))
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", 60)) # Seconds allowed per file
+
+class TextCache:
+    """
+    Thread-safe LRU cache of extracted text, bounded by the total size of the
+    cached strings. Entries are keyed by absolute path and only served while
+    the file's mtime and size are unchanged.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # abs path -> (mtime_ns, size, text, cost)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, file_path: str, file_stat: os.stat_result) -> Optional[str]:
+        key = os.path.abspath(file_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != file_stat.st_mtime_ns or entry[1] != file_stat.st_size:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, file_path: str, file_stat: os.stat_result, text: str):
+        cost = sys.getsizeof(text)
+        if cost > self.max_bytes:
+            return # Never let one huge document flush the whole cache
+        key = os.path.abspath(file_path)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (file_stat.st_mtime_ns, file_stat.st_size, text, cost)
+            self._bytes += cost
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate(self, file_path: str):
+        """Drops the cached text of a file (call when the file is removed or replaced)."""
+        with self._lock:
+            self._discard(os.path.abspath(file_path))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[3]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+text_cache = TextCache(TEXT_CACHE_MAX_BYTES)
+
+class ExtractionPool:
+    """
+    Runs PyMuPDF text extraction in worker processes.
+
+    A malformed PDF that hangs or crashes its worker only costs that file's
+    text: hung workers are killed after `timeout` seconds, and a broken pool is
+    replaced so later extractions keep working.
+    """
+
+    def __init__(self, workers: int, timeout: float):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: never fork the API worker's threads and open sockets into extraction processes
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=configure_logging,
+                )
+            return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor):
+        """Kills the workers of a hung or broken executor and lets the next call start a fresh one."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        terminate_workers = getattr(executor, "terminate_workers", None) # Python 3.14+
+        if terminate_workers is not None:
+            terminate_workers()
+        else:
+            for process in list((executor._processes or {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def extract(self, file_path: str) -> Optional[str]:
+        """Extracts the text of one file in a worker process (blocking). Returns None if it timed out or crashed."""
+        if self.workers <= 0:
+            return _extract_text(file_path)
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                return executor.submit(_extract_text, file_path).result(timeout=self.timeout)
+            except FutureTimeoutError:
+                logger.error(f"Text extraction timed out after {self.timeout}s for {file_path}; restarting workers.")
+                self._reset(executor)
+                return None
+            except BrokenProcessPool:
+                # Another file may have crashed the pool; retry once before blaming this one
+                self._reset(executor)
+        logger.error(f"Text extraction crashed its worker process for {file_path}")
+        return None
+
+    async def run_async(self, func, *args):
+        """
+        Runs a picklable module-level `func(*args)` in a worker process without
+        occupying a thread, restarting hung or crashed workers. Raises
+        asyncio.TimeoutError or BrokenProcessPool (after one retry) on failure.
+        """
+        if self.workers <= 0:
+            return await asyncio.to_thread(func, *args)
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                future = asyncio.wrap_future(executor.submit(func, *args))
+                return await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self._reset(executor)
+                raise
+            except BrokenProcessPool:
+                # Another call may have crashed the pool; retry once before blaming this one
+                self._reset(executor)
+                if attempt:
+                    raise
+
+    async def extract_async(self, file_path: str) -> Optional[str]:
+        """Awaitable extract() that does not occupy a thread while the worker runs."""
+        try:
+            return await self.run_async(_extract_text, file_path)
+        except asyncio.TimeoutError:
+            logger.error(f"Text extraction timed out after {self.timeout}s for {file_path}; restarting workers.")
+        except BrokenProcessPool:
+            logger.error(f"Text extraction crashed its worker process for {file_path}")
+        return None
+
+    def extract_many(self, file_paths: List[str]) -> Dict[str, Optional[str]]:
+        """Extracts many files in parallel across the workers (blocking). Timed-out or crashed files map to None."""
+        if self.workers <= 0 or len(file_paths) <= 1:
+            return {path: self.extract(path) for path in file_paths}
+        executor = self._get_executor()
+        futures = {path: executor.submit(_extract_text, path) for path in file_paths}
+        results = {}
+        for path, future in futures.items():
+            try:
+                results[path] = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                logger.error(f"Text extraction timed out after {self.timeout}s for {path}; restarting workers.")
+                self._reset(executor)
+                executor = self._get_executor()
+                results[path] = None
+            except (BrokenProcessPool, CancelledError):
+                results[path] = _RETRY # Retried one at a time below
+        # Files caught in a pool crash are retried in isolation to find the culprit
+        for path, text in results.items():
+            if text is _RETRY:
+                results[path] = self.extract(path)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+_RETRY = object()
+
+extraction_pool = ExtractionPool(EXTRACTION_WORKERS, EXTRACTION_TIMEOUT)
+
+# A timed-out or crashed extraction says nothing about the file, so its "" is
+# returned to the caller but never cached (the next read tries again).
+
+def read_text_from_file(file_path: str) -> str:
+    """Reads text content from a file, serving unchanged files from text_cache (blocking)."""
+    with tracing.span("extraction.read_text", {"file.path": file_path}) as text_span:
+        file_stat = _stat_or_none(file_path)
+        if file_stat is not None:
+            cached = text_cache.get(file_path, file_stat)
+            if cached is not None:
+                _annotate(text_span, True, cached)
+                return cached
+        started = time.perf_counter()
+        text = extraction_pool.extract(file_path)
+        extraction_duration.observe(time.perf_counter() - started, "sync")
+        if text is None:
+            return ""
+        if file_stat is not None:
+            text_cache.put(file_path, file_stat, text)
+        _annotate(text_span, False, text)
+        return text
+
+async def read_text_from_file_async(file_path: str, raise_on_failure: bool = False) -> str:
+    """
+    Async read_text_from_file for request handlers. With `raise_on_failure`, a
+    timeout or worker crash raises asyncio.TimeoutError / BrokenProcessPool, and
+    a missing file or one outside UPLOAD_DIR raises FileNotFoundError /
+    PermissionError, instead of returning "" (use it when the text is persisted).
+    """
+    with tracing.span("extraction.read_text", {"file.path": file_path}) as text_span:
+        file_stat = _stat_or_none(file_path)
+        if file_stat is not None:
+            cached = text_cache.get(file_path, file_stat)
+            if cached is not None:
+                _annotate(text_span, True, cached)
+                return cached
+        started = time.perf_counter()
+        if raise_on_failure:
+            text = await extraction_pool.run_async(_extract_text, file_path, True)
+        else:
+            text = await extraction_pool.extract_async(file_path)
+        extraction_duration.observe(time.perf_counter() - started, "async")
+        if text is None:
+            return ""
+        if file_stat is not None:
+            text_cache.put(file_path, file_stat, text)
+        _annotate(text_span, False, text)
+        return text
+
+def _annotate(text_span, cache_hit: bool, text: str):
+    if text_span is not None:
+        text_span.set_attribute("cache_hit", cache_hit)
+        text_span.set_attribute("text.chars", len(text))
+
+def read_texts_from_files(file_paths: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Bulk read_text_from_file: cache misses are extracted in parallel (blocking).
+    Files whose extraction timed out or crashed map to None.
+    """
+    results = {}
+    misses = {}
+    for path in dict.fromkeys(file_paths):
+        file_stat = _stat_or_none(path)
+        cached = text_cache.get(path, file_stat) if file_stat is not None else None
+        if cached is not None:
+            results[path] = cached
+        else:
+            misses[path] = file_stat
+    for path, text in extraction_pool.extract_many(list(misses)).items():
+        if text is not None and misses[path] is not None:
+            text_cache.put(path, misses[path], text)
+        results[path] = text
+    return results
+
+def _stat_or_none(file_path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(resolve_stored_path(file_path) or file_path)
+    except OSError:
+        return None # _extract_text reports the missing file
+
+def _extract_text(file_path: str, strict: bool = False) -> str:
+    """
+    Reads text content from a file, supporting PDF and plain text. With
+    `strict`, a path outside UPLOAD_DIR raises PermissionError and a missing
+    file raises FileNotFoundError instead of giving "".
+    """
+    # Security check: Ensure the file path is within the UPLOAD_DIR
+    # This prevents directory traversal attacks
+    if not is_within_upload_dir(file_path):
+        logger.warning(f"Security Alert: Attempted to read file outside UPLOAD_DIR during content search: {file_path}")
+        if strict:
+            raise PermissionError(f"File is outside UPLOAD_DIR: {file_path}")
+        return "" # Return empty string for invalid path
+
+    # Check if the file exists, under whichever storage layout currently holds it
+    stored_path = resolve_stored_path(file_path)
+    if stored_path is None:
+        logger.warning(f"File not found for content search: {file_path}")
+        if strict:
+            raise FileNotFoundError(f"File not found: {file_path}")
+        return "" # Return empty string if file not found
+    file_path = stored_path
+
+    try:
+        # Blobs compressed at rest are decoded in memory; the name without the codec suffix gives the type
+        compressed = codec_for_path(file_path) != CODEC_IDENTITY
+        mime_type, _ = mimetypes.guess_type(strip_codec_suffix(file_path))
+
+        if mime_type == 'application/pdf':
+            try:
+                if compressed:
+                    doc = fitz.open(stream=read_decompressed(file_path), filetype="pdf")
+                else:
+                    doc = fitz.open(file_path)
+                text = ""
+                for page_num in range(doc.page_count):
+                    page = doc.load_page(page_num)
+                    text += page.get_text()
+                doc.close()
+                return text
+            except Exception as pdf_error:
+                logger.error(f"Error reading PDF file {file_path}: {pdf_error}")
+                return "" # Return empty string on PDF read error
+        elif mime_type and mime_type.startswith('text/'):
+            try:
+                if compressed:
+                    return read_decompressed(file_path).decode('utf-8')
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    return f.read()
+            except Exception as text_error:
+                logger.error(f"Error reading text file {file_path}: {text_error}")
+                return "" # Return empty string on text file read error
+        else:
+            # Handle other known types or skip unsupported ones
+            # For simplicity, we only support PDF and basic text files for content search
+            logger.info(f"Skipping content search for unsupported file type: {mime_type} ({file_path})")
+            return "" # Skip unsupported types
+
+    except Exception as general_error:
+        logger.error(f"Unexpected error in read_text_from_file for {file_path}: {general_error}")
+        return "" # Catch any other unexpected errors
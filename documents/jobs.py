@@ -0,0 +1,98 @@
+# documents/jobs.py
+# Background work queued after an upload commits (see jobs/queue.py). Handlers
+# are idempotent: a job may run more than once if its worker dies mid-run.
+import logging
+import asyncio
+import hashlib
+from concurrent.futures.process import BrokenProcessPool
+from fastapi.concurrency import run_in_threadpool
+
+from database import get_async_db
+from jobs.queue import register_job, PermanentJobError
+from documents import search_index, text_store
+from documents.compression import open_decompressed
+from documents.storage import resolve_stored_path
+from documents.extraction import read_text_from_file_async
+from documents.previews import PREVIEW_DEFAULT_WIDTH, content_key, get_preview
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_TEXT_JOB = "extract_text"
+VERIFY_BLOB_JOB = "verify_blob"
+RENDER_PREVIEW_JOB = "render_preview"
+
+@register_job(EXTRACT_TEXT_JOB)
+async def extract_version_text(payload: dict):
+    """Stores the text of a version and, if it is still the latest, re-indexes its document."""
+    version_id = payload["version_id"]
+    async with get_async_db() as (db, cursor):
+        await cursor.execute(
+            "SELECT document_id, version, file_path, blob_sha256 FROM document_versions WHERE id = %s",
+            (version_id,),
+        )
+        version = await cursor.fetchone()
+        if version is None:
+            return # Document deleted before the job ran
+        content = await text_store.get_version_text(cursor, version_id)
+        if content is None and version["blob_sha256"]:
+            # Identical bytes uploaded before already have their text stored
+            content = await text_store.get_blob_text(cursor, version["blob_sha256"])
+
+    if content is None:
+        # Extraction runs outside any transaction: it can take seconds. A timeout, worker
+        # crash or missing file (e.g. mid shard move) raises, so the queue retries the
+        # job instead of storing ""
+        try:
+            content = await read_text_from_file_async(version["file_path"], raise_on_failure=True)
+        except PermissionError as e:
+            raise PermanentJobError(str(e))
+
+    async with get_async_db() as (db, cursor):
+        # Lock the document so concurrent jobs for older versions cannot overwrite newer postings
+        await cursor.execute("SELECT id FROM documents WHERE id = %s FOR UPDATE", (version["document_id"],))
+        if await cursor.fetchone() is None:
+            return
+        await text_store.save_version_text(cursor, version_id, content)
+        await cursor.execute(
+            "SELECT MAX(version) AS latest FROM document_versions WHERE document_id = %s",
+            (version["document_id"],),
+        )
+        if (await cursor.fetchone())["latest"] == version["version"]:
+            await search_index.index_document(cursor, version["document_id"], content)
+
+def _stored_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open_decompressed(resolve_stored_path(file_path) or file_path) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@register_job(VERIFY_BLOB_JOB)
+async def verify_blob(payload: dict):
+    """Checks that a stored (possibly compressed) blob still decodes to its digest."""
+    sha256 = payload["sha256"]
+    async with get_async_db() as (db, cursor):
+        await cursor.execute("SELECT file_path FROM blobs WHERE sha256 = %s", (sha256,))
+        blob = await cursor.fetchone()
+    if blob is None:
+        return # Released before the job ran
+    actual = await run_in_threadpool(_stored_sha256, blob["file_path"])
+    if actual != sha256:
+        logger.error(f"Integrity Error: blob {blob['file_path']} decodes to {actual}, expected {sha256}")
+        raise PermanentJobError(f"Stored blob {sha256} is corrupt (decodes to {actual}).")
+
+@register_job(RENDER_PREVIEW_JOB)
+async def render_first_page_preview(payload: dict):
+    """Pre-renders the default first-page thumbnail so the first preview request is a cache hit."""
+    async with get_async_db() as (db, cursor):
+        await cursor.execute(
+            "SELECT id, file_path, blob_sha256 FROM document_versions WHERE id = %s", (payload["version_id"],)
+        )
+        version = await cursor.fetchone()
+    if version is None:
+        return
+    try:
+        stored_path = await run_in_threadpool(resolve_stored_path, version["file_path"]) or version["file_path"]
+        await get_preview(stored_path, content_key(version["blob_sha256"], version["id"]), 1, PREVIEW_DEFAULT_WIDTH)
+    except (asyncio.TimeoutError, BrokenProcessPool) as e:
+        raise PermanentJobError(f"Could not render a preview of {version['file_path']}: {e!r}")
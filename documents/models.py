@@ -41,4 +41,5 @@ class PerQueryResult(BaseModel):
 # Pydantic model for the overall search results response
 class SearchResults(BaseModel):
     results: List[PerQueryResult]
+    next_cursor: Optional[str] = None # Pass back as `cursor` to fetch the next page
 
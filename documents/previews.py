@@ -0,0 +1,171 @@
+# documents/previews.py
+# PNG thumbnails of PDF pages, rendered with PyMuPDF in the extraction worker
+# processes and kept in a size-bounded on-disk cache. Versions are immutable,
+# so a rendered page never goes stale: cache files are keyed by the version's
+# content (blob digest, or version id for pre-blob versions), page and width,
+# and the least recently used files are evicted once the cache outgrows
+# PREVIEW_CACHE_MAX_BYTES. A request for a page past the end is remembered as
+# the document's page count, so repeating it never re-opens the PDF.
+import os
+import threading
+from typing import Optional, Tuple
+
+import fitz # PyMuPDF
+
+from documents.compression import CODEC_IDENTITY, codec_for_path, read_decompressed
+
+PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", "preview_cache")
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv("PREVIEW_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Rendered widths in pixels; requests are rounded up to one of these so the cache stays small
+PREVIEW_WIDTHS = sorted(int(w) for w in os.getenv("PREVIEW_WIDTHS", "160,320,640,1280").split(","))
+PREVIEW_DEFAULT_WIDTH = 320
+PREVIEW_MAX_PAGE = int(os.getenv("PREVIEW_MAX_PAGE", 2000)) # Highest page number a preview may be requested for
+
+def snap_width(width: int) -> int:
+    """Returns the smallest configured width >= `width` (or the largest one)."""
+    for candidate in PREVIEW_WIDTHS:
+        if candidate >= width:
+            return candidate
+    return PREVIEW_WIDTHS[-1]
+
+def render_page_png(file_path: str, page_number: int, width: int) -> Tuple[Optional[bytes], int]:
+    """
+    Renders one page (1-based) of a stored PDF as a PNG `width` pixels wide.
+    Returns (png, page_count), with png None if the document has no such page.
+    Runs in an extraction worker process, so it must stay a picklable
+    module-level function.
+    """
+    if codec_for_path(file_path) != CODEC_IDENTITY:
+        doc = fitz.open(stream=read_decompressed(file_path), filetype="pdf")
+    else:
+        doc = fitz.open(file_path)
+    try:
+        if not 1 <= page_number <= doc.page_count:
+            return None, doc.page_count
+        page = doc.load_page(page_number - 1)
+        zoom = width / page.rect.width if page.rect.width else 1.0
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return pixmap.tobytes("png"), doc.page_count
+    finally:
+        doc.close()
+
+class PreviewCache:
+    """
+    On-disk LRU of rendered previews bounded by total file size. A hit bumps
+    the file's mtime; eviction removes the oldest files first. The running
+    size is computed from disk on first use, so it survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path_for(self, content_key: str, page_number: int, width: int) -> str:
+        return os.path.join(self.directory, f"{content_key}_p{page_number}_w{width}.png")
+
+    def page_count_path(self, content_key: str) -> str:
+        return os.path.join(self.directory, f"{content_key}.pages")
+
+    def get_page_count(self, content_key: str) -> Optional[int]:
+        """Returns the remembered page count of a version's content, if a past-the-end page was requested (blocking)."""
+        try:
+            with open(self.page_count_path(content_key)) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def put_page_count(self, content_key: str, page_count: int):
+        self.put(self.page_count_path(content_key), str(page_count).encode())
+
+    def get(self, path: str) -> Optional[str]:
+        """Returns `path` if it is cached, marking it recently used (blocking)."""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, path: str, data: bytes):
+        """Stores a rendered preview and evicts old ones if over budget (blocking)."""
+        os.makedirs(self.directory, exist_ok=True)
+        partial_path = f"{path}.{threading.get_ident()}.part"
+        with open(partial_path, "wb") as f:
+            f.write(data)
+        os.replace(partial_path, path)
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_size()
+            else:
+                self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _scan_size(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+
+    def _evict(self):
+        """Removes least recently used previews until 90% of the budget is free. Caller holds the lock."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith((".png", ".pages")):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._bytes = total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+preview_cache = PreviewCache(PREVIEW_CACHE_DIR, PREVIEW_CACHE_MAX_BYTES)
+
+def content_key(blob_sha256: Optional[str], version_id: int) -> str:
+    """Cache key of a version's content: its blob digest, or the version id before blobs existed."""
+    return blob_sha256 or f"v{version_id}"
+
+async def get_preview(file_path: str, key: str, page_number: int, width: int) -> Optional[str]:
+    """
+    Returns the cached PNG path for a page preview, rendering it in an
+    extraction worker on a miss. Returns None if the page does not exist.
+    """
+    # Imported here so worker processes unpickling render_page_png do not import the pool
+    from fastapi.concurrency import run_in_threadpool
+    from documents.extraction import extraction_pool
+
+    path = preview_cache.path_for(key, page_number, width)
+    cached = await run_in_threadpool(preview_cache.get, path)
+    if cached is not None:
+        return cached
+    page_count = await run_in_threadpool(preview_cache.get_page_count, key)
+    if page_count is not None and page_number > page_count:
+        return None
+    data, page_count = await extraction_pool.run_async(render_page_png, file_path, page_number, width)
+    if data is None:
+        await run_in_threadpool(preview_cache.put_page_count, key, page_count)
+        return None
+    await run_in_threadpool(preview_cache.put, path, data)
+    return path
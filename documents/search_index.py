@@ -0,0 +1,130 @@
+# documents/search_index.py
+# Persistent inverted index (term -> document postings) for content search.
+# Postings live in the `search_postings` table (see sql.txt) and always describe
+# the latest version of each document: upload re-indexes a document, delete
+# removes its postings, and content search is an indexed lookup instead of
+# re-reading every PDF in scope.
+#
+# Rebuild the whole index from the files on disk with:
+#     python -m documents.search_index rebuild
+import logging
+import re
+import asyncio
+import argparse
+from collections import Counter
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from documents.utils import escape_like
+
+logger = logging.getLogger(__name__)
+
+MAX_TERM_LENGTH = 64 # Matches search_postings.term VARCHAR(64)
+MIN_TERM_LENGTH = 2
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    """Splits text into lowercase index terms (duplicates preserved)."""
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in _TOKEN_RE.findall(text.lower())
+        if len(token) >= MIN_TERM_LENGTH
+    ]
+
+# InnoDB's default full-text stopwords and innodb_ft_min_token_size: such words never match
+FULLTEXT_STOPWORDS = frozenset(
+    "a about an are as at be by com de en for from how i in is it la of on or "
+    "that the this to was what when where who will with und www".split()
+)
+FULLTEXT_MIN_WORD_LENGTH = 3
+_FULLTEXT_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE) # Titles are underscore-separated slugs
+
+def fulltext_boolean_query(query: str) -> Optional[str]:
+    """
+    Builds a MATCH ... AGAINST boolean-mode query requiring every word of `query`
+    as a prefix ("+python* +devel*"). Returns None if no word can be matched by
+    the FULLTEXT index, in which case callers fall back to substring search.
+    """
+    words = [
+        word for word in dict.fromkeys(_FULLTEXT_WORD_RE.findall(query.lower()))
+        if len(word) >= FULLTEXT_MIN_WORD_LENGTH and word not in FULLTEXT_STOPWORDS
+    ]
+    return " ".join(f"+{word}*" for word in words) or None
+
+def query_terms(query: str) -> List[str]:
+    """Returns the distinct terms of a search query, in query order."""
+    return list(dict.fromkeys(tokenize(query)))
+
+def postings_filter(query: str, id_column: str = "d.id") -> Optional[Tuple[str, list]]:
+    """
+    Builds a WHERE fragment restricting `id_column` to documents whose postings
+    contain every query term (each term matched as a prefix, so "engin" still
+    finds "engineering"). Returns None when the query has no indexable terms.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return None
+    clause = " AND ".join(
+        f"{id_column} IN (SELECT document_id FROM search_postings WHERE term LIKE %s)"
+        for _ in terms
+    )
+    return clause, [escape_like(term) + "%" for term in terms]
+
+async def index_document(cursor, document_id: int, text: str):
+    """Replaces the postings of a document with the terms of `text`."""
+    await remove_document(cursor, document_id)
+    term_counts = Counter(tokenize(text))
+    if not term_counts:
+        return
+    await cursor.executemany(
+        """
+        INSERT INTO search_postings (term, document_id, term_freq) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE term_freq = term_freq + VALUES(term_freq)
+        """,
+        [(term, document_id, count) for term, count in term_counts.items()],
+    )
+
+async def remove_document(cursor, document_id: int):
+    """Deletes every posting of a document."""
+    await cursor.execute("DELETE FROM search_postings WHERE document_id = %s", (document_id,))
+
+async def rebuild_index():
+    """Re-indexes the latest version of every document, preferring stored text over the files on disk."""
+    # Imported here so the tokenizer can be used without a DB/PDF stack
+    from database import get_async_db
+    from documents.extraction import read_text_from_file_async
+    from documents.text_store import LATEST_TEXT_JOIN
+
+    async with get_async_db() as (db, cursor):
+        await cursor.execute("SELECT id, latest_file_path FROM documents WHERE latest_file_path IS NOT NULL")
+        documents = await cursor.fetchall()
+
+    indexed = 0
+    for doc in documents:
+        # One short transaction per document keeps the index usable while rebuilding
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
+                "SELECT t.content FROM documents d" + LATEST_TEXT_JOIN + "WHERE d.id = %s", (doc["id"],)
+            )
+            stored = await cursor.fetchone()
+            if stored is not None:
+                text = stored["content"]
+            else:
+                try:
+                    text = await read_text_from_file_async(doc["latest_file_path"], raise_on_failure=True)
+                except (asyncio.TimeoutError, BrokenProcessPool, OSError) as e:
+                    logger.warning(f"Skipping document {doc['id']}: text extraction failed ({e!r}); its postings are unchanged.")
+                    continue
+            await index_document(cursor, doc["id"], text)
+        indexed += 1
+    logger.info(f"Indexed {indexed} documents.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the content search index.")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: re-index every document from disk")
+    args = parser.parse_args()
+    from logging_config import configure_logging
+    configure_logging()
+    if args.command == "rebuild":
+        asyncio.run(rebuild_index())
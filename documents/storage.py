@@ -0,0 +1,708 @@
+# documents/storage.py
+# Version files are stored content-addressed: each distinct file is written once
+# to BLOB_DIR under its SHA-256, document_versions rows point at the blob, and
+# the `blobs` table (see sql.txt) reference-counts it so a blob is only removed
+# when no version uses it any more.
+#
+# New blobs are compressed at rest when STORAGE_CODEC is set (see compression.py).
+#
+# Files are fanned out into hashed subdirectories so no single directory grows
+# to hundreds of thousands of entries: a blob lives at
+# BLOB_DIR/<d[0:2]>/<d[2:4]>/<digest><ext> for the default STORAGE_SHARD_DEPTH=2
+# and STORAGE_SHARD_WIDTH=2. Legacy per-upload files are keyed by the SHA-256
+# of their name instead. Paths recorded in the database are always resolved
+# through resolve_stored_path(), which also finds a file under the other
+# layout while a migration is moving it.
+#
+# Move versions uploaded before blobs existed into the blob store with:
+#     python -m documents.storage dedupe
+# Re-encode existing blobs with the configured (or given) codec, online, with:
+#     python -m documents.storage recompress [--codec zstd]
+# Move existing files into the configured sharded layout, online, with:
+#     python -m documents.storage shard
+import os
+import logging
+import time
+import shutil
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import re
+from typing import List, Optional, Tuple
+
+from tracing import traced
+from documents.compression import (
+    CODEC_IDENTITY, resolve_codec, codec_for_path, compress_file, strip_codec_suffix,
+    with_codec_suffix, open_decompressed,
+)
+
+logger = logging.getLogger(__name__)
+
+# Configuration (can move to a separate config file if needed)
+UPLOAD_DIR = "uploads"
+os.makedirs(UPLOAD_DIR, exist_ok=True) # Ensure upload directory exists
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+os.makedirs(BLOB_DIR, exist_ok=True)
+
+STORAGE_SHARD_DEPTH = int(os.getenv("STORAGE_SHARD_DEPTH", 2)) # Subdirectory levels per file (0 = flat)
+STORAGE_SHARD_WIDTH = int(os.getenv("STORAGE_SHARD_WIDTH", 2)) # Hex characters of the key per level (16^2 = 256 dirs)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024)) # Bytes read from the request per step
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 * 1024)) # Largest accepted version file
+MAX_BATCH_UPLOAD_FILES = int(os.getenv("MAX_BATCH_UPLOAD_FILES", 50)) # Files accepted by one batch upload
+# Readers accept the header anywhere in the first KiB, so allow the same here
+PDF_MAGIC = b"%PDF-"
+PDF_MAGIC_SEARCH_BYTES = 1024
+
+def is_within_upload_dir(file_path: str) -> bool:
+    """Returns True if file_path resolves inside UPLOAD_DIR (prevents directory traversal)."""
+    upload_root = os.path.abspath(UPLOAD_DIR)
+    return os.path.commonpath([upload_root, os.path.abspath(file_path)]) == upload_root
+
+# --- Path Resolution ---
+_DIGEST_NAME = re.compile(r"^[0-9a-f]{64}")
+
+def _shard_key(file_name: str) -> str:
+    """Blobs are sharded by their digest; any other stored file by the SHA-256 of its name."""
+    match = _DIGEST_NAME.match(file_name)
+    return match.group(0) if match else hashlib.sha256(file_name.encode("utf-8")).hexdigest()
+
+def _storage_root(file_path: str) -> str:
+    blob_root = os.path.abspath(BLOB_DIR)
+    if os.path.commonpath([blob_root, os.path.abspath(file_path)]) == blob_root:
+        return BLOB_DIR
+    return UPLOAD_DIR
+
+def shard_path(root: str, file_name: str) -> str:
+    """Returns where `file_name` belongs under `root` in the configured sharded layout."""
+    key = _shard_key(file_name)
+    levels = [key[i * STORAGE_SHARD_WIDTH:(i + 1) * STORAGE_SHARD_WIDTH] for i in range(STORAGE_SHARD_DEPTH)]
+    return os.path.join(root, *levels, file_name)
+
+def layout_path(file_path: str) -> str:
+    """Returns where a stored file (recorded under any layout) belongs in the configured one."""
+    return shard_path(_storage_root(file_path), os.path.basename(file_path))
+
+def _layout_candidates(file_path: str) -> List[str]:
+    root = _storage_root(file_path)
+    file_name = os.path.basename(file_path)
+    return [file_path, shard_path(root, file_name), os.path.join(root, file_name)]
+
+def resolve_stored_path(file_path: str) -> Optional[str]:
+    """
+    Returns the path a recorded file can be read from right now (blocking): the
+    recorded path itself, or the same file in the sharded or flat layout while
+    `shard` is moving it. Returns None if the file exists under none of them.
+    """
+    for candidate in dict.fromkeys(_layout_candidates(file_path)):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+def remove_stored_file(file_path: str) -> bool:
+    """Removes a recorded file under every layout it may exist in (blocking). Returns True if any was removed."""
+    removed = False
+    for candidate in dict.fromkeys(_layout_candidates(file_path)):
+        try:
+            os.remove(candidate)
+            removed = True
+        except FileNotFoundError:
+            pass
+    return removed
+
+def file_sha256(file_path: str) -> str:
+    """Returns the hex SHA-256 of a file (blocking)."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# --- Upload Pipeline ---
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+
+class UnsupportedUploadError(ValueError):
+    """Raised when an upload is not a PDF."""
+
+class UploadStats:
+    """
+    Counters for staged uploads: bytes, rejections, and the time spent copying
+    each upload from Starlette's spooled file into UPLOAD_DIR. The network
+    receive happens before the handler runs and is not part of these timings.
+    """
+
+    def __init__(self):
+        # Only updated from the event loop thread, so plain ints are sufficient
+        self.accepted = 0
+        self.rejected_too_large = 0
+        self.rejected_unsupported = 0
+        self.bytes_total = 0
+        self.staging_seconds_total = 0.0
+        self.peak_staging_bytes_per_second = 0.0
+
+    def record(self, size_bytes: int, seconds: float):
+        self.accepted += 1
+        self.bytes_total += size_bytes
+        self.staging_seconds_total += seconds
+        if seconds > 0:
+            self.peak_staging_bytes_per_second = max(self.peak_staging_bytes_per_second, size_bytes / seconds)
+
+    def stats(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "rejected_too_large": self.rejected_too_large,
+            "rejected_unsupported": self.rejected_unsupported,
+            "bytes_total": self.bytes_total,
+            "staging_seconds_total": self.staging_seconds_total,
+            "staging_bytes_per_second_avg": (
+                self.bytes_total / self.staging_seconds_total if self.staging_seconds_total else 0.0
+            ),
+            "staging_bytes_per_second_peak": self.peak_staging_bytes_per_second,
+        }
+
+upload_stats = UploadStats()
+
+MULTIPART_HEADER_LIMIT = 16 * 1024 # Part headers longer than this are left to the form parser
+
+def multipart_boundary(content_type: str) -> Optional[bytes]:
+    """Returns the boundary of a multipart/form-data Content-Type, or None for any other body."""
+    media_type, _, params = content_type.partition(";")
+    if media_type.strip().lower() != "multipart/form-data":
+        return None
+    match = re.search(r'boundary="?([^";]+)"?', params, re.IGNORECASE)
+    return match.group(1).encode("latin-1") if match else None
+
+class PdfPartSniffer:
+    """
+    Scans a multipart/form-data body as it arrives and reports a file part
+    whose first PDF_MAGIC_SEARCH_BYTES lack the PDF header, so a non-PDF
+    upload can be refused before the form parser spools the rest of it to
+    disk. receive_upload() repeats the check on the staged copy.
+    """
+
+    def __init__(self, boundary: bytes):
+        self._delimiter = b"\r\n--" + boundary
+        self._buffer = b"\r\n" # The body opens with the delimiter minus its line break
+        self._state = "delimiter"
+
+    def feed(self, data: bytes) -> bool:
+        """Consumes the next piece of the body. Returns False once a file part is shown not to be a PDF."""
+        if self._state == "done":
+            return True
+        self._buffer += data
+        while True:
+            if self._state == "delimiter":
+                index = self._buffer.find(self._delimiter)
+                if index < 0:
+                    # Keep just enough to match a delimiter split across pieces
+                    self._buffer = self._buffer[-(len(self._delimiter) - 1):]
+                    return True
+                self._buffer = self._buffer[index + len(self._delimiter):]
+                self._state = "headers"
+            elif self._state == "headers":
+                index = self._buffer.find(b"\r\n\r\n")
+                if index < 0:
+                    if len(self._buffer) > MULTIPART_HEADER_LIMIT:
+                        self._state = "done"
+                    return True
+                headers = self._buffer[:index].lower()
+                self._buffer = self._buffer[index + 4:]
+                self._state = "file" if b"filename=" in headers else "delimiter"
+            else:
+                end = self._buffer.find(self._delimiter, 0, PDF_MAGIC_SEARCH_BYTES + len(self._delimiter))
+                if end < 0 and len(self._buffer) < PDF_MAGIC_SEARCH_BYTES + len(self._delimiter):
+                    return True # Wait for more of the file (or its end)
+                head = self._buffer[:end if end >= 0 else PDF_MAGIC_SEARCH_BYTES]
+                if head and PDF_MAGIC not in head[:PDF_MAGIC_SEARCH_BYTES]:
+                    return False # Empty files are left to receive_upload, which reports them as such
+                self._state = "delimiter"
+
+def _write_chunk(handle, chunk: bytes):
+    handle.write(chunk)
+
+@traced("storage.receive_upload")
+async def receive_upload(upload, file_ext: str, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, str, int]:
+    """
+    Copies an UploadFile to a uniquely named temp file in UPLOAD_DIR, hashing
+    and counting bytes in the same pass. Starlette has already received (and
+    spooled) the whole request body by the time this runs; oversized and
+    non-PDF bodies are cut off earlier, while arriving, by
+    main.UploadGuardMiddleware. Stops copying as soon as the upload is shown
+    to be too large or not a PDF (raising UploadTooLargeError /
+    UnsupportedUploadError; the PDF check is on the first chunk, before
+    anything is written) and removes the partial file. Returns
+    (temp_path, sha256, size_bytes).
+    """
+    from fastapi.concurrency import run_in_threadpool
+
+    started = time.monotonic()
+    fd, temp_path = tempfile.mkstemp(prefix="temp_", suffix=file_ext.lower(), dir=UPLOAD_DIR)
+    digest = hashlib.sha256()
+    size_bytes = 0
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size_bytes == 0 and PDF_MAGIC not in chunk[:PDF_MAGIC_SEARCH_BYTES]:
+                    upload_stats.rejected_unsupported += 1
+                    raise UnsupportedUploadError("Only PDF files can be uploaded.")
+                size_bytes += len(chunk)
+                if size_bytes > max_bytes:
+                    upload_stats.rejected_too_large += 1
+                    raise UploadTooLargeError(f"File exceeds the {max_bytes} byte upload limit.")
+                digest.update(chunk)
+                await run_in_threadpool(_write_chunk, handle, chunk)
+        if size_bytes == 0:
+            upload_stats.rejected_unsupported += 1
+            raise UnsupportedUploadError("Uploaded file is empty.")
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+    elapsed = time.monotonic() - started
+    upload_stats.record(size_bytes, elapsed)
+    logger.debug("Staged upload %s: %s bytes in %.3fs", temp_path, size_bytes, elapsed)
+    return temp_path, digest.hexdigest(), size_bytes
+
+def blob_path(sha256: str, file_ext: str) -> str:
+    """Returns where the blob with this digest is stored."""
+    return shard_path(BLOB_DIR, f"{sha256}{file_ext.lower()}")
+
+def _link_or_copy(source_path: str, target_path: str):
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path) # Filesystem without hard links
+
+def _move_into_blob(source_path: str, target_path: str, keep_source: bool = False):
+    """Moves (or hard-links) a staged file to its blob path, or drops it if the blob already exists."""
+    if os.path.exists(target_path):
+        if not keep_source:
+            os.remove(source_path) # Identical bytes are already stored
+        return
+    if keep_source:
+        _link_or_copy(source_path, target_path)
+    else:
+        os.replace(source_path, target_path)
+
+def _write_new_blob(source_path: str, sha256: str, file_ext: str, codec: str, keep_source: bool) -> Tuple[str, str, int]:
+    """
+    Writes a staged file as a new blob, compressed with `codec` when that saves
+    space and raw otherwise (blocking). Returns (file_path, codec, stored_bytes).
+    """
+    raw_path = blob_path(sha256, file_ext)
+    os.makedirs(os.path.dirname(raw_path), exist_ok=True)
+    if codec != CODEC_IDENTITY:
+        compressed_path = with_codec_suffix(raw_path, codec)
+        if compress_file(source_path, compressed_path, codec):
+            if not keep_source:
+                os.remove(source_path)
+            return compressed_path, codec, os.path.getsize(compressed_path)
+    _move_into_blob(source_path, raw_path, keep_source)
+    return raw_path, CODEC_IDENTITY, os.path.getsize(raw_path)
+
+def _discard_source(source_path: str, keep_source: bool):
+    if not keep_source:
+        os.remove(source_path) # Identical bytes are already stored
+
+@traced("storage.store_blob")
+async def store_blob(cursor, source_path: str, sha256: str, file_ext: str, keep_source: bool = False,
+                     size_bytes: int = None, written: Optional[List[Tuple[str, str]]] = None) -> Tuple[str, str]:
+    """
+    Adds a reference to the blob with this digest inside the caller's transaction,
+    writing `source_path` into the store if the blob is new (otherwise the duplicate
+    file is deleted, or kept if `keep_source`). Returns the blob's (file_path, codec).
+    A newly written file is appended to `written` as (sha256, file_path), so the
+    caller can pass the list to discard_uncommitted_blobs() if it rolls back.
+    """
+    # Imported here so the CLI helpers do not need FastAPI
+    from fastapi.concurrency import run_in_threadpool
+
+    if size_bytes is None:
+        size_bytes = await run_in_threadpool(os.path.getsize, source_path)
+    # The upsert row-locks the blob until commit, so a concurrent delete cannot
+    # remove the file between this check and the caller's commit.
+    await cursor.execute(
+        """
+        INSERT INTO blobs (sha256, file_path, size_bytes, stored_bytes, codec, ref_count)
+        VALUES (%s, %s, %s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE ref_count = ref_count + 1
+        """,
+        (sha256, blob_path(sha256, file_ext), size_bytes, size_bytes, CODEC_IDENTITY),
+    )
+    await cursor.execute("SELECT file_path, codec, ref_count FROM blobs WHERE sha256 = %s", (sha256,))
+    blob = await cursor.fetchone()
+    if blob["ref_count"] > 1 and await run_in_threadpool(resolve_stored_path, blob["file_path"]):
+        await run_in_threadpool(_discard_source, source_path, keep_source)
+        return blob["file_path"], blob["codec"]
+
+    # New blob (or one whose file went missing): write it with the configured codec
+    stored_path, codec, stored_bytes = await run_in_threadpool(
+        _write_new_blob, source_path, sha256, file_ext, resolve_codec(), keep_source
+    )
+    if written is not None:
+        written.append((sha256, stored_path))
+    await cursor.execute(
+        "UPDATE blobs SET file_path = %s, codec = %s, stored_bytes = %s WHERE sha256 = %s",
+        (stored_path, codec, stored_bytes, sha256),
+    )
+    if blob["ref_count"] > 1 and stored_path != blob["file_path"]:
+        # Re-point versions still referencing a lost file under another name
+        await cursor.execute(
+            "UPDATE document_versions SET file_path = %s, codec = %s WHERE blob_sha256 = %s",
+            (stored_path, codec, sha256),
+        )
+    return stored_path, codec
+
+async def discard_uncommitted_blobs(written: List[Tuple[str, str]]):
+    """
+    Removes blob files written by store_blob() in a transaction that then rolled
+    back, so they do not linger on disk without a row. Each file is checked
+    under its blob's row lock and kept if a concurrent upload of the same bytes
+    has committed a row pointing at it meanwhile.
+    """
+    from fastapi.concurrency import run_in_threadpool
+    from database import get_async_db
+
+    for sha256, file_path in written:
+        try:
+            async with get_async_db() as (db, cursor):
+                # Locks the row, or the gap where it would go, until the file is gone
+                await cursor.execute("SELECT file_path FROM blobs WHERE sha256 = %s FOR UPDATE", (sha256,))
+                blob = await cursor.fetchone()
+                if blob is None or blob["file_path"] != file_path:
+                    await run_in_threadpool(_remove_if_present, file_path)
+                    logger.debug("Removed blob file of a rolled-back upload: %s", file_path)
+        except Exception as e:
+            logger.error(f"Could not remove blob file {file_path} of a rolled-back upload: {e}")
+
+async def release_blobs(cursor, sha256s: List[str]) -> List[str]:
+    """
+    Drops one reference per entry in `sha256s` (repeat a digest to drop several)
+    and deletes blobs left unreferenced. Returns the file paths of those blobs,
+    which the caller removes from disk.
+    """
+    counts = {}
+    for sha256 in sha256s:
+        counts[sha256] = counts.get(sha256, 0) + 1
+    if not counts:
+        return []
+    for sha256, count in counts.items():
+        await cursor.execute(
+            "UPDATE blobs SET ref_count = ref_count - %s WHERE sha256 = %s", (count, sha256)
+        )
+    placeholders = ", ".join(["%s"] * len(counts))
+    await cursor.execute(
+        f"SELECT file_path FROM blobs WHERE sha256 IN ({placeholders}) AND ref_count <= 0",
+        tuple(counts),
+    )
+    orphaned = [row["file_path"] for row in await cursor.fetchall()]
+    await cursor.execute(
+        f"DELETE FROM blobs WHERE sha256 IN ({placeholders}) AND ref_count <= 0", tuple(counts)
+    )
+    return orphaned
+
+async def dedupe_legacy_versions():
+    """Moves every version stored under a per-upload file name into the blob store."""
+    from fastapi.concurrency import run_in_threadpool
+    from database import get_async_db
+
+    async with get_async_db() as (db, cursor):
+        await cursor.execute("SELECT id, document_id, file_path FROM document_versions WHERE blob_sha256 IS NULL")
+        versions = await cursor.fetchall()
+
+    moved = 0
+    removed = 0
+    for version in versions:
+        legacy_path = version["file_path"]
+        if not is_within_upload_dir(legacy_path):
+            logger.warning(f"Skipping version {version['id']}: file outside UPLOAD_DIR ({legacy_path})")
+            continue
+        source_path = await run_in_threadpool(resolve_stored_path, legacy_path)
+        if source_path is None:
+            logger.warning(f"Skipping version {version['id']}: file missing ({legacy_path})")
+            continue
+        sha256 = await run_in_threadpool(file_sha256, source_path)
+        # Other rows may still point at the legacy file, so link rather than move it
+        async with get_async_db() as (db, cursor):
+            stored_path, codec = await store_blob(
+                cursor, source_path, sha256, os.path.splitext(legacy_path)[1], keep_source=True
+            )
+            await cursor.execute(
+                "UPDATE document_versions SET file_path = %s, blob_sha256 = %s, codec = %s WHERE id = %s",
+                (stored_path, sha256, codec, version["id"]),
+            )
+            await cursor.execute(
+                "UPDATE documents SET latest_file_path = %s WHERE id = %s AND latest_file_path = %s",
+                (stored_path, version["document_id"], legacy_path),
+            )
+            await cursor.execute(
+                "SELECT COUNT(*) AS remaining FROM document_versions WHERE file_path = %s", (legacy_path,)
+            )
+            still_used = (await cursor.fetchone())["remaining"] > 0
+        if not still_used:
+            await run_in_threadpool(remove_stored_file, legacy_path)
+            removed += 1
+        moved += 1
+    logger.info(f"Moved {moved} versions into the blob store and removed {removed} legacy files.")
+
+def _recode_blob(file_path: str, codec: str) -> Optional[Tuple[str, int]]:
+    """
+    Writes a copy of a stored blob re-encoded with `codec` at its place in the
+    configured layout (blocking). Returns (new_path, stored_bytes), or None if
+    compressing would not save space.
+    """
+    raw_path = layout_path(strip_codec_suffix(file_path))
+    os.makedirs(os.path.dirname(raw_path), exist_ok=True)
+    if codec == CODEC_IDENTITY:
+        target_path = raw_path
+        partial_path = target_path + ".part"
+        with open_decompressed(file_path) as source, open(partial_path, "wb") as target:
+            shutil.copyfileobj(source, target, HASH_CHUNK_SIZE)
+        os.replace(partial_path, target_path)
+        return target_path, os.path.getsize(target_path)
+
+    target_path = with_codec_suffix(raw_path, codec)
+    source_path = file_path
+    if codec_for_path(file_path) != CODEC_IDENTITY:
+        # Decode to a scratch copy first so the compressor reads plain bytes
+        source_path = raw_path + ".raw.part"
+        with open_decompressed(file_path) as source, open(source_path, "wb") as target:
+            shutil.copyfileobj(source, target, HASH_CHUNK_SIZE)
+    try:
+        if not compress_file(source_path, target_path, codec):
+            return None
+    finally:
+        if source_path != file_path:
+            os.remove(source_path)
+    return target_path, os.path.getsize(target_path)
+
+async def recompress_blobs(codec: Optional[str] = None, batch_size: int = 100, pause: float = 0.0):
+    """
+    Re-encodes every blob not yet stored with `codec` (default STORAGE_CODEC).
+    Runs alongside the API: each blob is rewritten to a new file, re-pointed in
+    one short transaction, and only then is the old file removed.
+    """
+    from fastapi.concurrency import run_in_threadpool
+    from database import get_async_db
+
+    codec = resolve_codec(codec)
+    last_sha256 = ""
+    recoded = 0
+    skipped = 0
+    bytes_saved = 0
+    while True:
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
+                """
+                SELECT sha256, file_path, stored_bytes FROM blobs
+                WHERE sha256 > %s AND codec <> %s
+                ORDER BY sha256
+                LIMIT %s
+                """,
+                (last_sha256, codec, batch_size),
+            )
+            blobs = await cursor.fetchall()
+        if not blobs:
+            break
+
+        for blob in blobs:
+            old_path = blob["file_path"]
+            source_path = await run_in_threadpool(resolve_stored_path, old_path) if is_within_upload_dir(old_path) else None
+            if source_path is None:
+                logger.warning(f"Skipping blob {blob['sha256']}: file missing or outside UPLOAD_DIR ({old_path})")
+                continue
+            result = await run_in_threadpool(_recode_blob, source_path, codec)
+            if result is None:
+                skipped += 1 # Incompressible: stays raw
+                continue
+            new_path, stored_bytes = result
+
+            async with get_async_db() as (db, cursor):
+                await cursor.execute(
+                    "SELECT file_path FROM blobs WHERE sha256 = %s FOR UPDATE", (blob["sha256"],)
+                )
+                current = await cursor.fetchone()
+                if current is None or current["file_path"] != old_path:
+                    current = None # Deleted or moved meanwhile; drop our copy
+                else:
+                    await cursor.execute(
+                        "UPDATE blobs SET file_path = %s, codec = %s, stored_bytes = %s WHERE sha256 = %s",
+                        (new_path, codec, stored_bytes, blob["sha256"]),
+                    )
+                    await cursor.execute(
+                        "UPDATE document_versions SET file_path = %s, codec = %s WHERE blob_sha256 = %s",
+                        (new_path, codec, blob["sha256"]),
+                    )
+                    await cursor.execute(
+                        "UPDATE documents SET latest_file_path = %s WHERE latest_file_path = %s",
+                        (new_path, old_path),
+                    )
+            if current is None:
+                await run_in_threadpool(os.remove, new_path)
+            else:
+                await run_in_threadpool(remove_stored_file, old_path)
+                recoded += 1
+                bytes_saved += (blob["stored_bytes"] or 0) - stored_bytes
+            if pause:
+                await asyncio.sleep(pause) # Leave disk bandwidth for live traffic
+
+        last_sha256 = blobs[-1]["sha256"]
+        logger.info(f"Re-encoded {recoded} blobs so far ({skipped} incompressible, last {last_sha256}).")
+
+    logger.info(f"Recompress complete: {recoded} blobs now stored as {codec}, {skipped} kept raw, {bytes_saved} bytes saved.")
+
+def _link_into_layout(old_path: str, new_path: str) -> bool:
+    """Hard-links (or copies) a stored file to its sharded path (blocking). Returns True if a new file was created."""
+    if os.path.exists(new_path):
+        return False
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    _link_or_copy(old_path, new_path)
+    return True
+
+def _remove_if_present(file_path: str):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass # A concurrent delete already removed it
+
+async def _shard_blobs(batch_size: int, pause: float) -> int:
+    from fastapi.concurrency import run_in_threadpool
+    from database import get_async_db
+
+    last_sha256 = ""
+    moved = 0
+    while True:
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
+                "SELECT sha256, file_path FROM blobs WHERE sha256 > %s ORDER BY sha256 LIMIT %s",
+                (last_sha256, batch_size),
+            )
+            blobs = await cursor.fetchall()
+        if not blobs:
+            return moved
+
+        for blob in blobs:
+            old_path = blob["file_path"]
+            new_path = layout_path(old_path)
+            if new_path == old_path:
+                continue
+            if not is_within_upload_dir(old_path) or not os.path.isfile(old_path):
+                logger.warning(f"Skipping blob {blob['sha256']}: file missing or outside UPLOAD_DIR ({old_path})")
+                continue
+            created = await run_in_threadpool(_link_into_layout, old_path, new_path)
+
+            # The row lock orders this against uploads adding a reference, so every
+            # version row of the blob is re-pointed in the same transaction
+            async with get_async_db() as (db, cursor):
+                await cursor.execute("SELECT file_path FROM blobs WHERE sha256 = %s FOR UPDATE", (blob["sha256"],))
+                current = await cursor.fetchone()
+                unchanged = current is not None and current["file_path"] == old_path
+                if unchanged:
+                    await cursor.execute("UPDATE blobs SET file_path = %s WHERE sha256 = %s", (new_path, blob["sha256"]))
+                    await cursor.execute(
+                        "UPDATE document_versions SET file_path = %s WHERE blob_sha256 = %s", (new_path, blob["sha256"])
+                    )
+                    await cursor.execute(
+                        "UPDATE documents SET latest_file_path = %s WHERE latest_file_path = %s", (new_path, old_path)
+                    )
+            # Readers holding the old path fall back to the sharded one (resolve_stored_path)
+            if unchanged:
+                await run_in_threadpool(_remove_if_present, old_path)
+                moved += 1
+            elif created and (current is None or current["file_path"] != new_path):
+                await run_in_threadpool(_remove_if_present, new_path) # Deleted or re-encoded meanwhile
+            if pause:
+                await asyncio.sleep(pause)
+
+        last_sha256 = blobs[-1]["sha256"]
+        logger.info(f"Sharded {moved} blobs so far (last {last_sha256}).")
+
+async def _shard_legacy_versions(batch_size: int, pause: float) -> int:
+    from fastapi.concurrency import run_in_threadpool
+    from database import get_async_db
+
+    last_id = 0
+    moved = 0
+    while True:
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
+                """
+                SELECT id, file_path FROM document_versions
+                WHERE id > %s AND blob_sha256 IS NULL
+                ORDER BY id
+                LIMIT %s
+                """,
+                (last_id, batch_size),
+            )
+            versions = await cursor.fetchall()
+        if not versions:
+            return moved
+
+        for version in versions:
+            old_path = version["file_path"]
+            new_path = layout_path(old_path)
+            if new_path == old_path:
+                continue
+            if not is_within_upload_dir(old_path) or not os.path.isfile(old_path):
+                logger.warning(f"Skipping version {version['id']}: file missing or outside UPLOAD_DIR ({old_path})")
+                continue
+            await run_in_threadpool(_link_into_layout, old_path, new_path)
+            async with get_async_db() as (db, cursor):
+                await cursor.execute(
+                    "UPDATE document_versions SET file_path = %s WHERE file_path = %s", (new_path, old_path)
+                )
+                await cursor.execute(
+                    "UPDATE documents SET latest_file_path = %s WHERE latest_file_path = %s", (new_path, old_path)
+                )
+            await run_in_threadpool(_remove_if_present, old_path)
+            moved += 1
+            if pause:
+                await asyncio.sleep(pause)
+
+        last_id = versions[-1]["id"]
+        logger.info(f"Sharded {moved} legacy version files so far (last version {last_id}).")
+
+async def shard_existing_files(batch_size: int = 100, pause: float = 0.0):
+    """
+    Moves blobs and legacy version files recorded outside the configured layout
+    (flat, or sharded with another depth/width) into it, alongside the API.
+    Each file is hard-linked to its new path, the rows pointing at it are
+    updated in one short transaction, and only then is the old name unlinked;
+    readers that loaded the old path meanwhile find the file through
+    resolve_stored_path().
+    """
+    blobs = await _shard_blobs(batch_size, pause)
+    legacy = await _shard_legacy_versions(batch_size, pause)
+    logger.info(
+        f"Shard complete: {blobs} blobs and {legacy} legacy files moved into the "
+        f"depth {STORAGE_SHARD_DEPTH} / width {STORAGE_SHARD_WIDTH} layout."
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage document version storage.")
+    parser.add_argument(
+        "command", choices=["dedupe", "recompress", "shard"],
+        help="dedupe: move legacy version files into the blob store; recompress: re-encode blobs with a codec; "
+             "shard: move files into the STORAGE_SHARD_DEPTH/WIDTH layout",
+    )
+    parser.add_argument("--codec", help="recompress: identity, gzip or zstd (default STORAGE_CODEC)")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--pause", type=float, default=0.0, help="recompress/shard: seconds to sleep between files")
+    args = parser.parse_args()
+    from logging_config import configure_logging
+    configure_logging()
+    if args.command == "dedupe":
+        asyncio.run(dedupe_legacy_versions())
+    elif args.command == "recompress":
+        asyncio.run(recompress_blobs(args.codec, args.batch_size, args.pause))
+    elif args.command == "shard":
+        asyncio.run(shard_existing_files(args.batch_size, args.pause))
@@ -0,0 +1,107 @@
+# documents/text_store.py
+# Extracted text of each document version, stored once in the `document_text`
+# table (see sql.txt). Version files never change after upload, so their text
+# is extracted a single time and content search reads it from here instead of
+# re-parsing PDFs.
+#
+# Populate text for versions uploaded before this table existed with:
+#     python -m documents.text_store backfill
+import logging
+import asyncio
+import argparse
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Joins the stored text of each document's latest version onto a documents row aliased `d`
+LATEST_TEXT_JOIN = """
+    JOIN document_text t ON t.version_id = (
+        SELECT dv.id FROM document_versions dv
+        WHERE dv.document_id = d.id
+        ORDER BY dv.version DESC
+        LIMIT 1
+    )
+"""
+
+async def save_version_text(cursor, version_id: int, text: str):
+    """Stores (or replaces) the extracted text of a document version."""
+    await cursor.execute(
+        """
+        INSERT INTO document_text (version_id, content) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE content = VALUES(content), extracted_at = NOW()
+        """,
+        (version_id, text),
+    )
+
+async def get_version_text(cursor, version_id: int) -> Optional[str]:
+    """Returns the stored text of a document version, or None if it was never extracted."""
+    await cursor.execute("SELECT content FROM document_text WHERE version_id = %s", (version_id,))
+    row = await cursor.fetchone()
+    return row["content"] if row else None
+
+async def get_blob_text(cursor, sha256: str) -> Optional[str]:
+    """Returns text already stored for any version of the blob with this digest, if any."""
+    await cursor.execute(
+        """
+        SELECT t.content FROM document_text t
+        JOIN document_versions dv ON dv.id = t.version_id
+        WHERE dv.blob_sha256 = %s
+        LIMIT 1
+        """,
+        (sha256,),
+    )
+    row = await cursor.fetchone()
+    return row["content"] if row else None
+
+async def backfill(batch_size: int = 100):
+    """Extracts and stores text for every version that has none yet."""
+    # Imported here so the SQL helpers can be used without a DB/PDF stack
+    from fastapi.concurrency import run_in_threadpool
+    from database import get_async_db
+    from documents.extraction import read_texts_from_files
+
+    last_id = 0
+    stored = 0
+    while True:
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
+                """
+                SELECT dv.id, dv.file_path
+                FROM document_versions dv
+                LEFT JOIN document_text t ON t.version_id = dv.id
+                WHERE t.version_id IS NULL AND dv.id > %s
+                ORDER BY dv.id
+                LIMIT %s
+                """,
+                (last_id, batch_size),
+            )
+            versions = await cursor.fetchall()
+        if not versions:
+            break
+
+        # The whole batch is extracted in parallel across the extraction worker processes
+        texts_by_path = await run_in_threadpool(read_texts_from_files, [v["file_path"] for v in versions])
+        texts = [(version["id"], texts_by_path[version["file_path"]]) for version in versions]
+        failed = [version_id for version_id, text in texts if text is None]
+        if failed:
+            # Left without text so the next backfill retries them
+            logger.warning(f"Text extraction timed out or crashed for versions {failed}; skipping them.")
+        texts = [(version_id, text) for version_id, text in texts if text is not None]
+        async with get_async_db() as (db, cursor):
+            for version_id, text in texts:
+                await save_version_text(cursor, version_id, text)
+        stored += len(texts)
+        last_id = versions[-1]["id"]
+        logger.info(f"Stored text for {stored} versions so far (last version id {last_id}).")
+
+    logger.info(f"Backfill complete: stored text for {stored} versions.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage stored document text.")
+    parser.add_argument("command", choices=["backfill"], help="backfill: extract text for versions that have none")
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    from logging_config import configure_logging
+    configure_logging()
+    if args.command == "backfill":
+        asyncio.run(backfill(args.batch_size))
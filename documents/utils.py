@@ -7,4 +7,8 @@ def sanitize_filename(filename: str) -> str:
     base = os.path.splitext(filename)[0]
     sanitized = re.sub(r"[^\w\-]+", "_", base)
     sanitized = re.sub(r"_+", "_", sanitized).strip("_")
-    return sanitized if sanitized else "untitled"
\ No newline at end of file
+    return sanitized if sanitized else "untitled"
+
+def escape_like(value: str) -> str:
+    """Escapes LIKE wildcards so user input matches literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
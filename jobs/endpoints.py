@@ -0,0 +1,33 @@
+# jobs/endpoints.py
+import logging
+import mysql.connector
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from auth import get_current_user, UserInDB
+from jobs.queue import get_queue_stats
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["jobs"]
+)
+
+@router.get("/stats")
+async def job_queue_stats(
+    window_minutes: int = Query(60, ge=1, le=7 * 24 * 60),
+    current_user: UserInDB = Depends(get_current_user), # Any authenticated user
+):
+    """
+    Reports queue depth per job kind and status (with the age of the oldest due
+    job), latency of jobs finished in the last `window_minutes`, and this API
+    process's worker counters.
+    """
+    try:
+        return await get_queue_stats(window_minutes)
+    except mysql.connector.Error as e:
+        logger.error(f"DB Error reading job queue stats: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error reading job stats.")
+    except Exception as e:
+        logger.exception(f"Error reading job queue stats: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Server error reading job stats.")
@@ -0,0 +1,367 @@
+# jobs/queue.py
+# Persistent background job queue. Jobs live in the MySQL `jobs` table (see
+# sql.txt), so they survive restarts and can be enqueued inside the same
+# transaction as the rows they refer to. Workers claim jobs with
+# SELECT ... FOR UPDATE SKIP LOCKED, which lets several workers (in the API
+# process or in standalone worker processes) share one table safely.
+#
+# Handlers are registered per job kind with @register_job("kind"). A failing
+# job is retried with exponential backoff until it runs out of attempts;
+# raise PermanentJobError to fail it immediately. A job whose worker dies or
+# hangs counts an attempt too: it is re-queued when its lock times out, or
+# failed if that was its last attempt.
+#
+# Run a standalone worker (instead of, or as well as, the in-process one) with:
+#     python -m jobs.queue work
+import os
+import logging
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import mysql.connector
+from database import get_async_db
+from logging_config import request_id_var
+
+logger = logging.getLogger(__name__)
+
+# Configuration (can move to a separate config file if needed)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2)) # Jobs run concurrently per process (0 = no in-process worker)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2)) # Seconds between polls when idle
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", 2)) # Seconds before the first retry, doubled per attempt
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", 600))
+JOB_LOCK_TIMEOUT = int(os.getenv("JOB_LOCK_TIMEOUT", 900)) # Running jobs older than this are presumed lost
+JOB_RETENTION_HOURS = int(os.getenv("JOB_RETENTION_HOURS", 72)) # Finished jobs are deleted after this
+JOB_MAINTENANCE_INTERVAL = float(os.getenv("JOB_MAINTENANCE_INTERVAL", 60))
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help; the job fails immediately."""
+
+JobHandler = Callable[[dict], Awaitable[None]]
+_handlers: Dict[str, JobHandler] = {}
+
+def register_job(kind: str):
+    """Decorator registering an async handler `handler(payload)` for a job kind."""
+    def decorator(handler: JobHandler) -> JobHandler:
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+async def enqueue(cursor, kind: str, payload: dict, delay: float = 0, max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+    """
+    Adds a job inside the caller's transaction, so it only becomes visible to
+    workers if that transaction commits. Call job_queue.notify() after the
+    commit to have an in-process worker pick it up without waiting for a poll.
+    """
+    await cursor.execute(
+        """
+        INSERT INTO jobs (kind, payload, max_attempts, run_after)
+        VALUES (%s, %s, %s, NOW(6) + INTERVAL %s MICROSECOND)
+        """,
+        (kind, json.dumps(payload), max_attempts, int(delay * 1_000_000)),
+    )
+    return cursor.lastrowid
+
+async def enqueue_many(cursor, kind: str, payloads: List[dict], max_attempts: int = JOB_MAX_ATTEMPTS):
+    """Bulk enqueue of jobs of one kind."""
+    if not payloads:
+        return
+    await cursor.executemany(
+        "INSERT INTO jobs (kind, payload, max_attempts, run_after) VALUES (%s, %s, %s, NOW(6))",
+        [(kind, json.dumps(payload), max_attempts) for payload in payloads],
+    )
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before retry number `attempts` (1-based): exponential, capped, with jitter."""
+    delay = min(JOB_BACKOFF_BASE * (2 ** (attempts - 1)), JOB_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+class JobQueue:
+    """
+    Runs up to `workers` jobs at a time from the `jobs` table. Each worker
+    task claims one job, runs its handler and records the outcome; idle
+    workers poll every `poll_interval` seconds or wake on notify().
+    """
+
+    def __init__(self, workers: int, poll_interval: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._stopping = False
+        # Counters are only updated from the event loop thread
+        self.in_flight = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        self.run_seconds_total = 0.0
+        self.run_seconds_max = 0.0
+
+    def start(self):
+        """Starts the worker tasks (and periodic maintenance) on the running loop."""
+        if self._tasks or self.workers <= 0:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._stop_event = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker_loop(n)) for n in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance_loop()))
+        logger.info(f"Job queue started with {self.workers} workers ({self.worker_id}).")
+
+    async def stop(self):
+        """Stops claiming jobs and waits for running ones to finish."""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+            self._stop_event.set()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wakes idle in-process workers (call after committing new jobs)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker_loop(self, number: int):
+        while not self._stopping:
+            # Cleared before claiming so a notify() during the claim is not lost
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+            except (mysql.connector.Error, OSError) as e:
+                logger.error(f"Job worker {number}: error claiming job: {e}")
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            await self._run(job)
+
+    async def _idle(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _claim(self) -> Optional[dict]:
+        """Locks the next due job for this worker, skipping jobs other workers hold."""
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
+                """
+                SELECT id, kind, payload, attempts, max_attempts FROM jobs
+                WHERE status = 'queued' AND run_after <= NOW(6)
+                ORDER BY run_after, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+                """
+            )
+            job = await cursor.fetchone()
+            if job is None:
+                return None
+            await cursor.execute(
+                """
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = %s,
+                    locked_at = NOW(6), started_at = COALESCE(started_at, NOW(6))
+                WHERE id = %s
+                """,
+                (self.worker_id, job["id"]),
+            )
+        job["attempts"] += 1
+        return job
+
+    async def _run(self, job: dict):
+        handler = _handlers.get(job["kind"])
+        started = time.monotonic()
+        self.in_flight += 1
+        error = None
+        permanent = False
+        log_context = request_id_var.set(f"job-{job['id']}") # Correlates the handler's log lines
+        try:
+            if handler is None:
+                raise PermanentJobError(f"No handler registered for job kind '{job['kind']}'.")
+            payload = job["payload"]
+            await handler(json.loads(payload) if isinstance(payload, (str, bytes)) else payload)
+        except PermanentJobError as e:
+            error, permanent = e, True
+        except Exception as e:
+            error = e
+            logger.exception(f"Job {job['id']} ({job['kind']}) raised on attempt {job['attempts']}")
+        finally:
+            self.in_flight -= 1
+            elapsed = time.monotonic() - started
+            self.run_seconds_total += elapsed
+            self.run_seconds_max = max(self.run_seconds_max, elapsed)
+
+        try:
+            await self._record_outcome(job, error, permanent)
+        except (mysql.connector.Error, OSError) as e:
+            # The job stays 'running' and is re-queued once its lock times out
+            logger.error(f"Error recording outcome of job {job['id']}: {e}")
+        finally:
+            request_id_var.reset(log_context)
+
+    async def _record_outcome(self, job: dict, error: Optional[Exception], permanent: bool):
+        async with get_async_db() as (db, cursor):
+            if error is None:
+                self.succeeded += 1
+                await cursor.execute(
+                    "UPDATE jobs SET status = 'done', finished_at = NOW(6), locked_by = NULL, last_error = NULL WHERE id = %s",
+                    (job["id"],),
+                )
+            elif not permanent and job["attempts"] < job["max_attempts"]:
+                self.retried += 1
+                delay = backoff_seconds(job["attempts"])
+                logger.warning(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}, retrying in {delay:.1f}s: {error}")
+                await cursor.execute(
+                    """
+                    UPDATE jobs SET status = 'queued', locked_by = NULL, last_error = %s,
+                        run_after = NOW(6) + INTERVAL %s MICROSECOND
+                    WHERE id = %s
+                    """,
+                    (str(error)[:2000], int(delay * 1_000_000), job["id"]),
+                )
+            else:
+                self.failed += 1
+                logger.warning(f"Job {job['id']} ({job['kind']}) failed permanently after {job['attempts']} attempts: {error}")
+                await cursor.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = NOW(6), locked_by = NULL, last_error = %s WHERE id = %s",
+                    (str(error)[:2000], job["id"]),
+                )
+
+    async def _maintenance_loop(self):
+        while not self._stopping:
+            try:
+                await self.maintain()
+            except (mysql.connector.Error, OSError) as e:
+                logger.error(f"Job queue maintenance error: {e}")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=JOB_MAINTENANCE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def maintain(self):
+        """
+        Re-queues jobs whose worker died mid-run (or fails them once they have
+        used up their attempts, so a job that kills or hangs its worker is not
+        re-run forever) and deletes old finished jobs.
+        """
+        async with get_async_db() as (db, cursor):
+            await cursor.execute(
+                """
+                UPDATE jobs SET status = 'failed', finished_at = NOW(6), locked_by = NULL,
+                    last_error = 'Worker lock timed out on the last attempt'
+                WHERE status = 'running' AND locked_at < NOW(6) - INTERVAL %s SECOND
+                    AND attempts >= max_attempts
+                """,
+                (JOB_LOCK_TIMEOUT,),
+            )
+            if cursor.rowcount:
+                logger.warning(f"Failed {cursor.rowcount} jobs whose worker lock timed out on their last attempt.")
+            await cursor.execute(
+                """
+                UPDATE jobs SET status = 'queued', locked_by = NULL,
+                    last_error = 'Worker lock timed out'
+                WHERE status = 'running' AND locked_at < NOW(6) - INTERVAL %s SECOND
+                    AND attempts < max_attempts
+                """,
+                (JOB_LOCK_TIMEOUT,),
+            )
+            if cursor.rowcount:
+                logger.info(f"Re-queued {cursor.rowcount} jobs whose worker lock timed out.")
+            await cursor.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < NOW(6) - INTERVAL %s HOUR",
+                (JOB_RETENTION_HOURS,),
+            )
+
+    def stats(self) -> dict:
+        """This process's worker counters."""
+        processed = self.succeeded + self.retried + self.failed
+        return {
+            "worker_id": self.worker_id,
+            "workers": self.workers,
+            "running": bool(self._tasks),
+            "in_flight": self.in_flight,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+            "run_seconds_avg": self.run_seconds_total / processed if processed else 0.0,
+            "run_seconds_max": self.run_seconds_max,
+        }
+
+job_queue = JobQueue(JOB_WORKERS, JOB_POLL_INTERVAL)
+
+async def get_queue_stats(window_minutes: int = 60) -> dict:
+    """Queue depth per kind/status and job latency (enqueue to finish) over a recent window."""
+    async with get_async_db() as (db, cursor):
+        await cursor.execute(
+            """
+            SELECT kind, status, COUNT(*) AS jobs,
+                   TIMESTAMPDIFF(MICROSECOND, MIN(CASE WHEN status = 'queued' THEN run_after END), NOW(6)) / 1e6 AS oldest_due_seconds
+            FROM jobs
+            GROUP BY kind, status
+            """
+        )
+        depth = await cursor.fetchall()
+        await cursor.execute(
+            """
+            SELECT kind, COUNT(*) AS finished,
+                   AVG(TIMESTAMPDIFF(MICROSECOND, created_at, finished_at)) / 1e6 AS latency_seconds_avg,
+                   MAX(TIMESTAMPDIFF(MICROSECOND, created_at, finished_at)) / 1e6 AS latency_seconds_max,
+                   AVG(TIMESTAMPDIFF(MICROSECOND, created_at, started_at)) / 1e6 AS wait_seconds_avg
+            FROM jobs
+            WHERE status = 'done' AND finished_at >= NOW(6) - INTERVAL %s MINUTE
+            GROUP BY kind
+            """,
+            (window_minutes,),
+        )
+        latency = await cursor.fetchall()
+    return {
+        "depth": [
+            {
+                "kind": row["kind"],
+                "status": row["status"],
+                "jobs": row["jobs"],
+                "oldest_due_seconds": max(0.0, float(row["oldest_due_seconds"])) if row["oldest_due_seconds"] is not None else None,
+            }
+            for row in depth
+        ],
+        "latency": [
+            {key: float(value) if value is not None and key != "kind" else value for key, value in row.items()}
+            for row in latency
+        ],
+        "latency_window_minutes": window_minutes,
+        "worker": job_queue.stats(),
+    }
+
+async def run_worker(workers: int):
+    """Runs a standalone worker process until interrupted."""
+    # Imported here so the handlers register themselves in this process too
+    import documents.jobs # noqa: F401
+
+    queue = JobQueue(workers, JOB_POLL_INTERVAL)
+    queue.start()
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await queue.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Background job queue.")
+    parser.add_argument("command", choices=["work"], help="work: run a standalone job worker")
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1))
+    args = parser.parse_args()
+    from logging_config import configure_logging
+    configure_logging()
+    if args.command == "work":
+        try:
+            asyncio.run(run_worker(args.workers))
+        except KeyboardInterrupt:
+            logger.info("Job worker stopped.")
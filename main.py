@@ -1,8 +1,13 @@
 # main.py
 import os
-from fastapi import FastAPI
+import logging
+from logging_config import configure_logging, logging_stats, RequestIdMiddleware, REQUEST_ID_HEADER
+
+configure_logging() # Before the imports below, so their import-time warnings are queued too
+
+from fastapi import FastAPI, status
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.exceptions import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -10,10 +15,113 @@ from fastapi.middleware.cors import CORSMiddleware
 from auth import router as auth_router
 from users.endpoints import router as users_router
 from documents.endpoints import router as documents_router
+from jobs.endpoints import router as jobs_router
+from database import pool as db_pool, slow_query_log
+from pagination import NEXT_CURSOR_HEADER
+from documents.extraction import extraction_pool
+from jobs.queue import job_queue
+from documents.storage import (
+    MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_FILES, PdfPartSniffer, multipart_boundary, upload_stats,
+)
+from documents.extraction import text_cache
+from documents.previews import preview_cache
+from auth import password_hasher
+import metrics
+from tracing import TracingMiddleware, tracing_stats
+
+logger = logging.getLogger(__name__)
 
 # --- FastAPI App Initialization ---
 app = FastAPI(title="Document Management System API (mysql.connector Version)")
 
+# --- Upload Size and Type Limits ---
+# Room for multipart boundaries and the other form fields around the file itself
+MULTIPART_OVERHEAD_BYTES = int(os.getenv("MULTIPART_OVERHEAD_BYTES", 64 * 1024))
+
+# Upload routes whose multipart bodies may only carry PDF files
+PDF_UPLOAD_PATHS = ("/documents/", "/documents/batch")
+
+class UploadGuardMiddleware:
+    """
+    Refuses bad upload bodies while they arrive, so the rest is never read
+    (and never spooled to disk by the multipart parser): bodies over the
+    upload limit get 413, up front when the declared Content-Length is too
+    large, otherwise (chunked uploads) as soon as the bytes received pass the
+    limit; a file part on an upload route that does not start like a PDF gets
+    415 as soon as its first bytes are in.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = MAX_UPLOAD_BYTES
+        if scope["path"] == "/documents/batch":
+            limit *= MAX_BATCH_UPLOAD_FILES
+        too_large = JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            content={"detail": f"Request body exceeds the {limit} byte upload limit."},
+        )
+        sniffer = None
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit + MULTIPART_OVERHEAD_BYTES:
+                await too_large(scope, receive, send)
+                return
+            if name == b"content-type" and scope["method"] == "POST" and scope["path"] in PDF_UPLOAD_PATHS:
+                boundary = multipart_boundary(value.decode("latin-1"))
+                if boundary:
+                    sniffer = PdfPartSniffer(boundary)
+
+        received = 0
+        rejected = False
+        response_started = False
+
+        async def reject(response):
+            nonlocal rejected
+            rejected = True
+            if not response_started:
+                await response(scope, receive, send)
+            # The app sees a disconnect and stops parsing; its own response is dropped below
+            return {"type": "http.disconnect"}
+
+        async def guarded_receive():
+            nonlocal received
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                received += len(body)
+                if received > limit + MULTIPART_OVERHEAD_BYTES:
+                    return await reject(too_large)
+                if sniffer is not None and not sniffer.feed(body):
+                    upload_stats.rejected_unsupported += 1
+                    return await reject(JSONResponse(
+                        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                        content={"detail": "Only PDF files can be uploaded."},
+                    ))
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, guarded_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise # Otherwise: the body parser giving up on the cut-off request, already answered
+
+# Added before CORS so the CORS middleware wraps (and decorates) these rejections
+app.add_middleware(UploadGuardMiddleware)
+
 # --- CORS Middleware ---
 # Get allowed origins from environment variable, default to localhost
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://localhost:8000").split(",")
@@ -24,18 +132,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], # Or specify ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
     allow_headers=["*"], # Or specify specific headers like ["Authorization", "Content-Type"]
+    # Let browser clients read list pagination cursors and download validators/ranges
+    expose_headers=[NEXT_CURSOR_HEADER, REQUEST_ID_HEADER, "Content-Disposition", "ETag", "Last-Modified", "Content-Range", "Accept-Ranges"],
 )
 
+# --- Metrics ---
+# Wraps the middleware above so it times the whole request, including rejections
+app.add_middleware(metrics.MetricsMiddleware)
+# Root span of each request's trace (inside RequestIdMiddleware so the span records the request id)
+app.add_middleware(TracingMiddleware)
+# Outermost of all, so every log line of a request (including middleware's) carries its id
+app.add_middleware(RequestIdMiddleware)
+metrics.registry.register_stats("db_pool", "Connection pool", db_pool.stats)
+metrics.registry.register_stats("uploads", "Staged uploads", upload_stats.stats)
+metrics.registry.register_stats("password_hasher", "bcrypt executor", password_hasher.stats)
+metrics.registry.register_stats("text_cache", "Extracted text cache", text_cache.stats)
+metrics.registry.register_stats("preview_cache", "Page preview cache", preview_cache.stats)
+metrics.registry.register_stats("job_worker", "Background job workers in this process", job_queue.stats)
+metrics.registry.register_stats("slow_queries", "Slow query log", slow_query_log.stats)
+metrics.registry.register_stats("tracing", "Span exporter", tracing_stats)
+metrics.registry.register_stats("logging", "Log records waiting for or dropped by the writer thread", logging_stats)
+
 # --- Include Routers ---
 app.include_router(auth_router)
 app.include_router(users_router)
 app.include_router(documents_router)
+app.include_router(jobs_router)
+app.include_router(metrics.router)
 
 # --- Static Files ---
 # Ensure the 'static' directory exists
 STATIC_DIR = "static"
 if not os.path.isdir(STATIC_DIR):
-     print(f"Warning: Static directory '{STATIC_DIR}' not found. Skipping static file serving.")
+     logger.warning(f"Static directory '{STATIC_DIR}' not found. Skipping static file serving.")
 else:
     app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
@@ -59,11 +188,14 @@ async def dashboard():
     return dashboard_content
 
 # Any other general app-level configurations or events go here
-# For example:
-# @app.on_event("startup"):
-# async def startup_event():
-#     print("App starting up...")
-
-# @app.on_event("shutdown"):
-# async def shutdown_event():
-#     print("App shutting down...")
\ No newline at end of file
+@app.on_event("startup")
+async def startup_event():
+    logger.info("App starting up, starting background job workers...")
+    job_queue.start() # Post-upload processing (text extraction, indexing, blob checks)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    logger.info("App shutting down, stopping job workers and closing pooled DB connections...")
+    await job_queue.stop()
+    db_pool.dispose()
+    extraction_pool.shutdown()
\ No newline at end of file
@@ -0,0 +1,245 @@
+# metrics.py
+# In-process metrics exposed at /metrics in the Prometheus text format. Hot
+# paths only touch plain counters under a per-metric lock (no I/O, no
+# allocation per sample beyond the first use of a label set), so the
+# instrumentation is cheap enough to stay enabled in production. Counters
+# that already live on the pools and caches (see their stats() methods) are
+# read at scrape time instead of being duplicated here.
+#
+# Values are per API process: with several uvicorn workers, scrape each one or
+# run a single worker per container.
+import os
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0" # Set to 0 to skip all instrumentation
+# Optional bearer token required to scrape /metrics (it is unauthenticated otherwise)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_PREFIX = "docuvault_"
+
+# Upper bounds (seconds) of latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    """Monotonic count per label set."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values
+        ]
+
+class Gauge(Counter):
+    """Value that can go up and down (in-flight requests and the like)."""
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount: float = 1):
+        self.inc(*labelvalues, amount=-amount)
+
+class Histogram(_Metric):
+    """Cumulative bucketed observations per label set, plus their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = self.header()
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Registry:
+    """Holds metrics plus collectors that report existing stats() snapshots at scrape time."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[str, str, Callable[[], dict]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, name: str, documentation: str, stats: Callable[[], dict]):
+        """Exposes every numeric field of `stats()` as `<name>_<field>` gauges."""
+        self._collectors.append((METRICS_PREFIX + name, documentation, stats))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, documentation, stats in self._collectors:
+            try:
+                snapshot = stats()
+            except Exception as e:
+                logger.error(f"Metrics: could not collect {name}: {e}")
+                continue
+            for field, value in _numeric_fields(snapshot):
+                lines.append(f"# HELP {name}_{field} {documentation} ({field.replace('_', ' ')})")
+                lines.append(f"# TYPE {name}_{field} gauge")
+                lines.append(f"{name}_{field} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def _numeric_fields(snapshot: dict, prefix: str = "") -> Iterable[Tuple[str, float]]:
+    for key, value in snapshot.items():
+        if isinstance(value, bool):
+            yield prefix + key, int(value)
+        elif isinstance(value, (int, float)):
+            yield prefix + key, value
+        elif isinstance(value, dict):
+            yield from _numeric_fields(value, f"{prefix}{key}_")
+
+registry = Registry()
+
+# --- HTTP ---
+http_requests_in_flight = registry.register(Gauge("http_requests_in_flight", "Requests being handled", ("method",)))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time until the last response byte was sent", ("method", "route", "status")
+))
+http_request_bytes = registry.register(Counter("http_request_bytes_total", "Request body bytes received", ("route",)))
+http_response_bytes = registry.register(Counter("http_response_bytes_total", "Response body bytes sent", ("route",)))
+
+# --- Database ---
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "Driver time per statement, by calling function", ("call_site",)
+))
+db_query_errors = registry.register(Counter("db_query_errors_total", "Statements that raised", ("call_site",)))
+db_checkout_wait = registry.register(Histogram("db_checkout_wait_seconds", "Time waiting for a pooled connection"))
+db_connect_duration = registry.register(Histogram("db_connect_duration_seconds", "Time to open a new DB connection"))
+
+# --- Text extraction ---
+extraction_duration = registry.register(Histogram(
+    "text_extraction_duration_seconds", "Time to extract the text of one file on a cache miss", ("mode",)
+))
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>" # Raw paths would explode label cardinality
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording in-flight requests, latency and body bytes per
+    route template. Timing stops at the last body chunk, so streamed downloads
+    and exports are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        started = time.perf_counter()
+        counts = {"in": 0, "out": 0, "status": 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                counts["in"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                counts["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                counts["out"] += len(message.get("body", b""))
+            await send(message)
+
+        http_requests_in_flight.inc(method)
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            http_requests_in_flight.dec(method)
+            route = _route_label(scope) # Set by the router on the shared scope dict
+            http_request_duration.observe(time.perf_counter() - started, method, route, str(counts["status"]))
+            if counts["in"]:
+                http_request_bytes.inc(route, amount=counts["in"])
+            if counts["out"]:
+                http_response_bytes.inc(route, amount=counts["out"])
+
+_call_sites: Dict[object, str] = {}
+
+def call_site(depth: int = 2) -> str:
+    """Returns `module:function` of the frame `depth` levels above the caller, cached per code object."""
+    frame = sys._getframe(depth)
+    site = _call_sites.get(frame.f_code)
+    if site is None:
+        site = _call_sites[frame.f_code] = f"{frame.f_globals.get('__name__')}:{frame.f_code.co_name}"
+    return site
+
+# --- Endpoint ---
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus scrape target."""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token.")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
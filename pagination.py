@@ -0,0 +1,42 @@
+# pagination.py
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence
+from fastapi import HTTPException, status
+
+# List endpoints return plain JSON arrays, so their next-page cursor travels in this header
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values: Sequence) -> str:
+    """Encodes the sort key of the last row of a page into an opaque cursor string."""
+    raw = json.dumps(
+        [v.isoformat() if isinstance(v, datetime) else v for v in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, types: Sequence[Callable]) -> List:
+    """
+    Decodes a cursor produced by encode_cursor, converting each value with the
+    matching callable in `types` (e.g. (datetime.fromisoformat, int)).
+    Raises a 400 HTTPException for malformed cursors.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("wrong number of cursor values")
+        return [convert(value) for convert, value in zip(types, values)]
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor.",
+        )
+
+def next_cursor(rows: List[dict], limit: int, key: Callable[[dict], Sequence]) -> Optional[str]:
+    """Returns the cursor for the page after `rows`, or None if this was the last page."""
+    if not rows or len(rows) < limit:
+        return None
+    return encode_cursor(key(rows[-1]))
@@ -0,0 +1,42 @@
+# tests/test_export.py
+# Run with: python -m unittest discover tests
+import io
+import os
+import random
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from documents import export
+
+def _compressed_size(data: bytes) -> int:
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        return archive.getinfo("sample.txt").compress_size
+
+class ExportCompressLevelTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        words = [f"term{n}" for n in range(400)]
+        handle, self.path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(handle, "w") as f:
+            f.write(" ".join(rng.choice(words) for _ in range(200_000)))
+        self.addCleanup(os.remove, self.path)
+
+    def _export(self, level: int) -> bytes:
+        with mock.patch.object(export, "EXPORT_COMPRESSLEVEL", level):
+            return b"".join(export.iter_zip([{"arcname": "sample.txt", "file_path": self.path}]))
+
+    def test_compresslevel_changes_entry_size(self):
+        fast, best = self._export(1), self._export(9)
+        self.assertGreater(_compressed_size(fast), _compressed_size(best))
+
+    def test_level_zero_stores_entries(self):
+        with zipfile.ZipFile(io.BytesIO(self._export(0))) as archive:
+            info = archive.getinfo("sample.txt")
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(info.compress_size, os.path.getsize(self.path))
+            self.assertEqual(archive.testzip(), None)
+
+if __name__ == "__main__":
+    unittest.main()
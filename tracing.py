@@ -0,0 +1,291 @@
+# tracing.py
+# Request-scoped tracing. TracingMiddleware opens a root span per request
+# (continuing an incoming W3C `traceparent` when there is one), `span()` and
+# `traced()` open child spans around auth, DB statements, file I/O and text
+# extraction, and finished spans are handed to a background exporter thread.
+#
+#   TRACE_EXPORTER=none  tracing off (default): span() is a no-op
+#   TRACE_EXPORTER=file  one JSON object per span appended to TRACE_FILE
+#   TRACE_EXPORTER=otlp  OTLP/HTTP JSON batches POSTed to TRACE_OTLP_ENDPOINT
+#                        (an OpenTelemetry collector, Jaeger, Tempo, ...)
+#
+# Spans only exist inside a sampled request, so code running outside one
+# (job workers, CLIs) pays a single context-variable lookup per span.
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower() # none, file or otlp
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "docuvault-api")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0)) # Fraction of new traces recorded
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", 10000)) # Finished spans buffered before new ones are dropped
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", 2.0)) # Seconds between exporter flushes
+TRACE_EXPORT_BATCH = 512 # Spans per file write / OTLP request
+
+TRACING_ENABLED = TRACE_EXPORTER in ("file", "otlp")
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+class Span:
+    """One timed operation within a trace."""
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Optional[Dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_error(self, exc: BaseException):
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def finish(self):
+        self.end_ns = time.time_ns()
+        _exporter.submit(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None else 1, # SERVER for roots, INTERNAL otherwise
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict] = None):
+    """Times the enclosed block as a child of the current span. Yields None when not tracing."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace_id, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+
+def traced(name: str):
+    """Decorator wrapping every call of a sync or async function in `span(name)`."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class _SpanExporter:
+    """Background thread writing finished spans in batches; drops spans rather than blocking callers."""
+
+    def __init__(self, exporter: str):
+        self.exporter = exporter
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, finished: Span):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = self._drain(timeout=TRACE_EXPORT_INTERVAL)
+            if batch:
+                self._export(batch)
+
+    def _drain(self, timeout: Optional[float]) -> List[Span]:
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait())
+            while len(batch) < TRACE_EXPORT_BATCH:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def flush(self):
+        """Exports whatever is queued (called at exit)."""
+        while True:
+            batch = self._drain(timeout=None)
+            if not batch:
+                return
+            self._export(batch)
+
+    def _export(self, batch: List[Span]):
+        try:
+            if self.exporter == "otlp":
+                self._post_otlp(batch)
+            else:
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(item.to_dict(), default=str) + "\n" for item in batch))
+            self.exported += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning(f"Could not export {len(batch)} spans via {self.exporter}: {e}")
+
+    def _post_otlp(self, batch: List[Span]):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "docuvault"}, "spans": [item.to_otlp() for item in batch]}],
+            }]
+        }
+        request = urllib.request.Request(
+            TRACE_OTLP_ENDPOINT,
+            data=json.dumps(body, default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+_exporter = _SpanExporter(TRACE_EXPORTER)
+
+def tracing_stats() -> dict:
+    return _exporter.stats()
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening the root span of each sampled request. The span
+    is named after the matched route template and records the method, status
+    and request id (so traces and logs can be joined).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        trace_id, parent_id, sampled = self._incoming_context(scope)
+        if not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        from logging_config import request_id_var
+
+        root = Span(f"{scope['method']} {scope['path']}", trace_id, parent_id, {"http.method": scope["method"]})
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException as e:
+            root.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                root.name = f"{scope['method']} {route}"
+                root.set_attribute("http.route", route)
+            root.set_attribute("http.status_code", status_code)
+            root.set_attribute("request_id", request_id_var.get())
+            root.finish()
+
+    @staticmethod
+    def _incoming_context(scope):
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                match = _TRACEPARENT.match(value.decode("latin-1").strip())
+                if match:
+                    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+                break
+        return f"{random.getrandbits(128):032x}", None, random.random() < TRACE_SAMPLE_RATE
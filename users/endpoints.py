@@ -1,11 +1,14 @@
 # users/endpoints.py
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import logging
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 import mysql.connector
-from typing import List
-from database import get_db
+from typing import List, Optional
+from database import get_async_db
+from pagination import NEXT_CURSOR_HEADER, decode_cursor, next_cursor
 from users.models import UserCreate, UserInDB
-from auth import get_password_hash, get_current_user, require_role, UserInDB
-import traceback
+from auth import get_password_hash_async, get_current_user, invalidate_user, require_role, UserInDB
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/users",
@@ -22,31 +25,33 @@ async def create_user(user: UserCreate):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Role must be 'user' or 'recruiter'",
         )
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password) # Off the event loop; 503 when saturated
     try:
-        with get_db() as (db, cursor):
-            cursor.execute("SELECT id FROM users WHERE username = %s", (user.username,))
-            if cursor.fetchone():
+        async with get_async_db() as (db, cursor):
+            await cursor.execute("SELECT id FROM users WHERE username = %s", (user.username,))
+            if await cursor.fetchone():
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Username already registered",
                 )
-            cursor.execute(
+            await cursor.execute(
                 "INSERT INTO users (username, password, role) VALUES (%s, %s, %s)",
                 (user.username, hashed_password, user.role), # Use provided role
             )
             user_id = cursor.lastrowid
             if not user_id:
                 raise Exception("Failed to get ID for new user.")
-            cursor.execute("SELECT id, username, role FROM users WHERE id = %s", (user_id,))
-            new_user_data = cursor.fetchone()
+            await cursor.execute("SELECT id, username, role FROM users WHERE id = %s", (user_id,))
+            new_user_data = await cursor.fetchone()
             if not new_user_data:
                 raise Exception("Failed to fetch newly created user data.")
 
-            return UserInDB(**new_user_data)
+        # A deleted user's name can be registered again: drop anything cached for the old account
+        invalidate_user(user.username)
+        return UserInDB(**new_user_data)
 
     except mysql.connector.Error as e:
-        print(f"DB Error during signup for user {user.username}: {e}")
+        logger.error(f"DB Error during signup for user {user.username}: {e}")
         if e.errno == 1062: # MySQL error code for duplicate entry
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -58,8 +63,7 @@ async def create_user(user: UserCreate):
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Unexpected error during signup for user {user.username}: {e}")
-        traceback.print_exc()
+        logger.exception(f"Unexpected error during signup for user {user.username}: {e}")
         raise HTTPException(
             status_code=500, detail="An unexpected error occurred during signup."
         )
@@ -74,33 +78,45 @@ async def read_users_me(current_user: UserInDB = Depends(get_current_user)):
 # This endpoint is restricted to users with the 'recruiter' role.
 @router.get("/", response_model=List[UserInDB])
 async def get_all_users(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header; replaces skip"),
     current_user: UserInDB = Depends(require_role(["recruiter"])) # Restrict to recruiters
 ):
     """
-    Retrieves a list of all users with the 'user' role (Applicants).
+    Retrieves a list of all users with the 'user' role (Applicants), ordered by username.
     This endpoint is only accessible by users with the 'recruiter' role.
     Can be used by recruiters to see the list of applicants (users).
+    The cursor for the next page is returned in the X-Next-Cursor header.
     """
+    if cursor:
+        # Keyset pagination on (username, id) via the (role, username, id) index
+        last_username, last_id = decode_cursor(cursor, (str, int))
+        page_sql = "AND (username > %s OR (username = %s AND id > %s)) ORDER BY username, id LIMIT %s"
+        page_params = (last_username, last_username, last_id, limit)
+    else:
+        page_sql = "ORDER BY username, id LIMIT %s OFFSET %s"
+        page_params = (limit, skip)
     try:
-        with get_db() as (db, cursor):
+        async with get_async_db() as (db, db_cursor):
             # FIX: Ensure WHERE clause filters for role = 'user'
-            query = """
+            query = f"""
                 SELECT id, username, role
                 FROM users
                 WHERE role = 'user' -- Explicitly filter for 'user' role
-                ORDER BY username
-                LIMIT %s OFFSET %s
+                {page_sql}
             """
-            cursor.execute(query, (limit, skip))
-            users_data = cursor.fetchall()
+            await db_cursor.execute(query, page_params)
+            users_data = await db_cursor.fetchall()
+            users_cursor = next_cursor(users_data, limit, lambda user: (user["username"], user["id"]))
+            if users_cursor:
+                response.headers[NEXT_CURSOR_HEADER] = users_cursor
             # Convert fetched data (dictionaries) to UserInDB models
             return [UserInDB(**user_data) for user_data in users_data]
     except mysql.connector.Error as e:
-        print(f"DB Error fetching all users for recruiter {current_user.id}: {e}")
+        logger.error(f"DB Error fetching all users for recruiter {current_user.id}: {e}")
         raise HTTPException(status_code=500, detail="Database error fetching users.")
     except Exception as e:
-        print(f"Error fetching all users for recruiter {current_user.id}: {e}")
-        traceback.print_exc()
+        logger.exception(f"Error fetching all users for recruiter {current_user.id}: {e}")
         raise HTTPException(status_code=500, detail="Server error fetching users.")